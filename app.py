@@ -15,6 +15,7 @@ db = SQLAlchemy(app)
 CORS(app)
 
 from application.views import *
+from application.commands import *
 
 
 @app.errorhandler(Exception)
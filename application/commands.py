@@ -0,0 +1,125 @@
+import json
+from datetime import date
+
+import click
+
+from app import app
+from application.repositories.persistence.replicas import check_replicas
+from application.services.partition_service import PartitionService
+from application.tasks.benchmark_tasks import benchmark_auth, benchmark_serializers
+from application.tasks.job_tasks import run_job_workers
+from application.tasks.query_plan_tasks import check_query_plans
+from application.tasks.reconciliation_tasks import reconcile_balances, backfill_balance_snapshots
+from application.tasks.settlement_workers import run_settlement_workers, run_settlement_consumers
+from settings import (
+    SETTLEMENT_BATCH_SIZE, SETTLEMENT_POLL_INTERVAL, SETTLEMENT_WORKERS, SETTLEMENT_MICRO_BATCH_SIZE, JOB_WORKERS,
+    TRANSACTIONS_PARTITIONS_AHEAD, TRANSACTIONS_RETENTION_MONTHS,
+)
+
+
+@app.cli.command("settlement-workers")
+@click.option("--workers", "-w", default=SETTLEMENT_WORKERS, show_default=True, help="Number of settlement processes.")
+@click.option("--batch-size", default=SETTLEMENT_BATCH_SIZE, show_default=True, help="Transactions claimed per batch.")
+@click.option("--poll-interval", default=SETTLEMENT_POLL_INTERVAL, show_default=True, help="Seconds to wait when the queue is empty.")
+@click.option("--drain", is_flag=True, help="Exit once there are no CREATED transactions left.")
+def settlement_workers(workers: int, batch_size: int, poll_interval: float, drain: bool):
+    run_settlement_workers(workers=workers, batch_size=batch_size, poll_interval=poll_interval, drain=drain)
+
+
+@app.cli.command("settlement-consumers")
+@click.option("--workers", "-w", default=SETTLEMENT_WORKERS, show_default=True, help="Number of consumer processes.")
+@click.option("--batch-size", default=SETTLEMENT_MICRO_BATCH_SIZE, show_default=True, help="Events settled per micro-batch.")
+def settlement_consumers(workers: int, batch_size: int):
+    run_settlement_consumers(workers=workers, batch_size=batch_size)
+
+
+@app.cli.command("job-workers")
+@click.option("--workers", "-w", default=JOB_WORKERS, show_default=True, help="Number of job processes.")
+def job_workers(workers: int):
+    run_job_workers(workers=workers)
+
+
+@app.cli.command("explain-queries")
+def explain_queries():
+    """Fails when a repository query shape falls back to a sequential scan."""
+    failures = check_query_plans()
+    for name, tables in failures.items():
+        click.echo("{:<25} {}".format(name, "seq scan on " + ", ".join(tables) if tables else "ok"))
+    if any(failures.values()):
+        raise SystemExit(1)
+
+
+@app.cli.command("bench-auth")
+@click.option("--iterations", "-n", default=1000, show_default=True)
+def bench_auth(iterations: int):
+    """p50/p99 of token validation per request."""
+    for name, result in benchmark_auth(iterations=iterations).items():
+        click.echo("{:<12} p50={p50_ms}ms p99={p99_ms}ms".format(name, **result))
+
+
+@app.cli.command("bench-serializers")
+@click.option("--iterations", "-n", default=5, show_default=True)
+def bench_serializers(iterations: int):
+    """marshmallow vs compiled serializer on /movements/ bodies of 10, 1k and 100k rows."""
+    for size, result in benchmark_serializers(iterations=iterations).items():
+        click.echo("{:>7} rows marshmallow={marshmallow_ms}ms serializer={serializer_ms}ms".format(size, **result))
+
+
+@app.cli.command("reconcile")
+@click.option("--full", is_flag=True, help="Recompute every balance instead of starting from the last checkpoint.")
+def reconcile(full: bool):
+    """Prints every account whose total doesn't match its transactions (one json per line)."""
+    data = reconcile_balances(
+        full=full,
+        on_mismatch=lambda mismatch: click.echo(json.dumps(mismatch, default=str)),
+    )
+    click.echo(json.dumps(data), err=True)
+    if data["mismatches"]:
+        raise SystemExit(1)
+
+
+@app.cli.command("backfill-snapshots")
+def backfill_snapshots():
+    """Builds the daily balance snapshots of the days settled before snapshots were recorded."""
+    click.echo(json.dumps(backfill_balance_snapshots()))
+
+
+@app.cli.command("replica-status")
+def replica_status():
+    """Checks every configured replica is reachable, in recovery and how far behind it is."""
+    for bind_key, status in check_replicas().items():
+        click.echo("{:<12} {}".format(bind_key, status))
+
+
+def _month(value: str) -> date:
+    return date.fromisoformat(value + "-01")
+
+
+@app.cli.group("partitions")
+def partitions():
+    """Monthly partitions of the transactions table (TRANSACTIONS_PARTITIONED)."""
+
+
+@partitions.command("list")
+def partitions_list():
+    for month in PartitionService().list_partitions():
+        click.echo(month.strftime("%Y-%m"))
+
+
+@partitions.command("ensure")
+@click.option("--ahead", default=TRANSACTIONS_PARTITIONS_AHEAD, show_default=True, help="Months created ahead of the current one.")
+@click.option("--since", default=None, help="First month to create (YYYY-MM), the current one by default.")
+def partitions_ensure(ahead: int, since: str):
+    """Creates the missing partitions, run it at least monthly."""
+    for name in PartitionService().ensure(ahead=ahead, since=_month(since) if since else None):
+        click.echo(name)
+
+
+@partitions.command("rotate")
+@click.option("--retention", default=TRANSACTIONS_RETENTION_MONTHS, show_default=True, help="Months kept attached.")
+@click.option("--ahead", default=TRANSACTIONS_PARTITIONS_AHEAD, show_default=True, help="Months created ahead of the current one.")
+def partitions_rotate(retention: int, ahead: int):
+    """Creates the upcoming partitions and moves the ones past the retention to the archive schema."""
+    data = PartitionService().rotate(ahead=ahead, retention_months=retention)
+    for name in data["archived"]:
+        click.echo("archived {}".format(name))
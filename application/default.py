@@ -27,3 +27,10 @@ class OperationStatus(Enum):
     CANCELLED = "cancelled"  # cancelled by the user
     FAILED = "failed"  # failed while was trying to operate
     DONE = "done"  # finally impacted the balance -> Account
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"  # waiting for a worker
+    RUNNING = "running"  # taken by a worker
+    DONE = "done"  # finished, result available
+    FAILED = "failed"  # raised an error, see error
@@ -0,0 +1,50 @@
+import hashlib
+
+from flask import request, jsonify, g, make_response, Response
+from functools import wraps
+
+from application.services.idempotency_service import IdempotencyService
+
+idempotency_service = IdempotencyService()
+
+
+def idempotent(f):
+    """
+    Honors the Idempotency-Key header: the first request with a key runs and its response is stored, retries
+    with the same key get the stored response back without running the view again. Must be applied after
+    token_required, keys are scoped per user and path. A key reused with another body is answered 422, one
+    still running 409; a request failing (exception or 5xx) gives its key back for the retry.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+
+        scope = f"{g.user_id}:{request.path}"
+        body_hash = hashlib.sha256(request.get_data()).hexdigest()
+        is_reserved, stored = idempotency_service.reserve(scope=scope, key=key, body_hash=body_hash)
+        if not is_reserved:
+            if stored is not None and stored["body_hash"] != body_hash:
+                return jsonify({"status": "failure", "message": "Idempotency-Key already used for another request"}), 422
+            if stored is None or "status_code" not in stored:
+                return jsonify({"status": "failure", "message": "Request with this Idempotency-Key in progress"}), 409
+            return Response(
+                stored["body"], status=stored["status_code"], mimetype="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            idempotency_service.release(scope=scope, key=key)
+            raise
+        if response.status_code >= 500:
+            idempotency_service.release(scope=scope, key=key)
+        else:
+            idempotency_service.store(
+                scope=scope, key=key, body_hash=body_hash, body=response.get_data(as_text=True),
+                status_code=response.status_code,
+            )
+        return response
+    return decorated_function
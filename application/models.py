@@ -1,8 +1,8 @@
 from sqlalchemy import (
-    Column, Integer, String, ForeignKey, Float, DateTime, Boolean,
+    Column, Integer, String, ForeignKey, Numeric, Date, DateTime, Boolean,
     Index, CheckConstraint, Enum
 )
-from sqlalchemy import event
+from sqlalchemy import event, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, validates
@@ -11,6 +11,8 @@ from uuid import uuid4
 
 from app import db
 from application.default import OperationType, UserStatus, AccountStatus, OperationStatus
+from application.money import MONEY_PRECISION, MONEY_SCALE
+from settings import TRANSACTIONS_PARTITIONED
 
 
 class TimestampMixin:
@@ -32,6 +34,10 @@ class Currency(db.Model, TimestampMixin):
 
     name = Column(String, primary_key=True, unique=True)
 
+    __table_args__ = (
+        Index('ix_currencies_last_updated_name', 'last_updated', 'name'),
+    )
+
 
 class User(db.Model, TimestampMixin):
     __tablename__ = 'users'
@@ -46,6 +52,15 @@ class User(db.Model, TimestampMixin):
 
     accounts = relationship('Account', backref='user', lazy='dynamic')
 
+    __table_args__ = (
+        Index('ix_users_last_updated_id', 'last_updated', 'id'),
+        # users waiting for validation
+        Index(
+            'ix_users_created_last_updated', 'last_updated',
+            postgresql_where=text(f"status = '{UserStatus.CREATED.name}'"),
+        ),
+    )
+
 
 class Account(db.Model, TimestampMixin):
     __tablename__ = 'accounts'
@@ -55,10 +70,17 @@ class Account(db.Model, TimestampMixin):
     user_id = Column(UUID, ForeignKey('users.id'), nullable=False)
     status = Column(Enum(AccountStatus), nullable=False, default=AccountStatus.CREATED)
     currency_name = Column(String, ForeignKey('currencies.name'), nullable=False)
-    total = Column(Float, nullable=False, default=0.0)
+    total = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False, default=0)
 
     __table_args__ = (
         CheckConstraint('total >= 0', name='check_total_positive'),
+        Index('ix_accounts_last_updated_id', 'last_updated', 'id'),
+        Index('ix_accounts_user_id_last_updated', 'user_id', 'last_updated', 'id'),
+        # accounts waiting for validation
+        Index(
+            'ix_accounts_created_last_updated', 'last_updated',
+            postgresql_where=text(f"status = '{AccountStatus.CREATED.name}'"),
+        ),
     )
 
 
@@ -67,8 +89,8 @@ class Transaction(db.Model, TimestampMixin):
 
     id = Column(UUID, primary_key=True)
     linked_transaction_id = Column(UUID, nullable=True)  # intentionally possible could be blank
-    amount = Column(Float, nullable=False)
-    total = Column(Float, nullable=True)
+    amount = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False)
+    total = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=True)
     operation = Column(Enum(OperationType), nullable=False)
     operation_status = Column(Enum(OperationStatus), nullable=False, default=OperationStatus.CREATED)
     origin_account_id = Column(UUID, ForeignKey('accounts.id'), nullable=False)
@@ -77,6 +99,68 @@ class Transaction(db.Model, TimestampMixin):
     user_id = Column(UUID, ForeignKey('users.id'), nullable=False)
     reference = Column(String, nullable=True)
 
+    if TRANSACTIONS_PARTITIONED:
+        # postgres wants the partition key in the primary key of a partitioned table, the mapper keeps
+        # identifying rows by id alone
+        created_at = Column(DateTime, default=func.now(), nullable=False, primary_key=True)
+        __mapper_args__ = {"primary_key": [id]}
+
+    __table_args__ = (
+        Index('ix_transactions_last_updated_id', 'last_updated', 'id'),
+        # movements of a user for a currency, with and without operation_status filter
+        Index('ix_transactions_user_currency_last_updated', 'user_id', 'currency_name', 'last_updated', 'id'),
+        Index(
+            'ix_transactions_user_currency_status_last_updated',
+            'user_id', 'currency_name', 'operation_status', 'last_updated', 'id',
+        ),
+        # settlement queue: only the CREATED rows, so it stays small whatever the size of the table
+        Index(
+            'ix_transactions_created_last_updated', 'last_updated',
+            postgresql_where=text(f"operation_status = '{OperationStatus.CREATED.name}'"),
+        ),
+        # reconciliation tells the two legs of a transfer apart by their order within the link
+        Index('ix_transactions_linked_created_at', 'linked_transaction_id', 'created_at', 'id'),
+        # one partition per month (see PartitionService), queries bounded on created_at only scan the
+        # partitions of that range
+        {"postgresql_partition_by": "RANGE (created_at)"} if TRANSACTIONS_PARTITIONED else {},
+    )
+
+
+class AccountBalanceSnapshot(db.Model, TimestampMixin):
+    """
+    Balance of an account at the end of every day it moved, maintained by settlement. The balance at any
+    date is the closing_total of the last snapshot up to that date.
+    """
+    __tablename__ = 'account_balance_snapshots'
+
+    account_id = Column(UUID, ForeignKey('accounts.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    opening_total = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False)  # before the first movement of the day
+    closing_total = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False)
+    credits = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False, default=0)
+    debits = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False, default=0)
+    movements = Column(Integer, nullable=False, default=0)
+
+
+class LedgerBalance(db.Model, TimestampMixin):
+    """
+    Balance of an account recomputed from its settled transactions up to the watermark of the last
+    reconciliation run, the starting point of the next incremental run.
+    """
+    __tablename__ = 'ledger_balances'
+
+    account_id = Column(UUID, ForeignKey('accounts.id'), primary_key=True)
+    total = Column(Numeric(MONEY_PRECISION, MONEY_SCALE), nullable=False)
+
+
+class ReconciliationRun(db.Model, TimestampMixin):
+    __tablename__ = 'reconciliation_runs'
+
+    id = Column(UUID, primary_key=True)
+    watermark = Column(DateTime, nullable=False, index=True)  # transactions updated up to here are in ledger_balances
+    is_full = Column(Boolean, nullable=False, default=False)
+    accounts = Column(Integer, nullable=False, default=0)
+    mismatches = Column(Integer, nullable=False, default=0)
 
 
 # Event listeners to ensure that created_at and last_updated are always set correctly
@@ -0,0 +1,15 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+MONEY_PRECISION = 18
+MONEY_SCALE = 4
+MONEY_QUANTUM = Decimal(1).scaleb(-MONEY_SCALE)
+
+
+def to_money(value) -> Decimal:
+    """
+    Converts a float/str/Decimal amount to an exact Decimal with MONEY_SCALE decimals (banker's rounding,
+    the same rounding python's round() applies).
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(MONEY_QUANTUM, rounding=ROUND_HALF_EVEN)
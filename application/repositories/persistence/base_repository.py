@@ -1,5 +1,5 @@
 from app import db
-from typing import Optional, Dict, Tuple, Any
+from typing import Optional, Dict, Tuple, Any, List, Iterable, Sequence
 
 
 class BaseRepository:
@@ -28,20 +28,39 @@ class BaseRepository:
         self.model = model
         self.black_list_fields = black_list_fields or self.black_list_fields
 
-    def get(self, key: str, field: str = 'id') -> Optional[db.Model]:
+    def get(self, key: str, field: str = 'id', columns: Sequence[str] = None, readonly: bool = False) -> Optional[db.Model]:
         """
         Retrieves a single record by a given field.
 
         Args:
             key (str): The value to search for.
             field (str, optional): The field to search by. Defaults to 'id'.
+            columns (Sequence[str], optional): only load these columns, a row is returned instead of an entity.
+            readonly (bool, optional): return a row with every column, not tracked by the session.
 
         Returns:
             Optional[db.Model]: The retrieved record or None if not found.
         """
         raise NotImplementedError()
 
-    def get_all(self, filters: Dict[str, Any], limit: int = 10, skip: int = 0) -> Optional[db.Model]:
+    def get_many(self, keys: Iterable[Any], field: str = 'id', columns: Sequence[str] = None,
+                 lock: bool = False) -> List[db.Model]:
+        """
+        Retrieves every record whose field is one of the keys with a single query.
+
+        Args:
+            keys (Iterable[Any]): The values to search for.
+            field (str, optional): The field to search by. Defaults to 'id'.
+            columns (Sequence[str], optional): only load these columns, rows are returned instead of entities.
+            lock (bool, optional): lock the records FOR UPDATE until the transaction ends.
+
+        Returns:
+            List[db.Model]: The retrieved records.
+        """
+        raise NotImplementedError()
+
+    def get_all(self, filters: Dict[str, Any], limit: int = 10, skip: int = 0, cursor: str = None,
+                columns: Sequence[str] = None, readonly: bool = False) -> Optional[db.Model]:
         """
         Retrieves a multiple records by a given field.
 
@@ -50,19 +69,41 @@ class BaseRepository:
             field (str, optional): The field to search by. Defaults to 'id'.
             limit (int): limit of results
             skip (int): offset of results on query
+            cursor (str, optional): keyset cursor of the page, replaces skip
+            columns (Sequence[str], optional): only load these columns, rows are returned instead of entities.
+            readonly (bool, optional): return rows with every column, not tracked by the session.
 
         Returns:
             Optional[db.Model]: The retrieved record or None if not found.
         """
         raise NotImplementedError()
 
-    def get_or_create(self, field: str, data: Dict[str, Any]) -> Tuple[Optional[db.Model], bool]:
+    def claim(self, filters: Dict[str, Any], data: Dict[str, Any], limit: int = 10, order_by: str = 'last_updated',
+              columns: Sequence[str] = None) -> List[db.Model]:
+        """
+        Locks up to `limit` records matching the filters, skipping the ones already locked by someone else,
+        and updates them with the given data in a single statement.
+
+        Args:
+            filters (map): key and value to be filter on
+            data (Dict[str, Any]): The data to update the claimed records with.
+            limit (int): max number of records to claim
+            order_by (str, optional): field used to pick the oldest records first. Defaults to 'last_updated'.
+            columns (Sequence[str], optional): only return these columns, rows are returned instead of entities.
+
+        Returns:
+            List[db.Model]: The claimed records, locked until the current transaction ends.
+        """
+        raise NotImplementedError()
+
+    def get_or_create(self, field: str, data: Dict[str, Any], commit: bool = True) -> Tuple[Optional[db.Model], bool]:
         """
         Retrieves a record by a specified field if it exists, otherwise creates a new one.
 
         Args:
             field (str): The field to use for retrieving the record.
             data (Dict[str, Any]): The data to use for creating the record if it does not exist.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
 
         Returns:
             Tuple[Optional[db.Model], bool]: A tuple containing the retrieved or created record and a boolean indicating
@@ -70,32 +111,77 @@ class BaseRepository:
         """
         raise NotImplementedError()
 
-    def create(self, data: Dict[str, Any]) -> db.Model:
+    def create(self, data: Dict[str, Any], commit: bool = True) -> db.Model:
         """
         Creates a new record with the given data.
 
         Args:
             data (Dict[str, Any]): The data to use for creating the record.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
 
         Returns:
             db.Model: The created record.
         """
         raise NotImplementedError()
 
-    def update(self, data: Dict[str, Any], field: str = 'id') -> db.Model:
+    def create_many(self, items: List[Dict[str, Any]], commit: bool = True) -> List[Any]:
+        """
+        Creates many records with as few statements as possible.
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
+
+        Returns:
+            List[Any]: primary keys of the created records, in the same order as the items.
+        """
+        raise NotImplementedError()
+
+    def update(self, data: Dict[str, Any], field: str = 'id', commit: bool = True) -> db.Model:
         """
         Updates an existing record with the given data.
 
         Args:
             data (Dict[str, Any]): The data to update the record with.
             field (str, optional): The field to search by. Defaults to 'id'.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
 
         Returns:
             db.Model: The updated record.
         """
         raise NotImplementedError()
 
-    def delete(self, key: str, field: str = 'id', is_soft_deleted: bool = True):
+    def update_many(self, items: List[Dict[str, Any]], commit: bool = True) -> int:
+        """
+        Updates many records by primary key without selecting them first.
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record, each one including its primary key.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
+
+        Returns:
+            int: number of records given to update.
+        """
+        raise NotImplementedError()
+
+    def upsert_many(self, items: List[Dict[str, Any]], index_elements: List[str] = None,
+                    update_fields: List[str] = None, commit: bool = True) -> List[Any]:
+        """
+        Inserts many records, updating the ones that already exist.
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record.
+            index_elements (List[str], optional): unique columns identifying an existing record.
+                Defaults to the primary key.
+            update_fields (List[str], optional): fields overwritten on existing records.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
+
+        Returns:
+            List[Any]: primary keys sent for every item.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key: str, field: str = 'id', is_soft_deleted: bool = True, commit: bool = True):
         """
         Deletes a record, either by performing a soft delete or a hard delete.
 
@@ -104,6 +190,7 @@ class BaseRepository:
             field (str, optional): The field to search by. Defaults to 'id'.
             is_soft_deleted (bool, optional): If True, performs a soft delete. Otherwise, performs a hard delete.
                 Defaults to True.
+            commit (bool, optional): If False, only flushes and the caller commits. Defaults to True.
 
         Raises:
             NotImplementedError: This method should be implemented by subclasses.
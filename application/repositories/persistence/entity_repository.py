@@ -1,8 +1,24 @@
-from typing import Optional, Dict, Tuple, Any, List
-from sqlalchemy import select, and_
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Dict, Tuple, Any, List, Iterable, Iterator, NamedTuple, Sequence
+from uuid import uuid4
+from sqlalchemy import select, update, and_, tuple_, literal, func, Select, Update
+from sqlalchemy.dialects.postgresql import insert
 
 from app import db
 from application.repositories.persistence.base_repository import BaseRepository
+from application.repositories.persistence.replicas import execute_read
+from application.repositories.persistence.unit_of_work import in_unit_of_work, record_changes
+
+
+class Range(NamedTuple):
+    """
+    Filter value matching `start <= field < end`, a bound left to None is open. Bounding the partition
+    key (created_at of the transactions) lets postgres skip the partitions out of the range.
+    """
+    start: Any = None
+    end: Any = None
 
 
 class EntityRepository(BaseRepository):
@@ -13,88 +29,351 @@ class EntityRepository(BaseRepository):
     get, get_or_create, create, update, and delete operations.
     """
 
-    def get(self, key: str, field: str = 'id') -> Optional[db.Model]:
+    def _filters_query(self, filters: Dict[str, Any]) -> list:
+        filters_query = []
+        for field, value in filters.items():
+            if hasattr(self.model, field):
+                if isinstance(value, Range):
+                    if value.start is not None:
+                        filters_query.append(getattr(self.model, field) >= value.start)
+                    if value.end is not None:
+                        filters_query.append(getattr(self.model, field) < value.end)
+                elif isinstance(value, (list, tuple, set)):
+                    filters_query.append(getattr(self.model, field).in_(value))
+                else:
+                    filters_query.append(
+                        getattr(self.model, field) == value
+                    )
+        return filters_query
+
+    @property
+    def _primary_key(self):
+        return self.model.__mapper__.primary_key[0]
+
+    def _projection(self, columns: Optional[Sequence[str]], readonly: bool = False,
+                    required: Sequence[str] = ()) -> Optional[list]:
+        """
+        Mapped columns to select instead of the whole entity, None to load entities. `readonly` without
+        columns projects every column, `required` are added when missing (e.g. the keys of the cursor).
+        """
+        if columns is None and not readonly:
+            return None
+        if columns is None:
+            names = [column_attr.key for column_attr in self.model.__mapper__.column_attrs]
+        else:
+            names = list(columns)
+        names.extend(name for name in required if name not in names)
+        return [getattr(self.model, name) for name in names]
+
+    def _select(self, projection: Optional[list]) -> Select:
+        if projection is None:
+            return select(self.model)
+        return select(*projection)
+
+    @staticmethod
+    def _fetch_all(stmt, projection: Optional[list], read: bool = True) -> list:
+        # reads may go to a replica (see replicas.read_replica), locks and writes always run on the primary
+        result = execute_read(stmt) if read else db.session.execute(stmt)
+        if projection is None:
+            return result.scalars().all()
+        return result.all()
+
+    def encode_cursor(self, object_instance: db.Model) -> str:
+        """
+        Builds the opaque cursor pointing right after the given record (keyed on last_updated and primary key).
+        """
+        key = [object_instance.last_updated.isoformat(), str(getattr(object_instance, self._primary_key.key))]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def decode_cursor(self, cursor: str) -> Tuple[datetime, str]:
+        """
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        try:
+            last_updated, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            # a key the column can't hold (not a uuid) would only fail in the database
+            return datetime.fromisoformat(last_updated), self._primary_key.type.python_type(key)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid cursor {cursor}") from e
+
+    def next_cursor(self, results: List[db.Model], limit: int) -> Optional[str]:
+        """
+        Returns the cursor of the following page, None when the given page is the last one.
+        """
+        if not results or len(results) < int(limit):
+            return None
+        return self.encode_cursor(results[-1])
+
+    def get(self, key: str, field: str = 'id', columns: Sequence[str] = None, readonly: bool = False) -> Optional[db.Model]:
         """
         Retrieves a single record by a given field.
 
         Args:
             key (str): The value to search for.
             field (str, optional): The field to search by. Defaults to 'id'.
+            columns (Sequence[str], optional): only load these columns, a row is returned instead of an entity.
+            readonly (bool, optional): return a row with every column, not tracked by the session.
 
         Returns:
             Optional[db.Model]: The retrieved record or None if not found.
         """
+        projection = self._projection(columns, readonly)
+        stmt = self._select(projection).where(getattr(self.model, field) == key)
+        if projection is None:
+            return execute_read(stmt).scalar()
+        return execute_read(stmt).first()
+
+    def _get_for_write(self, key: str, field: str = 'id') -> Optional[db.Model]:
+        # the record about to be written, or just written: always from the primary, a replica may lag behind
         stmt = select(self.model).where(getattr(self.model, field) == key)
-        result = db.session.execute(stmt).scalar()
-        return result
+        return db.session.execute(stmt).scalar()
+
+    def build_get_many_stmt(self, keys: Iterable[Any], field: str = 'id', columns: Sequence[str] = None,
+                            lock: bool = False) -> Select:
+        """
+        Builds the statement run by get_many (also used to check its query plan).
+        """
+        projection = self._projection(columns)
+        stmt = (
+            self._select(projection)
+            .where(getattr(self.model, field).in_(list(keys)))
+            .order_by(self._primary_key)
+        )
+        if lock:
+            stmt = stmt.with_for_update(of=self.model)
+            if projection is None:
+                stmt = stmt.execution_options(populate_existing=True)
+        return stmt
+
+    def get_many(self, keys: Iterable[Any], field: str = 'id', columns: Sequence[str] = None,
+                 lock: bool = False) -> List[db.Model]:
+        """
+        Retrieves every record whose field is one of the keys with a single query, sorted by primary key.
+
+        Args:
+            keys (Iterable[Any]): The values to search for.
+            field (str, optional): The field to search by. Defaults to 'id'.
+            columns (Sequence[str], optional): only load these columns, rows are returned instead of entities.
+            lock (bool, optional): lock the records FOR UPDATE until the transaction ends. The primary key order
+                makes concurrent callers take their locks in the same order, so they never deadlock.
+
+        Returns:
+            List[db.Model]: The retrieved records.
+        """
+        projection = self._projection(columns)
+        stmt = self.build_get_many_stmt(keys=keys, field=field, columns=columns, lock=lock)
+        return self._fetch_all(stmt, projection, read=not lock)
 
-    def get_all(self, filters: Dict[str, Any], limit: int = 10, skip: int = 0) -> List[db.Model]:
+    def _get_all_projection(self, columns: Sequence[str] = None, readonly: bool = False) -> Optional[list]:
+        # rows keep what next_cursor needs
+        return self._projection(columns, readonly, required=('last_updated', self._primary_key.key))
+
+    def build_get_all_stmt(self, filters: Dict[str, Any], limit: int = 10, skip: int = 0, cursor: str = None,
+                           columns: Sequence[str] = None, readonly: bool = False) -> Select:
+        """
+        Builds the statement run by get_all (also used to check its query plan).
+        """
+        filters_query = self._filters_query(filters)
+        stmt = self._select(self._get_all_projection(columns, readonly))
+        if filters_query:
+            stmt = stmt.where(and_(*filters_query))
+        primary_key = self._primary_key
+        if cursor:
+            last_updated, key = self.decode_cursor(cursor)
+            stmt = stmt.where(
+                tuple_(self.model.last_updated, primary_key) < tuple_(
+                    literal(last_updated, self.model.last_updated.type), literal(key, primary_key.type)
+                )
+            )
+        else:
+            stmt = stmt.offset(skip)
+        return stmt.order_by(self.model.last_updated.desc(), primary_key.desc()).limit(limit)
+
+    def get_all(self, filters: Dict[str, Any], limit: int = 10, skip: int = 0, cursor: str = None,
+                columns: Sequence[str] = None, readonly: bool = False) -> List[db.Model]:
         """
         Retrieves a multiple records by a given field.
 
         Args:
             filters (map): key and value to be filter on
             limit (int): limit of results
-            skip (int): offset of results on query
+            skip (int): offset of results on query, ignored when a cursor is given
+            cursor (str, optional): opaque cursor returned by next_cursor, seeks straight to the next page
+                instead of scanning and discarding `skip` rows.
+            columns (Sequence[str], optional): only load these columns (plus last_updated and the primary key),
+                rows are returned instead of entities.
+            readonly (bool, optional): return rows with every column, not tracked by the session.
 
         Returns:
             Optional[db.Model]: The retrieved record or None if not found.
         """
-        filters_query = []
-        for field, value in filters.items():
-            if hasattr(self.model, field):
-                filters_query.append(
-                    getattr(self.model, field) == value
-                )
-        if filters_query:
-            stmt = select(self.model).where(and_(*filters_query))
+        stmt = self.build_get_all_stmt(
+            filters=filters, limit=limit, skip=skip, cursor=cursor, columns=columns, readonly=readonly
+        )
+        return self._fetch_all(stmt, self._get_all_projection(columns, readonly))
+
+    def iterate(self, filters: Dict[str, Any], yield_per: int = 1000, columns: Sequence[str] = None,
+                readonly: bool = False) -> Iterator[db.Model]:
+        """
+        Iterates every record matching the filters (newest first) through a server side cursor, fetching
+        `yield_per` rows at a time so memory stays flat whatever the number of rows.
+
+        Args:
+            filters (map): key and value to be filter on
+            yield_per (int): rows fetched from the cursor on each round trip
+            columns (Sequence[str], optional): only load these columns, rows are returned instead of entities.
+            readonly (bool, optional): return rows with every column, not tracked by the session.
+
+        Returns:
+            Iterator[db.Model]: The matching records.
+        """
+        projection = self._projection(columns, readonly)
+        stmt = (
+            self._select(projection)
+            .where(*self._filters_query(filters))
+            .order_by(self.model.last_updated.desc(), self._primary_key.desc())
+            .execution_options(yield_per=yield_per)
+        )
+        result = execute_read(stmt)
+        if projection is None:
+            result = result.scalars()
+        for object_instance in result:
+            yield object_instance
+
+    def build_claim_stmt(self, filters: Dict[str, Any], data: Dict[str, Any], limit: int = 10,
+                         order_by: str = 'last_updated', columns: Sequence[str] = None) -> Update:
+        """
+        Builds the statement run by claim (also used to check its query plan).
+        """
+        projection = self._projection(columns)
+        primary_key = self._primary_key
+        subquery = (
+            select(primary_key)
+            .where(*self._filters_query(filters))
+            .order_by(getattr(self.model, order_by).asc())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return (
+            update(self.model)
+            .where(primary_key.in_(subquery))
+            .values(**data)
+            .returning(*(projection or [self.model]))
+            .execution_options(synchronize_session=False)
+        )
+
+    def claim(self, filters: Dict[str, Any], data: Dict[str, Any], limit: int = 10, order_by: str = 'last_updated',
+              columns: Sequence[str] = None) -> List[db.Model]:
+        """
+        Locks up to `limit` records matching the filters, skipping the ones already locked by someone else,
+        and updates them with the given data in a single statement.
+
+        Concurrent callers never receive the same record: rows stay locked until the current transaction
+        ends, so the caller is responsible for committing (or rolling back to release them).
+
+        Args:
+            filters (map): key and value to be filter on
+            data (Dict[str, Any]): The data to update the claimed records with.
+            limit (int): max number of records to claim
+            order_by (str, optional): field used to pick the oldest records first. Defaults to 'last_updated'.
+            columns (Sequence[str], optional): only return these columns, rows are returned instead of entities.
+
+        Returns:
+            List[db.Model]: The claimed records.
+        """
+        stmt = self.build_claim_stmt(filters=filters, data=data, limit=limit, order_by=order_by, columns=columns)
+        records = self._fetch_all(stmt, self._projection(columns), read=False)
+        self._record_changes(records)
+        return records
+
+    def _record_changes(self, records: Iterable[Any]):
+        # records or rows of a projection, the ones without the primary key can't be told apart
+        primary_key = self._primary_key.key
+        record_changes(self.model, (
+            getattr(record, primary_key) for record in records if getattr(record, primary_key, None) is not None
+        ))
+
+    def _commit(self, commit: bool = True):
+        # inside a unit of work (or with commit=False) only flush, the caller owns the transaction
+        if commit and not in_unit_of_work():
+            db.session.commit()
         else:
-            stmt = select(self.model)
-        stmt = stmt.order_by(self.model.last_updated.desc()).limit(limit).offset(skip)
-        results = db.session.execute(stmt).scalars().all()
-        return results
+            db.session.flush()
+
+    def _with_primary_key(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # bulk statements skip the before_insert listener that generates ids
+        primary_key = self._primary_key
+        if primary_key.key == 'id' and data.get('id') is None:
+            return {**data, 'id': str(uuid4())}
+        return data
 
-    def get_or_create(self, field: str, data: Dict[str, Any]) -> Tuple[Optional[db.Model], bool]:
+    def get_or_create(self, field: str, data: Dict[str, Any], commit: bool = True) -> Tuple[Optional[db.Model], bool]:
         """
         Retrieves a record by a specified field if it exists, otherwise creates a new one.
 
+        The insert is an INSERT ... ON CONFLICT DO NOTHING, so two concurrent calls can't both create the
+        record (`field` must be unique).
+
         Args:
             field (str): The field to use for retrieving the record.
             data (Dict[str, Any]): The data to use for creating the record if it does not exist.
+            commit (bool, optional): If False, only flushes. Defaults to True.
 
         Returns:
             Tuple[Optional[db.Model], bool]: A tuple containing the retrieved or created record and a boolean indicating
             whether the record was created (True) or retrieved (False).
         """
-        object_instance = self.get(key=data[field], field=field)
-        is_created = False
-        if object_instance is None:
-            object_instance = self.create(data)
-            is_created = True
-        return object_instance, is_created
+        object_instance = self._get_for_write(key=data[field], field=field)
+        if object_instance is not None:
+            return object_instance, False
+
+        stmt = insert(self.model).values(**self._with_primary_key(data)).on_conflict_do_nothing(index_elements=[field])
+        is_created = db.session.execute(stmt).rowcount == 1
+        self._commit(commit)
+        return self._get_for_write(key=data[field], field=field), is_created
 
-    def create(self, data: Dict[str, Any]) -> db.Model:
+    def create(self, data: Dict[str, Any], commit: bool = True) -> db.Model:
         """
         Creates a new record with the given data.
 
         Args:
             data (Dict[str, Any]): The data to use for creating the record.
+            commit (bool, optional): If False, only flushes. Defaults to True.
 
         Returns:
             db.Model: The created record.
         """
         object_instance = self.model(**data)
         db.session.add(object_instance)
-        db.session.commit()
+        self._commit(commit)
         return object_instance
 
-    def update(self, data: Dict[str, Any], field: str = 'id') -> db.Model:
+    def create_many(self, items: List[Dict[str, Any]], commit: bool = True) -> List[Any]:
+        """
+        Creates many records at once, SQLAlchemy packs them into multi-row INSERT statements.
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record.
+            commit (bool, optional): If False, only flushes. Defaults to True.
+
+        Returns:
+            List[Any]: primary keys of the created records, in the same order as the items.
+        """
+        rows = [self._with_primary_key(item) for item in items]
+        if rows:
+            db.session.execute(insert(self.model), rows)
+            self._commit(commit)
+        return [row[self._primary_key.key] for row in rows]
+
+    def update(self, data: Dict[str, Any], field: str = 'id', commit: bool = True) -> db.Model:
         """
         Updates an existing record with the given data.
 
         Args:
             data (Dict[str, Any]): The data to update the record with.
             field (str, optional): The field to search by. Defaults to 'id'.
+            commit (bool, optional): If False, only flushes. Defaults to True.
 
         Returns:
             db.Model: The updated record.
@@ -102,7 +381,7 @@ class EntityRepository(BaseRepository):
         Raises:
             ValueError: If the record is not found.
         """
-        object_instance = self.get(key=data[field], field=field)
+        object_instance = self._get_for_write(key=data[field], field=field)
         if object_instance is None:
             raise ValueError(f"{self.entity_name} not found for {field}={data[field]}")
 
@@ -111,10 +390,72 @@ class EntityRepository(BaseRepository):
                 setattr(object_instance, field, value)
 
         db.session.add(object_instance)
-        db.session.commit()
+        self._record_changes([object_instance])
+        self._commit(commit)
         return object_instance
 
-    def delete(self, pk: str, field: str = 'id', is_soft_delete: bool = True):
+    def update_many(self, items: List[Dict[str, Any]], commit: bool = True) -> int:
+        """
+        Updates many records by primary key without loading them first (an executemany UPDATE).
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record, each one including its primary key.
+            commit (bool, optional): If False, only flushes. Defaults to True.
+
+        Returns:
+            int: number of records given to update.
+        """
+        primary_key = self._primary_key.key
+        rows = [
+            {
+                field: value for field, value in item.items()
+                if field == primary_key or (hasattr(self.model, field) and field not in self.black_list_fields)
+            }
+            for item in items
+        ]
+        if rows:
+            db.session.execute(update(self.model), rows)
+            record_changes(self.model, (row[primary_key] for row in rows))
+            self._commit(commit)
+        return len(rows)
+
+    def upsert_many(self, items: List[Dict[str, Any]], index_elements: List[str] = None,
+                    update_fields: List[str] = None, commit: bool = True) -> List[Any]:
+        """
+        Inserts many records, updating the ones that already exist (INSERT ... ON CONFLICT DO UPDATE).
+
+        Args:
+            items (List[Dict[str, Any]]): The data of every record, all with the same fields.
+            index_elements (List[str], optional): unique columns identifying a conflict. Defaults to the primary key.
+            update_fields (List[str], optional): fields overwritten on conflict. Defaults to every given field
+                except the conflict columns and the black listed ones.
+            commit (bool, optional): If False, only flushes. Defaults to True.
+
+        Returns:
+            List[Any]: primary keys of the stored records, in the same order as the items (an existing record
+            keeps its own when the conflict is not on the primary key).
+        """
+        rows = [self._with_primary_key(item) for item in items]
+        if not rows:
+            return []
+        index_elements = index_elements or [self._primary_key.key]
+        if update_fields is None:
+            update_fields = [
+                field for field in rows[0]
+                if field not in index_elements and field not in self.black_list_fields
+            ]
+        stmt = insert(self.model)
+        set_ = {field: stmt.excluded[field] for field in update_fields}
+        if hasattr(self.model, "last_updated"):
+            set_["last_updated"] = func.now()
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_).returning(
+            getattr(self.model, self._primary_key.key), sort_by_parameter_order=True,
+        )
+        keys = db.session.execute(stmt, rows).scalars().all()
+        self._commit(commit)
+        return keys
+
+    def delete(self, pk: str, field: str = 'id', is_soft_delete: bool = True, commit: bool = True):
         """
         Deletes a record, either by performing a soft delete or a hard delete.
 
@@ -122,16 +463,18 @@ class EntityRepository(BaseRepository):
             pk (str): The value to search for.
             field (str, optional): The field to search by. Defaults to 'id'.
             is_soft_delete (bool, optional): If True, performs a soft delete. Otherwise, performs a hard delete. Defaults to True.
+            commit (bool, optional): If False, only flushes. Defaults to True.
 
         Raises:
             ValueError: If the record is not found for hard delete.
         """
         if is_soft_delete:
             data = {"is_deleted": True, field: pk}
-            self.update(data=data, field=field)
+            self.update(data=data, field=field, commit=commit)
         else:
-            object_instance = self.get(key=pk, field=field)
+            object_instance = self._get_for_write(key=pk, field=field)
             if object_instance is None:
                 raise ValueError(f"{self.entity_name} not found for {field}={pk}")
             db.session.delete(object_instance)
-            db.session.commit()
+            self._record_changes([object_instance])
+            self._commit(commit)
@@ -0,0 +1,123 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Collection, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import app, db
+from application.repositories.persistence.unit_of_work import in_unit_of_work
+from settings import REPLICA_BINDS, REPLICA_RETRY_INTERVAL
+
+READ_REPLICA_DEPTH = "read_replica_depth"
+
+
+class ReplicaRouter:
+    """
+    Picks the replica (a SQLALCHEMY_BINDS key) of the next read, round robin. A replica that fails is left
+    out for `retry_interval` seconds, with none available reads go to the primary.
+    """
+
+    def __init__(self, bind_keys: List[str], retry_interval: float = REPLICA_RETRY_INTERVAL):
+        self.bind_keys = list(bind_keys)
+        self.retry_interval = retry_interval
+        self._counter = itertools.count()
+        self._unhealthy_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, bind_key: str) -> bool:
+        return self._unhealthy_until.get(bind_key, 0) <= time.monotonic()
+
+    def mark_unhealthy(self, bind_key: str):
+        with self._lock:
+            self._unhealthy_until[bind_key] = time.monotonic() + self.retry_interval
+
+    def choose(self, exclude: Collection[str] = ()) -> Optional[str]:
+        if not self.bind_keys:
+            return None
+        start = next(self._counter)
+        for offset in range(len(self.bind_keys)):
+            bind_key = self.bind_keys[(start + offset) % len(self.bind_keys)]
+            if bind_key not in exclude and self.is_healthy(bind_key):
+                return bind_key
+        return None
+
+
+router = ReplicaRouter(REPLICA_BINDS)
+
+
+def reads_from_replica() -> bool:
+    # a unit of work reads what it is about to write, so it stays on the primary
+    return db.session.info.get(READ_REPLICA_DEPTH, 0) > 0 and not in_unit_of_work()
+
+
+@contextmanager
+def read_from_replica() -> Iterator[None]:
+    """
+    Repository reads inside this scope run on a replica. Replicas lag a little behind the primary, use it
+    only where slightly stale data is fine.
+    """
+    info = db.session.info
+    depth = info.get(READ_REPLICA_DEPTH, 0)
+    info[READ_REPLICA_DEPTH] = depth + 1
+    try:
+        yield
+    finally:
+        info[READ_REPLICA_DEPTH] = depth
+
+
+def read_replica(f: Callable) -> Callable:
+    """
+    Serves a read only view from the replicas.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with read_from_replica():
+            return f(*args, **kwargs)
+
+    return decorated
+
+
+def execute_read(stmt):
+    """
+    Executes a read only statement on the next healthy replica when reads_from_replica(), on the primary
+    otherwise. A replica that can't run it is marked unhealthy and the statement is retried on the next
+    one, and on the primary at last.
+    """
+    if not reads_from_replica():
+        return db.session.execute(stmt)
+
+    failed = set()
+    while True:
+        bind_key = router.choose(exclude=failed)
+        if bind_key is None:
+            return db.session.execute(stmt)
+        try:
+            return db.session.execute(stmt, bind_arguments={"bind": db.engines[bind_key]})
+        except OperationalError as e:
+            app.logger.warning("Replica {} failed, retrying the read elsewhere: {}".format(bind_key, str(e).splitlines()[0]))
+            router.mark_unhealthy(bind_key)
+            failed.add(bind_key)
+            # the failed connection aborted the session transaction, nothing was written in it
+            db.session.rollback()
+
+
+def check_replicas() -> Dict[str, str]:
+    """
+    Connects to every replica and reports whether it is a standby and its replay lag.
+    """
+    statuses = {}
+    for bind_key in router.bind_keys:
+        try:
+            with db.engines[bind_key].connect() as connection:
+                in_recovery, lag = connection.execute(
+                    text("SELECT pg_is_in_recovery(), now() - pg_last_xact_replay_timestamp()")
+                ).one()
+        except OperationalError as e:
+            statuses[bind_key] = "unreachable: {}".format(str(e).splitlines()[0])
+            continue
+        statuses[bind_key] = "ok, replay lag {}".format(lag) if in_recovery else "not a standby (pg_is_in_recovery is false)"
+    return statuses
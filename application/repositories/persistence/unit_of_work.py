@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db
+
+UNIT_OF_WORK_DEPTH = "unit_of_work_depth"
+CHANGED_KEYS = "changed_keys"
+
+_change_listeners: Dict[type, List[Callable[[Set[str]], None]]] = {}
+
+
+def in_unit_of_work() -> bool:
+    """
+    True while a unit of work is open on the current session, repositories only flush then.
+    """
+    return db.session.info.get(UNIT_OF_WORK_DEPTH, 0) > 0
+
+
+@contextmanager
+def unit_of_work() -> Iterator[Session]:
+    """
+    Opens a transaction scope on the current session: every repository call inside it only flushes and the
+    outermost scope commits once when it exits (or rolls everything back if an exception escapes).
+    Scopes can be nested, the inner ones join the outer one.
+
+    Yields:
+        Session: the current session.
+    """
+    info = db.session.info
+    depth = info.get(UNIT_OF_WORK_DEPTH, 0)
+    info[UNIT_OF_WORK_DEPTH] = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        info[UNIT_OF_WORK_DEPTH] = depth
+
+
+@contextmanager
+def savepoint() -> Iterator[Session]:
+    """
+    Per item scope inside a unit of work (SAVEPOINT): when an exception escapes, only the work of the item
+    is rolled back and the exception is raised again for the caller to record the failure and go on.
+
+    Raises:
+        RuntimeError: If there is no unit of work open.
+    """
+    if not in_unit_of_work():
+        raise RuntimeError("savepoint() must run inside a unit_of_work()")
+    with db.session.begin_nested():
+        yield db.session
+
+
+def on_commit_changes(model: type, listener: Callable[[Set[str]], None]):
+    """
+    Calls `listener` with the primary keys of the `model` records the repositories changed, once the
+    transaction that changed them is committed (e.g. to invalidate a cache). Nothing is called on rollback.
+    """
+    _change_listeners.setdefault(model, []).append(listener)
+
+
+def record_changes(model: type, keys: Iterable[Any]):
+    # only the models somebody listens to are tracked
+    if model not in _change_listeners:
+        return
+    changed = db.session.info.setdefault(CHANGED_KEYS, {})
+    changed.setdefault(model, set()).update(str(key) for key in keys)
+
+
+@event.listens_for(db.session, "after_commit")
+def _notify_changes(session: Session):
+    changed = session.info.pop(CHANGED_KEYS, None) or {}
+    for model, keys in changed.items():
+        for listener in _change_listeners.get(model, []):
+            try:
+                listener(keys)
+            except Exception:
+                # the transaction is already committed, a listener can't undo it
+                app.logger.exception("Change listener of {} failed".format(model.__name__))
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(CHANGED_KEYS, None)
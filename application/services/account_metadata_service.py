@@ -0,0 +1,123 @@
+import json
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+from sqlalchemy import select
+
+from app import db
+from application.models import Account, User, AccountStatus, UserStatus
+from application.repositories.persistence.unit_of_work import on_commit_changes
+from application.services.cache_service import CacheService
+from settings import ACCOUNT_METADATA_TTL
+
+ACCOUNT_KEY = "account_metadata:{}"
+USER_STATUS_KEY = "user_status:{}"
+
+
+class AccountMetadata(NamedTuple):
+    account_id: str
+    user_id: str
+    account_status: AccountStatus
+    user_status: Optional[UserStatus]
+    currency_name: str
+
+
+class AccountMetadataService:
+    """
+    Owner, status and currency of the accounts cached in redis, so authorization checks don't query the
+    database for every account (settlement reads statuses from the database, it can't act on a stale one). The account part and the status of its owner are cached
+    under separate keys: a change of a user only drops its own key whatever the number of its accounts.
+
+    Misses are loaded from the primary (never from a replica, it could put back what was just
+    invalidated) and written to redis for ACCOUNT_METADATA_TTL seconds. Changes of accounts and users
+    made through the repositories drop their keys once committed; a miss loaded while such a change
+    commits can still put the old value back, the TTL bounds how long it stays.
+    """
+
+    def __init__(self):
+        self.cache = CacheService()
+
+    def _cached(self, key: str, ids: Iterable[str]) -> Dict[str, dict]:
+        ids = list(ids)
+        values = self.cache.mget([key.format(pk) for pk in ids])
+        return {pk: json.loads(value) for pk, value in zip(ids, values) if value is not None}
+
+    def _store(self, key: str, entries: Dict[str, dict]):
+        if entries:
+            self.cache.set_many(
+                {key.format(pk): json.dumps(entry) for pk, entry in entries.items()}, exp=ACCOUNT_METADATA_TTL
+            )
+
+    def _load_accounts(self, account_ids: Iterable[str]) -> Dict[str, dict]:
+        ids = list(account_ids)
+        if not ids:
+            return {}
+        stmt = select(Account.id, Account.user_id, Account.status, Account.currency_name).where(Account.id.in_(ids))
+        return {
+            str(row.id): {"user_id": str(row.user_id), "status": row.status.name, "currency_name": row.currency_name}
+            for row in db.session.execute(stmt)
+        }
+
+    def _load_users(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        ids = list(user_ids)
+        if not ids:
+            return {}
+        stmt = select(User.id, User.status).where(User.id.in_(ids))
+        return {str(row.id): {"status": row.status.name} for row in db.session.execute(stmt)}
+
+    def get_many(self, account_ids: Iterable[str]) -> Dict[str, AccountMetadata]:
+        """
+        Metadata of many accounts: two redis round trips, plus a query for the accounts and one for the users
+        missing from redis.
+
+        Args:
+            account_ids (Iterable[str]): ids of the accounts.
+
+        Returns:
+            Dict[str, AccountMetadata]: account id -> metadata, accounts that don't exist are left out.
+        """
+        account_ids = {str(account_id) for account_id in account_ids}
+        if not account_ids:
+            return {}
+        accounts = self._cached(ACCOUNT_KEY, account_ids)
+        loaded = self._load_accounts(account_ids - accounts.keys())
+        self._store(ACCOUNT_KEY, loaded)
+        accounts.update(loaded)
+
+        users_status = self.users_status(account["user_id"] for account in accounts.values())
+        return {
+            account_id: AccountMetadata(
+                account_id=account_id,
+                user_id=account["user_id"],
+                account_status=AccountStatus[account["status"]],
+                user_status=users_status.get(account["user_id"]),
+                currency_name=account["currency_name"],
+            )
+            for account_id, account in accounts.items()
+        }
+
+    def get(self, account_id: str) -> Optional[AccountMetadata]:
+        return self.get_many([account_id]).get(str(account_id))
+
+    def users_status(self, user_ids: Iterable[str]) -> Dict[str, UserStatus]:
+        """
+        Status of many users, from the same keys as get_many.
+        """
+        user_ids = {str(user_id) for user_id in user_ids}
+        if not user_ids:
+            return {}
+        users = self._cached(USER_STATUS_KEY, user_ids)
+        loaded = self._load_users(user_ids - users.keys())
+        self._store(USER_STATUS_KEY, loaded)
+        users.update(loaded)
+        return {user_id: UserStatus[user["status"]] for user_id, user in users.items()}
+
+    def invalidate_accounts(self, account_ids: Set[str]):
+        self.cache.delete_many([ACCOUNT_KEY.format(account_id) for account_id in account_ids])
+
+    def invalidate_users(self, user_ids: Set[str]):
+        self.cache.delete_many([USER_STATUS_KEY.format(user_id) for user_id in user_ids])
+
+
+account_metadata_service = AccountMetadataService()
+on_commit_changes(Account, account_metadata_service.invalidate_accounts)
+on_commit_changes(User, account_metadata_service.invalidate_users)
@@ -1,32 +1,201 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+from uuid import uuid4
+
 import requests
 
-from settings import API_KEY_FOREX
-from application.services.cache_service import CacheService
+from app import app
+from settings import (
+    API_KEY_FOREX, RATE_CACHE_TTL, RATE_STALE_TTL, RATE_LOCAL_TTL, RATE_LOCAL_CACHE_SIZE, RATE_REQUEST_TIMEOUT,
+    RATE_FETCH_WORKERS,
+)
+from application.services.cache_service import CacheService, LocalCache
+
+
+class RateUnavailableError(Exception):
+    """
+    No rate for a currency pair: the upstream call failed and there is no cached one, not even stale.
+    """
 
 
 class ApiRateService:
+    """
+    Rates are cached in two tiers: a process local LRU (RATE_LOCAL_TTL) in front of redis. A rate older than
+    RATE_CACHE_TTL is still served while a background thread refreshes it (up to RATE_STALE_TTL), and
+    concurrent misses for the same pair wait for a single upstream call. There is no made up fallback:
+    a pair without any rate is reported as unavailable.
+    """
+    local_cache = LocalCache(max_size=RATE_LOCAL_CACHE_SIZE, ttl=RATE_LOCAL_TTL)
+    _key_locks: Dict[str, threading.Lock] = {}
+    _key_locks_lock = threading.Lock()
+    _refreshing = set()
+
     def __init__(self):
         self.cache = CacheService()
 
-    def _calculate_rate(self, key: str):
+    @classmethod
+    def _key_lock(cls, key: str) -> threading.Lock:
+        with cls._key_locks_lock:
+            return cls._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _parse_entry(value: Optional[str]) -> Optional[dict]:
+        if value is None:
+            return None
+        try:
+            entry = json.loads(value)
+        except ValueError:
+            entry = None
+        if not isinstance(entry, dict):
+            # plain rate stored by older versions, served but refreshed right away
+            entry = {"rate": float(value), "fetched_at": 0}
+        return entry
+
+    @staticmethod
+    def _is_stale(entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] > RATE_CACHE_TTL
+
+    def _read(self, key: str) -> Optional[dict]:
+        entry = self.local_cache.get(key)
+        if entry is None:
+            entry = self._parse_entry(self.cache.get(key))
+            if entry is not None:
+                self.local_cache.set(key, entry)
+        return entry
+
+    def _store(self, key: str, rate: float) -> dict:
+        entry = {"rate": rate, "fetched_at": time.time()}
+        self.cache.set(key=key, value=json.dumps(entry), exp=RATE_CACHE_TTL + RATE_STALE_TTL)
+        self.local_cache.set(key, entry)
+        return entry
+
+    def _fetch_rate(self, key: str) -> float:
         url = f"https://api.polygon.io/v2/aggs/ticker/{key}/prev?adjusted=true&apiKey={API_KEY_FOREX}"
-        response = requests.get(url)
+        response = requests.get(url, timeout=RATE_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return float(response.json()["results"][0]["c"])
+
+    def _wait_for_refresh(self, key: str) -> Optional[dict]:
+        # another process holds the upstream call for this key, wait for its result
+        deadline = time.monotonic() + RATE_REQUEST_TIMEOUT
+        while time.monotonic() < deadline:
+            entry = self._parse_entry(self.cache.get(key))
+            if entry is not None and not self._is_stale(entry):
+                self.local_cache.set(key, entry)
+                return entry
+            time.sleep(0.05)
+        return None
+
+    def _calculate_rate(self, key: str) -> Optional[float]:
+        """
+        Fetches the rate of `key` from upstream, only one caller at a time across processes (redis lock).
+
+        Returns:
+            Optional[float]: the new rate, the stale one when upstream failed, None when there is none at all.
+        """
+        with self._key_lock(key):
+            self.local_cache.delete(key)
+            entry = self._read(key)
+            if entry is not None and not self._is_stale(entry):
+                # refreshed by another thread while we were waiting
+                return float(entry["rate"])
+
+            lock_key = f"lock:{key}"
+            # the lock may expire while a slow call is still running, only its owner can release it
+            token = str(uuid4())
+            if self.cache.set_nx(key=lock_key, value=token, exp=int(RATE_REQUEST_TIMEOUT) + 1):
+                try:
+                    rate = self._fetch_rate(key)
+                except Exception:
+                    app.logger.exception("Rate request failed for {}".format(key))
+                else:
+                    return float(self._store(key, rate)["rate"])
+                finally:
+                    self.cache.delete_if_equals(lock_key, token)
+            else:
+                refreshed_entry = self._wait_for_refresh(key)
+                if refreshed_entry is not None:
+                    return float(refreshed_entry["rate"])
+
+            if entry is not None:
+                return float(entry["rate"])
+            app.logger.warning("No rate available for {}".format(key))
+            return None
+
+    def _refresh(self, key: str):
         try:
-            response.raise_for_status()
-            rate = response.json()["results"][0]["c"]
-            self.cache.set(key=key, value=str(rate), exp=None)
-        except:
-            rate = 0.01
+            self._calculate_rate(key)
+        finally:
+            self._refreshing.discard(key)
 
-        return float(rate)
+    def _refresh_in_background(self, key: str):
+        with self._key_locks_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
 
-    def get_rate(self, origin_currency_name: str, destination_currency_name: str):
+    @staticmethod
+    def _rate_key(origin_currency_name: str, destination_currency_name: str) -> str:
+        return f"C:{origin_currency_name}{destination_currency_name}"
+
+    def get_rate(self, origin_currency_name: str, destination_currency_name: str) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: the rate, None when it is unavailable.
+        """
         if origin_currency_name == destination_currency_name:
             return 1.0
-        key = f"C:{origin_currency_name}{destination_currency_name}"
-        if self.cache.exists(key):
-            rate = self.cache.get(key)
-        else:
-            rate = self._calculate_rate(key)
+        key = self._rate_key(origin_currency_name, destination_currency_name)
+        entry = self._read(key)
+        if entry is None:
+            return self._calculate_rate(key)
+        if self._is_stale(entry):
+            self._refresh_in_background(key)
+
+        return float(entry["rate"])
+
+    def get_rates(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        """
+        Resolves every (origin, destination) currency pair at once: the local tier first, a single MGET for
+        what is missing there and concurrent upstream calls (RATE_FETCH_WORKERS) for what redis doesn't have.
+
+        Returns:
+            Dict[Tuple[str, str], float]: pair -> rate, the pairs whose rate is unavailable are left out.
+        """
+        rates = {}
+        keys = {}
+        for origin_currency_name, destination_currency_name in set(pairs):
+            pair = (origin_currency_name, destination_currency_name)
+            if origin_currency_name == destination_currency_name:
+                rates[pair] = 1.0
+                continue
+            key = self._rate_key(origin_currency_name, destination_currency_name)
+            entry = self.local_cache.get(key)
+            if entry is None:
+                keys[pair] = key
+                continue
+            if self._is_stale(entry):
+                self._refresh_in_background(key)
+            rates[pair] = float(entry["rate"])
+
+        missing = {}
+        for (pair, key), value in zip(keys.items(), self.cache.mget(list(keys.values()))):
+            entry = self._parse_entry(value)
+            if entry is None:
+                missing[pair] = key
+                continue
+            self.local_cache.set(key, entry)
+            if self._is_stale(entry):
+                self._refresh_in_background(key)
+            rates[pair] = float(entry["rate"])
 
-        return float(rate)
\ No newline at end of file
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(RATE_FETCH_WORKERS, len(missing))) as executor:
+                for pair, rate in zip(missing, executor.map(self._calculate_rate, missing.values())):
+                    if rate is not None:
+                        rates[pair] = rate
+        return rates
@@ -1,15 +1,36 @@
 import json
+import os
+import threading
 from flask import g
 
-from application.services.cache_service import CacheService
+from app import app
+from settings import AUTH_LOCAL_TTL, AUTH_LOCAL_CACHE_SIZE
+from application.services.cache_service import CacheService, LocalCache
 from application.services.key_producer_service import KeyProducerService
 
 
 class AuthService:
+    """
+    Tokens live in redis. When AUTH_LOCAL_TTL is set, validated tokens are also kept in the process for that
+    many seconds; revoked tokens are announced on a redis pub/sub channel so every process drops them at once.
 
-    def __init__(self):
+    The subscriber is running before a token is read from redis, and a token isn't cached when a revocation
+    arrived while it was being read, so a revocation can't be overwritten by the token it revokes. What is
+    left is the delivery of the message: other processes keep accepting a revoked token until it reaches
+    them (usually milliseconds). Pub/sub doesn't replay messages missed while disconnected, a subscriber
+    that drops clears the cache, the tokens are read from redis again.
+    """
+    revocation_channel = "auth:revoked"
+    local_cache = LocalCache(max_size=AUTH_LOCAL_CACHE_SIZE, ttl=AUTH_LOCAL_TTL)
+    _subscriber = None
+    _subscriber_pid = None
+    _subscriber_lock = threading.Lock()
+    _revocations = 0  # revocations received (and subscriber drops), only ever increases
+
+    def __init__(self, local_ttl: float = AUTH_LOCAL_TTL):
         self.cache = CacheService()
         self.key_producer = KeyProducerService()
+        self.local_ttl = local_ttl
 
     def create_token(self, value: dict, prefix: str = "auth", exp=None):
         key = self.key_producer.generate_key()
@@ -23,11 +44,62 @@ class AuthService:
             return True, self.create_token({"id": str(user.id), "profile": user.profile, "email": user.email})
         return False, None
 
+    @classmethod
+    def _on_revoked(cls, message):
+        cls._revocations += 1
+        cls.local_cache.delete(message["data"])
+
+    @classmethod
+    def _on_subscriber_error(cls, error, pubsub, thread):
+        # revocations may have been missed while disconnected, forget everything and subscribe again later
+        app.logger.warning("Token revocation subscriber stopped: {}".format(error))
+        thread.stop()
+        pubsub.close()
+        with cls._subscriber_lock:
+            cls._subscriber = None
+        cls._revocations += 1
+        cls.local_cache.clear()
+
+    def _listen_revocations(self):
+        # one subscriber thread per process, started lazily so it's created after gunicorn forks
+        if self._subscriber is not None and self._subscriber_pid == os.getpid():
+            return
+        with self._subscriber_lock:
+            if self._subscriber is not None and self._subscriber_pid == os.getpid():
+                return
+            pubsub = self.cache.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.revocation_channel: self._on_revoked})
+            AuthService._subscriber = pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=self._on_subscriber_error
+            )
+            AuthService._subscriber_pid = os.getpid()
+
     def validate_token(self, token: str, prefix: str = "auth"):
         key = f"{prefix}:{token}"
-        if self.cache.exists(key):
-            return json.loads(self.cache.get(key))
-        return None
+        if self.local_ttl:
+            user = self.local_cache.get(key)
+            if user is not None:
+                return user
+
+        revocations = None
+        if self.local_ttl:
+            self._listen_revocations()
+            revocations = self._revocations
+        # a single round trip, a missing key comes back as None
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        user = json.loads(value)
+        # a revocation received since the read may be this token's
+        if self.local_ttl and self._revocations == revocations:
+            self.local_cache.set(key, user, ttl=self.local_ttl)
+        return user
+
+    def revoke_token(self, token: str, prefix: str = "auth"):
+        key = f"{prefix}:{token}"
+        self.cache.delete(key)
+        self.local_cache.delete(key)
+        self.cache.publish(self.revocation_channel, key)
 
     @staticmethod
     def is_admin() -> bool:
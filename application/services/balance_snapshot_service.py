@@ -0,0 +1,103 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from application.models import Account, AccountBalanceSnapshot
+from application.money import to_money
+from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.replicas import execute_read
+
+
+class BalanceSnapshotService:
+    """
+    Daily balance history of the accounts: settlement records what every batch moved and statements are
+    served from the snapshots instead of the transactions.
+    """
+    repository = None
+
+    def __init__(self, repository: EntityRepository):
+        self.repository = repository
+
+    def record(self, flows: Dict[str, Dict[str, Any]]):
+        """
+        Adds the movements of a settled batch to today's snapshot of every account, with a single
+        INSERT ... ON CONFLICT DO UPDATE. Runs inside the settlement transaction, with the accounts locked.
+
+        Args:
+            flows (Dict[str, Dict[str, Any]]): account id -> opening_total (before the batch), closing_total,
+                credits, debits and movements of the batch.
+        """
+        if not flows:
+            return
+        table = AccountBalanceSnapshot.__table__
+        stmt = insert(table).values([
+            {"account_id": account_id, "day": func.current_date(), **flow}
+            for account_id, flow in sorted(flows.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.account_id, table.c.day],
+            set_={
+                # opening_total stays the one of the first batch of the day
+                "closing_total": stmt.excluded.closing_total,
+                "credits": table.c.credits + stmt.excluded.credits,
+                "debits": table.c.debits + stmt.excluded.debits,
+                "movements": table.c.movements + stmt.excluded.movements,
+                "last_updated": func.now(),
+            },
+        )
+        db.session.execute(stmt)
+
+    def balance_as_of(self, account: Account, day: date) -> Decimal:
+        """
+        Balance of the account at the end of `day`: the closing of the last snapshot up to that day, else the
+        opening of the first one after it (nothing moved in between), else the current total. Days settled
+        before snapshots were recorded need backfill_balance_snapshots to have run.
+        """
+        snapshot = AccountBalanceSnapshot
+        stmt = (
+            select(snapshot.closing_total)
+            .where(snapshot.account_id == account.id, snapshot.day <= day)
+            .order_by(snapshot.day.desc())
+            .limit(1)
+        )
+        total = execute_read(stmt).scalar()
+        if total is None:
+            stmt = (
+                select(snapshot.opening_total)
+                .where(snapshot.account_id == account.id, snapshot.day > day)
+                .order_by(snapshot.day.asc())
+                .limit(1)
+            )
+            total = execute_read(stmt).scalar()
+        if total is None:
+            total = account.total
+        return to_money(total)
+
+    def statement(self, account: Account, date_from: date, date_to: date) -> Dict[str, Any]:
+        """
+        Statement of the account between two days (both included): opening and closing balances, the sum of
+        credits/debits and one entry per day with movements.
+        """
+        snapshot = AccountBalanceSnapshot
+        stmt = (
+            select(snapshot)
+            .where(snapshot.account_id == account.id, snapshot.day >= date_from, snapshot.day <= date_to)
+            .order_by(snapshot.day.asc())
+        )
+        days: List[AccountBalanceSnapshot] = execute_read(stmt).scalars().all()
+        opening_total = self.balance_as_of(account, date_from - timedelta(days=1))
+        return {
+            "account_id": account.id,
+            "date_from": date_from,
+            "date_to": date_to,
+            "opening_total": opening_total,
+            "closing_total": days[-1].closing_total if days else opening_total,
+            "credits": to_money(sum((day.credits for day in days), Decimal(0))),
+            "debits": to_money(sum((day.debits for day in days), Decimal(0))),
+            "movements": sum(day.movements for day in days),
+            "days": days,
+        }
@@ -1,19 +1,200 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
 import redis
+from redis.connection import DefaultParser
+
+from settings import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_SOCKET_PATH, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> redis.ConnectionPool:
+    """
+    Connection pool shared by every CacheService of the process (redis-py resets it after a fork).
+    The hiredis parser is used automatically when the hiredis package is installed.
+    """
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            options = dict(
+                db=REDIS_DB,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                parser_class=DefaultParser,
+                decode_responses=True,
+            )
+            if REDIS_SOCKET_PATH:
+                _connection_pool = redis.ConnectionPool(
+                    connection_class=redis.UnixDomainSocketConnection, path=REDIS_SOCKET_PATH, **options
+                )
+            else:
+                _connection_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, **options)
+        return _connection_pool
+
+
+# deletes KEYS[1] only while it still holds ARGV[1], in one step
+DELETE_IF_EQUALS_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
-from settings import REDIS_HOST, REDIS_PORT
 
 class CacheService:
     def __init__(self):
-        self.redis = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        self.redis = redis.StrictRedis(connection_pool=get_connection_pool())
 
     def set(self, key: str, value: str, exp=None):
         self.redis.set(key, value, ex=exp)
 
+    def set_nx(self, key: str, value: str, exp=None) -> bool:
+        return bool(self.redis.set(key, value, ex=exp, nx=True))
+
     def get(self, key: str):
         return self.redis.get(key)
 
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return self.redis.mget(keys)
+
+    def set_many(self, mapping: Dict[str, str], exp=None):
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, ex=exp)
+        pipeline.execute()
+
     def exists(self, key: str):
         return self.redis.exists(key)
 
     def delete(self, key: str):
         self.redis.delete(key)
+
+    def delete_if_equals(self, key: str, value: str) -> bool:
+        return bool(self.redis.eval(DELETE_IF_EQUALS_SCRIPT, 1, key, value))
+
+    def delete_many(self, keys: List[str]):
+        if keys:
+            self.redis.delete(*keys)
+
+    def publish(self, channel: str, message: str):
+        self.redis.publish(channel, message)
+
+    def hset(self, key: str, mapping: Dict[str, str], exp=None):
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, mapping=mapping)
+        if exp is not None:
+            pipeline.expire(key, exp)
+        pipeline.execute()
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        return self.redis.hgetall(key)
+
+    def lpush(self, key: str, value: str):
+        self.redis.lpush(key, value)
+
+    def blmove(self, source: str, destination: str, timeout: float = 0, src: str = "RIGHT",
+               dest: str = "LEFT") -> Optional[str]:
+        return self.redis.blmove(source, destination, timeout, src=src, dest=dest)
+
+    def lmove(self, source: str, destination: str, src: str = "RIGHT", dest: str = "LEFT") -> Optional[str]:
+        return self.redis.lmove(source, destination, src=src, dest=dest)
+
+    def lrem(self, key: str, value: str, count: int = 0):
+        self.redis.lrem(key, count, value)
+
+    def sadd(self, key: str, *values: str):
+        self.redis.sadd(key, *values)
+
+    def srem(self, key: str, *values: str):
+        self.redis.srem(key, *values)
+
+    def smembers(self, key: str) -> Set[str]:
+        return self.redis.smembers(key)
+
+    def xadd_many(self, stream: str, entries: List[Dict[str, str]], maxlen: int = None):
+        pipeline = self.redis.pipeline(transaction=False)
+        for fields in entries:
+            pipeline.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        pipeline.execute()
+
+    def xgroup_create(self, stream: str, group: str):
+        try:
+            self.redis.xgroup_create(stream, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def xreadgroup(self, stream: str, group: str, consumer: str, count: int, block: int) -> List[Tuple[str, Dict[str, str]]]:
+        response = self.redis.xreadgroup(group, consumer, {stream: ">"}, count=count, block=block)
+        return response[0][1] if response else []
+
+    def xautoclaim(self, stream: str, group: str, consumer: str, min_idle_time: int, count: int) -> List[Tuple[str, Dict[str, str]]]:
+        response = self.redis.xautoclaim(stream, group, consumer, min_idle_time=min_idle_time, count=count)
+        return response[1]
+
+    def xpending_deliveries(self, stream: str, group: str, ids: List[str]) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: id -> times delivered, for the ids still pending in the group.
+        """
+        pipeline = self.redis.pipeline(transaction=False)
+        for entry_id in ids:
+            pipeline.xpending_range(stream, group, min=entry_id, max=entry_id, count=1)
+        return {
+            entry["message_id"]: entry["times_delivered"]
+            for entries in pipeline.execute() for entry in entries
+        }
+
+    def xack(self, stream: str, group: str, *ids: str):
+        if ids:
+            self.redis.xack(stream, group, *ids)
+
+
+class LocalCache:
+    """
+    Process local LRU cache with a TTL per entry, placed in front of redis for the hottest keys.
+    Thread safe, gunicorn threads of a worker share it.
+    """
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,44 @@
+import json
+from typing import Optional, Tuple
+
+from settings import IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL
+from application.services.cache_service import CacheService
+
+
+class IdempotencyService:
+    """
+    Reserves an idempotency key atomically (SET NX) and keeps the response produced for it, so a retried
+    request gets the stored response instead of being executed again. The hash of the request body is kept
+    with the key, a key reused for another body can be told apart from a retry.
+    """
+
+    def __init__(self):
+        self.cache = CacheService()
+
+    @staticmethod
+    def _key(scope: str, key: str) -> str:
+        return f"idempotency:{scope}:{key}"
+
+    def reserve(self, scope: str, key: str, body_hash: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Returns:
+            Tuple[bool, Optional[dict]]: (True, None) when the key is reserved for this request, else (False, entry)
+            with the body_hash of the request holding the key, plus its status_code and body once answered (None
+            when the key was taken in between).
+        """
+        redis_key = self._key(scope, key)
+        reservation = json.dumps({"body_hash": body_hash})
+        if self.cache.set_nx(key=redis_key, value=reservation, exp=IDEMPOTENCY_LOCK_TTL):
+            return True, None
+        stored = self.cache.get(redis_key)
+        if stored is None:
+            # expired in between, try once more
+            return self.cache.set_nx(key=redis_key, value=reservation, exp=IDEMPOTENCY_LOCK_TTL), None
+        return False, json.loads(stored)
+
+    def store(self, scope: str, key: str, body_hash: str, body: str, status_code: int):
+        value = json.dumps({"body_hash": body_hash, "body": body, "status_code": status_code})
+        self.cache.set(key=self._key(scope, key), value=value, exp=IDEMPOTENCY_TTL)
+
+    def release(self, scope: str, key: str):
+        self.cache.delete(self._key(scope, key))
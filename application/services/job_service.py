@@ -0,0 +1,149 @@
+import inspect
+import json
+import os
+import socket
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from app import app
+from settings import JOB_TTL, JOB_POLL_TIMEOUT, JOB_WORKER_TTL
+from application.default import JobStatus
+from application.services.cache_service import CacheService
+
+
+class JobService:
+    """
+    Background jobs on top of redis: a job is a hash `job:<id>` (status, kwargs, result) plus its id pushed
+    to the `jobs:queue` list, workers pop ids from the list and run the function registered under the job name.
+
+    A worker moves the id it takes to its own processing list (BLMOVE) and removes it once the job is over.
+    Workers keep a heartbeat key alive while they run; the jobs left in the processing list of a worker whose
+    heartbeat expired (crashed, killed) are pushed back to the queue by requeue_stale.
+    """
+    queue_key = "jobs:queue"
+    workers_key = "jobs:workers"
+    registry: Dict[str, Callable[..., Dict[str, Any]]] = {}
+
+    def __init__(self, worker_id: str = None):
+        self.cache = CacheService()
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    @classmethod
+    def register(cls, name: str, fn: Callable[..., Dict[str, Any]]):
+        cls.registry[name] = fn
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    @staticmethod
+    def _processing_key(worker_id: str) -> str:
+        return f"jobs:processing:{worker_id}"
+
+    @staticmethod
+    def _worker_key(worker_id: str) -> str:
+        return f"jobs:worker:{worker_id}"
+
+    def _save(self, job_id: str, **fields):
+        self.cache.hset(self._job_key(job_id), mapping={k: str(v) for k, v in fields.items()}, exp=JOB_TTL)
+
+    def enqueue(self, name: str, **kwargs) -> str:
+        if name not in self.registry:
+            raise ValueError(f"job {name} is not registered")
+        job_id = str(uuid4())
+        self._save(
+            job_id,
+            id=job_id,
+            name=name,
+            kwargs=json.dumps(kwargs),
+            status=JobStatus.QUEUED.value,
+            created_at=datetime.utcnow().isoformat(),
+        )
+        self.cache.lpush(self.queue_key, job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.cache.hgetall(self._job_key(job_id))
+        if not job:
+            return None
+        job["kwargs"] = json.loads(job["kwargs"])
+        if "result" in job:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def update_progress(self, job_id: str, result: Dict[str, Any]):
+        self._save(job_id, result=json.dumps(result))
+
+    def heartbeat(self):
+        """
+        Tells the other workers this one is alive, for JOB_WORKER_TTL seconds.
+        """
+        self.cache.set(self._worker_key(self.worker_id), datetime.utcnow().isoformat(), exp=JOB_WORKER_TTL)
+        self.cache.sadd(self.workers_key, self.worker_id)
+
+    def requeue_stale(self) -> List[str]:
+        """
+        Pushes the jobs taken by dead workers (heartbeat expired) back to the front of the queue.
+
+        Returns:
+            List[str]: ids of the jobs queued again.
+        """
+        requeued = []
+        for worker_id in self.cache.smembers(self.workers_key):
+            if worker_id == self.worker_id or self.cache.exists(self._worker_key(worker_id)):
+                continue
+            while True:
+                # the right end of the queue is the next one popped
+                job_id = self.cache.lmove(self._processing_key(worker_id), self.queue_key, src="RIGHT", dest="RIGHT")
+                if job_id is None:
+                    break
+                if self.cache.exists(self._job_key(job_id)):
+                    self._save(job_id, status=JobStatus.QUEUED.value)
+                app.logger.warning("Job {} of dead worker {} queued again".format(job_id, worker_id))
+                requeued.append(job_id)
+            self.cache.srem(self.workers_key, worker_id)
+        return requeued
+
+    def run_next(self, timeout: float = JOB_POLL_TIMEOUT) -> Optional[str]:
+        """
+        Waits up to `timeout` seconds for a job and runs it. Call heartbeat() first: the job is only visible
+        in the processing list of this worker while it runs.
+
+        Returns:
+            Optional[str]: id of the job executed, None if the queue was empty.
+        """
+        processing_key = self._processing_key(self.worker_id)
+        job_id = self.cache.blmove(self.queue_key, processing_key, timeout=timeout)
+        if job_id is None:
+            return None
+        try:
+            self._run(job_id)
+        finally:
+            self.cache.lrem(processing_key, job_id)
+        return job_id
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if job is None:
+            # expired before anyone took it
+            return
+
+        self._save(job_id, status=JobStatus.RUNNING.value, started_at=datetime.utcnow().isoformat())
+        fn = self.registry[job["name"]]
+        kwargs = job["kwargs"]
+        if "progress" in inspect.signature(fn).parameters:
+            # long jobs report partial results, readable with get() while they run
+            kwargs["progress"] = lambda result: self.update_progress(job_id, result)
+        try:
+            result = fn(**kwargs)
+        except Exception as e:
+            app.logger.exception("Job {} ({}) failed".format(job_id, job["name"]))
+            self._save(job_id, status=JobStatus.FAILED.value, error=str(e), finished_at=datetime.utcnow().isoformat())
+        else:
+            self._save(
+                job_id,
+                status=JobStatus.DONE.value,
+                result=json.dumps(result),
+                finished_at=datetime.utcnow().isoformat(),
+            )
@@ -0,0 +1,160 @@
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app import app, db
+from application.models import Transaction
+from settings import TRANSACTIONS_PARTITIONS_AHEAD, TRANSACTIONS_RETENTION_MONTHS, TRANSACTIONS_ARCHIVE_SCHEMA
+
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionService:
+    """
+    Monthly range partitions of a table partitioned on created_at (transactions, see TRANSACTIONS_PARTITIONED):
+    partitions are created ahead of time, old ones are detached and moved to the archive schema, where
+    they can be dumped or dropped without touching the live table.
+    """
+    table = None
+
+    def __init__(self, table: str = Transaction.__tablename__):
+        self.table = table
+
+    def partition_name(self, month: date) -> str:
+        return "{}_y{:04d}m{:02d}".format(self.table, month.year, month.month)
+
+    def is_partitioned(self) -> bool:
+        stmt = text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+        )
+        return bool(db.session.execute(stmt, {"table": self.table}).scalar())
+
+    def list_partitions(self) -> List[date]:
+        """
+        Months of the partitions attached to the table, oldest first.
+        """
+        stmt = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table)"
+        )
+        months = []
+        for name in db.session.execute(stmt, {"table": self.table}).scalars():
+            match = PARTITION_NAME.search(name)
+            if match is not None:
+                months.append(date(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+
+    def list_archived(self, schema: str = TRANSACTIONS_ARCHIVE_SCHEMA, connection: Optional[Connection] = None) -> List[str]:
+        """
+        Names of the partitions of the table moved to the archive schema, oldest first. Read through
+        `connection` when given (to see the same snapshot as the caller), the session otherwise.
+        """
+        stmt = text("SELECT tablename FROM pg_tables WHERE schemaname = :schema")
+        rows = (connection or db.session).execute(stmt, {"schema": schema}).scalars()
+        prefix = self.table + "_y"
+        return sorted(name for name in rows if name.startswith(prefix) and PARTITION_NAME.search(name))
+
+    def create(self, month: date, commit: bool = True) -> str:
+        """
+        Creates the partition of the month holding `month`, does nothing if it already exists.
+
+        Returns:
+            str: name of the partition.
+        """
+        month = month_start(month)
+        name = self.partition_name(month)
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')".format(
+                name, self.table, month.isoformat(), add_months(month, 1).isoformat(),
+            )
+        ))
+        if commit:
+            db.session.commit()
+        return name
+
+    def ensure(self, ahead: int = TRANSACTIONS_PARTITIONS_AHEAD, since: Optional[date] = None) -> List[str]:
+        """
+        Creates the partitions from `since` (the current month by default) up to `ahead` months from now.
+        Inserts fail when their month has no partition, run it on a schedule.
+
+        Returns:
+            List[str]: names of the partitions, existing ones included.
+
+        Raises:
+            RuntimeError: If the table is not partitioned.
+        """
+        if not self.is_partitioned():
+            raise RuntimeError("{} is not partitioned, create it with TRANSACTIONS_PARTITIONED".format(self.table))
+        current = month_start(date.today())
+        month = month_start(since) if since is not None else current
+        names = []
+        while month <= add_months(current, ahead):
+            names.append(self.create(month, commit=False))
+            month = add_months(month, 1)
+        db.session.commit()
+        return names
+
+    def detach(self, month: date, concurrently: bool = True) -> str:
+        """
+        Detaches the partition of the month from the table, it's kept as a plain table. CONCURRENTLY
+        (postgres 14+) doesn't block queries on the table but can't run inside a transaction, the statement
+        goes through its own autocommit connection. It waits for every transaction using the table, so it
+        runs without the STATEMENT_TIMEOUT of the api connections.
+
+        Returns:
+            str: name of the detached partition.
+        """
+        name = self.partition_name(month_start(month))
+        sql = "ALTER TABLE {} DETACH PARTITION {}{}".format(self.table, name, " CONCURRENTLY" if concurrently else "")
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            # no transaction for SET LOCAL, the setting is reset before the connection goes back to the pool
+            connection.execute(text("SET statement_timeout = 0"))
+            try:
+                connection.execute(text(sql))
+            finally:
+                connection.execute(text("RESET statement_timeout"))
+        return name
+
+    def archive(self, before: date, schema: str = TRANSACTIONS_ARCHIVE_SCHEMA, concurrently: bool = True) -> List[str]:
+        """
+        Detaches every partition of a month before `before` and moves it to the archive schema.
+
+        Returns:
+            List[str]: names of the archived partitions.
+        """
+        archived = []
+        months = self.list_partitions()
+        # a concurrent detach waits for the open transactions, the session's included
+        db.session.commit()
+        for month in months:
+            if month >= month_start(before):
+                break
+            name = self.detach(month, concurrently=concurrently)
+            db.session.execute(text("CREATE SCHEMA IF NOT EXISTS {}".format(schema)))
+            db.session.execute(text("ALTER TABLE {} SET SCHEMA {}".format(name, schema)))
+            db.session.commit()
+            app.logger.info("Archived partition {} to schema {}".format(name, schema))
+            archived.append(name)
+        return archived
+
+    def rotate(self, ahead: int = TRANSACTIONS_PARTITIONS_AHEAD,
+               retention_months: int = TRANSACTIONS_RETENTION_MONTHS) -> dict:
+        """
+        Creates the upcoming partitions and archives the ones older than `retention_months`.
+        """
+        created = self.ensure(ahead=ahead)
+        archived = self.archive(before=add_months(month_start(date.today()), -retention_months))
+        return {"partitions": created, "archived": archived}
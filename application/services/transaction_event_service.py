@@ -0,0 +1,57 @@
+from typing import Dict, Iterable, List
+
+from settings import (
+    SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP, SETTLEMENT_STREAM_MAXLEN, SETTLEMENT_STREAM_BLOCK_MS,
+    SETTLEMENT_STREAM_CLAIM_IDLE_MS, SETTLEMENT_DEAD_LETTER_STREAM,
+)
+from application.services.cache_service import CacheService
+
+
+class TransactionEventService:
+    """
+    Publishes the id of every new transaction to a redis stream consumed by the settlement consumer group.
+    Events are acked once settled, the ones left unacked by a dead consumer are claimed again after
+    SETTLEMENT_STREAM_CLAIM_IDLE_MS. Events that keep failing are moved to SETTLEMENT_DEAD_LETTER_STREAM.
+    """
+    def __init__(self):
+        self.cache = CacheService()
+
+    def publish_created(self, transaction_ids: Iterable[str]):
+        entries = [{"id": str(transaction_id)} for transaction_id in transaction_ids]
+        if entries:
+            self.cache.xadd_many(SETTLEMENT_STREAM, entries, maxlen=SETTLEMENT_STREAM_MAXLEN)
+
+    def ensure_group(self):
+        self.cache.xgroup_create(SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP)
+
+    def read(self, consumer: str, count: int, block: int = SETTLEMENT_STREAM_BLOCK_MS) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: event id -> transaction id, redelivered events first.
+        """
+        messages = self.cache.xautoclaim(
+            SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP, consumer, min_idle_time=SETTLEMENT_STREAM_CLAIM_IDLE_MS,
+            count=count,
+        )
+        if not messages:
+            messages = self.cache.xreadgroup(SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP, consumer, count=count, block=block)
+        return {event_id: (fields or {}).get("id") for event_id, fields in messages}
+
+    def ack(self, event_ids: List[str]):
+        self.cache.xack(SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP, *event_ids)
+
+    def deliveries(self, event_ids: List[str]) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: event id -> times it was delivered, for the events not acked yet.
+        """
+        return self.cache.xpending_deliveries(SETTLEMENT_STREAM, SETTLEMENT_STREAM_GROUP, event_ids)
+
+    def dead_letter(self, events: Dict[str, str]):
+        """
+        Moves the events to the dead letter stream (with the id they had) and acks them.
+        """
+        if events:
+            entries = [{"event_id": event_id, "id": transaction_id or ""} for event_id, transaction_id in events.items()]
+            self.cache.xadd_many(SETTLEMENT_DEAD_LETTER_STREAM, entries, maxlen=SETTLEMENT_STREAM_MAXLEN)
+            self.ack(list(events))
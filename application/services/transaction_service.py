@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from application.models import Transaction
 from application.repositories.persistence.entity_repository import EntityRepository
@@ -13,3 +13,11 @@ class TransactionService:
     def create(self, data: Dict[str, Any]) -> Transaction:
         return self.repository.create(data)
 
+    def create_many(self, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        Inserts every item with a single commit, SQLAlchemy packs the rows into multi-row INSERT statements.
+
+        Returns:
+            List[str]: ids of the created transactions, in the same order as the items.
+        """
+        return self.repository.create_many(items)
@@ -1,26 +1,32 @@
-from app import db
+from typing import Any, Callable, Dict, Optional
+
 from application.models import Account, AccountStatus
 from application.repositories.persistence.entity_repository import EntityRepository
 from application.services.account_service import AccountService
+from application.tasks.validation_tasks import validate_created
+from settings import VALIDATION_CHUNK_SIZE
 
 repository = EntityRepository(model=Account)
 service = AccountService(repository=repository)
 
 
-def validate_accounts_created():
-    accounts_created = service.repository.get_all(filters={"status": AccountStatus.CREATED})
-    if len(accounts_created) == 0:
-        return {"total": 0}
+def validate_account(account: Account) -> bool:
+    # Simulate a validation automated process!!
+    return True
 
-    accounts_validated = []
-    for user_created in accounts_created:
-        # Simulate a validation automated process!!
-        user_created = {
-            "status": AccountStatus.ACTIVE,
-            "id": user_created.id
-        }
-        accounts_validated.append(user_created)
 
-    db.session.bulk_update_mappings(Account, accounts_validated)
-    db.session.commit()
-    return {"total": len(accounts_validated)}
+def validate_accounts_created(chunk_size: int = VALIDATION_CHUNK_SIZE,
+                              validator: Callable[[Account], bool] = validate_account,
+                              progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, int]:
+    """
+    Activates every CREATED account, the ones rejected by `validator` are blocked.
+    """
+    return validate_created(
+        service.repository,
+        created_status=AccountStatus.CREATED,
+        active_status=AccountStatus.ACTIVE,
+        rejected_status=AccountStatus.BLOCKED,
+        validator=validator,
+        chunk_size=chunk_size,
+        progress=progress,
+    )
@@ -0,0 +1,100 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+from statistics import quantiles
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List
+from uuid import uuid4
+
+from app import app
+from application.default import OperationType, OperationStatus
+from application.serializers import get_serializer
+from application.services.auth_service import AuthService
+from application.validation_schemas import TransactionSchema
+
+
+def _percentiles(timings: List[float]) -> Dict[str, float]:
+    cuts = quantiles(timings, n=100)
+    return {
+        "p50_ms": round(cuts[49] * 1000, 4),
+        "p99_ms": round(cuts[98] * 1000, 4),
+    }
+
+
+def _measure(fn: Callable, iterations: int) -> List[float]:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_auth(iterations: int = 1000, local_ttl: float = 30) -> Dict[str, Dict[str, float]]:
+    """
+    Auth overhead per request (validate_token) against the configured redis, with and without the
+    process local token cache.
+    """
+    redis_only = AuthService(local_ttl=0)
+    token = redis_only.create_token({"id": "benchmark", "profile": "user", "email": "benchmark@local"}, exp=60)
+    with_local_cache = AuthService(local_ttl=local_ttl)
+    try:
+        return {
+            "redis": _percentiles(_measure(lambda: redis_only.validate_token(token), iterations)),
+            "local_cache": _percentiles(_measure(lambda: with_local_cache.validate_token(token), iterations)),
+        }
+    finally:
+        redis_only.revoke_token(token)
+
+
+def _sample_transactions(rows: int) -> List[SimpleNamespace]:
+    now = datetime.utcnow()
+    return [
+        SimpleNamespace(
+            id=uuid4(),
+            total=Decimal("1520.1234"),
+            amount=Decimal(index) / 100,
+            operation=OperationType.TRANSFER,
+            operation_status=OperationStatus.DONE,
+            origin_account_id=uuid4(),
+            destination_account_id=uuid4(),
+            user_id=uuid4(),
+            currency_name="USD",
+            linked_transaction_id=uuid4(),
+            reference="Exchange from EUR" if index % 2 else None,
+            created_at=now,
+            last_updated=now,
+        )
+        for index in range(rows)
+    ]
+
+
+def benchmark_serializers(sizes: Iterable[int] = (10, 1000, 100000), iterations: int = 5) -> Dict[int, Dict[str, float]]:
+    """
+    Time to build the /movements/ response body with marshmallow and with the compiled serializer.
+
+    Raises:
+        AssertionError: If both bodies are not byte for byte the same.
+    """
+    results = {}
+    serializer = get_serializer(TransactionSchema)
+    with app.app_context():
+        for size in sizes:
+            transactions = _sample_transactions(size)
+
+            def with_marshmallow():
+                data = TransactionSchema(many=True).dump(transactions)
+                return app.json.response({"status": "success", "data": data, "next_cursor": None}).get_data()
+
+            def with_serializer():
+                data = serializer.dump_many(transactions)
+                return app.json.response({"status": "success", "data": data, "next_cursor": None}).get_data()
+
+            assert with_marshmallow() == with_serializer(), "serializer output differs from marshmallow"
+            marshmallow_timings = _measure(with_marshmallow, iterations)
+            serializer_timings = _measure(with_serializer, iterations)
+            results[size] = {
+                "marshmallow_ms": round(min(marshmallow_timings) * 1000, 4),
+                "serializer_ms": round(min(serializer_timings) * 1000, 4),
+            }
+    return results
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from app import app
+from application.services.job_service import JobService
+from application.tasks.account_tasks import validate_accounts_created
+from application.tasks.processes import run_processes
+from application.tasks.reconciliation_tasks import reconcile_balances_job
+from application.tasks.settlement_workers import drain_transactions
+from application.tasks.user_tasks import validate_users_created
+from settings import JOB_WORKERS, JOB_WORKER_TTL, JOB_POLL_TIMEOUT
+
+SETTLE_TRANSACTIONS_JOB = "settle_transactions"
+VALIDATE_ACCOUNTS_JOB = "validate_accounts"
+VALIDATE_USERS_JOB = "validate_users"
+RECONCILE_BALANCES_JOB = "reconcile_balances"
+
+JobService.register(SETTLE_TRANSACTIONS_JOB, drain_transactions)
+JobService.register(VALIDATE_ACCOUNTS_JOB, validate_accounts_created)
+JobService.register(VALIDATE_USERS_JOB, validate_users_created)
+JobService.register(RECONCILE_BALANCES_JOB, reconcile_balances_job)
+
+
+def _heartbeat(job_service: JobService, stop: threading.Event):
+    while not stop.wait(JOB_WORKER_TTL / 3):
+        try:
+            job_service.heartbeat()
+        except Exception:
+            app.logger.exception("Job worker heartbeat failed")
+
+
+def _job_worker():
+    job_service = JobService()
+    stop = threading.Event()
+    with app.app_context():
+        threading.Thread(target=_heartbeat, args=(job_service, stop), daemon=True).start()
+        try:
+            swept_at = None
+            while True:
+                try:
+                    if swept_at is None or time.monotonic() - swept_at > JOB_WORKER_TTL:
+                        # alive before taking any job, the jobs of a worker without heartbeat are queued again
+                        job_service.heartbeat()
+                        job_service.requeue_stale()
+                        swept_at = time.monotonic()
+                    job_service.run_next()
+                except Exception:
+                    app.logger.exception("Job worker failed, retrying in {}s".format(JOB_POLL_TIMEOUT))
+                    time.sleep(JOB_POLL_TIMEOUT)
+        except KeyboardInterrupt:
+            return
+        finally:
+            stop.set()
+
+
+def run_job_workers(workers: int = JOB_WORKERS):
+    run_processes(_job_worker, (), workers=workers, name="job-worker")
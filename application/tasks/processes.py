@@ -0,0 +1,23 @@
+import multiprocessing
+from typing import Callable, Tuple
+
+
+def run_processes(target: Callable, args: Tuple, workers: int, name: str):
+    """
+    Runs `target(*args)` in `workers` processes and waits for them. Processes are spawned, not forked, so
+    each one builds its own engine and connection pools.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=target, args=args, name=f"{name}-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
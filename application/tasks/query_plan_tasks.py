@@ -0,0 +1,81 @@
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from sqlalchemy import select, text
+
+from app import db
+from application.models import User, Account, Transaction, UserStatus, AccountStatus, OperationStatus
+from application.repositories.persistence.entity_repository import EntityRepository, Range
+
+
+def query_shapes() -> Dict[str, Any]:
+    """
+    Every statement shape the repositories send to the database on the hot paths (listings and settlement).
+    """
+    users = EntityRepository(model=User)
+    accounts = EntityRepository(model=Account)
+    transactions = EntityRepository(model=Transaction)
+    user_id = str(uuid4())
+    account_id = str(uuid4())
+    cursor = transactions.encode_cursor(SimpleNamespace(last_updated=datetime.utcnow(), id=str(uuid4())))
+    movements_filters = {"user_id": user_id, "currency_name": "USD"}
+    return {
+        "movements": transactions.build_get_all_stmt(filters=movements_filters),
+        "movements_by_status": transactions.build_get_all_stmt(
+            filters={**movements_filters, "operation_status": OperationStatus.DONE}
+        ),
+        "movements_cursor": transactions.build_get_all_stmt(filters=movements_filters, cursor=cursor),
+        "movements_window": transactions.build_get_all_stmt(
+            filters={**movements_filters, "created_at": Range(datetime(2024, 5, 1), datetime(2024, 6, 1))},
+        ),
+        "settlement_claim": transactions.build_claim_stmt(
+            filters={"operation_status": OperationStatus.CREATED},
+            data={"operation_status": OperationStatus.PENDING},
+        ),
+        "settlement_accounts": accounts.build_get_many_stmt(keys=[account_id], columns=("id", "total"), lock=True),
+        "accounts_by_user": accounts.build_get_all_stmt(filters={"user_id": user_id}),
+        "accounts_created": accounts.build_get_all_stmt(filters={"status": AccountStatus.CREATED}),
+        "account_by_alias": select(Account).where(Account.alias == "alias"),
+        "users_created": users.build_get_all_stmt(filters={"status": UserStatus.CREATED}),
+        "user_by_email": select(User).where(User.email == "user@example.com"),
+    }
+
+
+def _sequential_scans(plan: Dict[str, Any]) -> List[str]:
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan.get("Relation Name"))
+    for sub_plan in plan.get("Plans", []):
+        scans.extend(_sequential_scans(sub_plan))
+    return scans
+
+
+def sequential_scans(connection, statement) -> List[str]:
+    """
+    Tables the plan of `statement` reads with a sequential scan, to call with enable_seqscan off.
+    """
+    sql = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) {}".format(sql)).scalar()
+    return _sequential_scans(plan[0]["Plan"])
+
+
+def check_query_plans() -> Dict[str, List[str]]:
+    """
+    Runs EXPLAIN over every query shape with sequential scans disabled: postgres still falls back to one
+    when no index can serve the query, so the check does not depend on how much data is seeded.
+
+    Returns:
+        Dict[str, List[str]]: query shape -> tables read with a sequential scan (empty when all plans are fine).
+    """
+    failures = {}
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, statement in query_shapes().items():
+                failures[name] = sequential_scans(connection, statement)
+        finally:
+            transaction.rollback()
+    return failures
@@ -0,0 +1,343 @@
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from sqlalchemy import select, exists, case, func, and_, tuple_, literal, text, table, column, union_all, cast, Date
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+
+from app import db
+from application.models import (
+    Account, AccountBalanceSnapshot, LedgerBalance, ReconciliationRun, Transaction, OperationStatus, OperationType,
+)
+from application.money import to_money
+from application.services.partition_service import PartitionService
+from settings import RECONCILIATION_LAG, RECONCILIATION_STATEMENT_TIMEOUT, EXPORT_YIELD_PER, TRANSACTIONS_ARCHIVE_SCHEMA
+
+# any constant works, it only has to be the same for every process running the reconciliation
+RECONCILIATION_LOCK_ID = 820417
+# columns of the transactions the movements are computed from, in the live table and in the archived partitions
+MOVEMENT_COLUMNS = (
+    "id", "linked_transaction_id", "operation", "operation_status", "amount", "origin_account_id",
+    "destination_account_id", "created_at", "last_updated",
+)
+
+
+def _transactions_tables(archived: List[str]) -> list:
+    transactions = Transaction.__table__
+    return [transactions] + [
+        table(name, *[column(key, transactions.c[key].type) for key in MOVEMENT_COLUMNS], schema=TRANSACTIONS_ARCHIVE_SCHEMA)
+        for name in archived
+    ]
+
+
+def _legs(since, archived: List[str]):
+    """
+    One row per DONE transaction updated after `since` (all of them when None) with the account it moves and
+    its signed `delta`, from the live table and the `archived` partitions.
+
+    The debit leg of a transfer is the row created by the user, the credit leg is created by settlement
+    later with the same linked_transaction_id, so a TRANSFER row is the credit leg when an older one exists.
+    The archived partitions are read along with the live table: a partition archived before the run
+    checkpointed its rows, or holding the debit leg of a live credit leg, doesn't skew the balances.
+    """
+    sources = _transactions_tables(archived)
+    prior = union_all(*[
+        select(source.c.linked_transaction_id, source.c.created_at, source.c.id).where(
+            source.c.operation == OperationType.TRANSFER
+        )
+        for source in sources
+    ]).subquery("prior")
+
+    def legs_of(source):
+        is_credit = and_(
+            source.c.operation == OperationType.TRANSFER,
+            exists().where(
+                prior.c.linked_transaction_id == source.c.linked_transaction_id,
+                tuple_(prior.c.created_at, prior.c.id) < tuple_(source.c.created_at, source.c.id),
+            ),
+        )
+        filters = [source.c.operation_status == OperationStatus.DONE]
+        if since is not None:
+            filters.append(source.c.last_updated > since)
+        return select(
+            case((is_credit, source.c.destination_account_id), else_=source.c.origin_account_id).label("account_id"),
+            # deposits and credit legs add, withdrawals, fees and debit legs subtract
+            case(
+                (source.c.operation == OperationType.DEPOSIT, source.c.amount),
+                (is_credit, source.c.amount),
+                else_=-source.c.amount,
+            ).label("delta"),
+            source.c.operation,
+            source.c.last_updated,
+        ).where(*filters)
+
+    return union_all(*[legs_of(source) for source in sources]).subquery("legs")
+
+
+def _movements(since, watermark, archived: List[str]):
+    """
+    Net change of every account from the DONE transactions updated after `since` (all of them when None),
+    split into the part up to the watermark (`settled`) and the one after it (`pending`). A single GROUP BY
+    over the transactions, postgres aggregates it without sending rows back.
+    """
+    legs = _legs(since, archived)
+    return (
+        select(
+            legs.c.account_id,
+            func.sum(legs.c.delta).filter(legs.c.last_updated <= watermark).label("settled"),
+            func.sum(legs.c.delta).filter(legs.c.last_updated > watermark).label("pending"),
+        )
+        .group_by(legs.c.account_id)
+        .cte("movements")
+    )
+
+
+def _report_stmt(movements, full: bool):
+    accounts = Account.__table__
+    ledger_balances = LedgerBalance.__table__
+    previous_total = literal(0) if full else func.coalesce(ledger_balances.c.total, 0)
+    ledger_total = previous_total + func.coalesce(movements.c.settled, 0)
+    stmt = (
+        select(
+            accounts.c.id,
+            accounts.c.total,
+            ledger_total.label("ledger_total"),
+            (ledger_total + func.coalesce(movements.c.pending, 0)).label("expected_total"),
+            movements.c.account_id.isnot(None).label("moved"),
+        )
+        .select_from(accounts)
+        .outerjoin(movements, movements.c.account_id == accounts.c.id)
+        .order_by(accounts.c.id)
+    )
+    if not full:
+        stmt = stmt.outerjoin(ledger_balances, ledger_balances.c.account_id == accounts.c.id)
+    return stmt
+
+
+def _save_ledger_balances(connection: Connection, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    table = LedgerBalance.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id],
+        set_={"total": stmt.excluded.total, "last_updated": func.now()},
+    )
+    connection.execute(stmt, rows)
+
+
+def reconcile_balances(full: bool = False, on_mismatch: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       chunk_size: int = EXPORT_YIELD_PER) -> Dict[str, Any]:
+    """
+    Compares every Account.total with the balance recomputed from its DONE transactions.
+
+    Incremental runs only aggregate the transactions updated after the watermark of the last run and add
+    them to the ledger balances it saved; `full` recomputes everything from scratch. Everything is read
+    from a single REPEATABLE READ snapshot (settlement commits account totals and transactions together,
+    so both sides are consistent) and accounts are streamed `chunk_size` at a time. The new watermark stays
+    RECONCILIATION_LAG seconds behind now(), so a settlement still running can't commit behind it. The
+    transaction runs under RECONCILIATION_STATEMENT_TIMEOUT rather than the request sized STATEMENT_TIMEOUT.
+
+    Once partitions of the transactions have been archived only incremental runs are possible, a full one
+    (or the first one) would miss the archived transactions.
+
+    Args:
+        full (bool): ignore the previous checkpoint.
+        on_mismatch (Callable, optional): called with every account whose total doesn't match.
+        progress (Callable, optional): called with the counters after every chunk of accounts.
+
+    Returns:
+        Dict[str, Any]: watermark of the run, accounts checked and mismatches found.
+
+    Raises:
+        RuntimeError: If another reconciliation is running, or a full one is asked once partitions are archived.
+    """
+    runs = ReconciliationRun.__table__
+    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection:
+        with connection.begin():
+            # a full run over every account outlasts the timeout of the api connections, only for this transaction
+            connection.execute(text("SET LOCAL statement_timeout = {:d}".format(RECONCILIATION_STATEMENT_TIMEOUT)))
+            if not connection.execute(select(func.pg_try_advisory_xact_lock(RECONCILIATION_LOCK_ID))).scalar():
+                raise RuntimeError("another reconciliation is running")
+
+            since = None
+            if not full:
+                since = connection.execute(select(func.max(runs.c.watermark))).scalar()
+                full = since is None
+            archived = PartitionService().list_archived(connection=connection)
+            if full and archived:
+                # archived partitions may have been dumped and dropped, their transactions are only certain to
+                # be accounted for in the ledger balances
+                raise RuntimeError(
+                    "transactions partitions are archived ({}), a full reconciliation can't see them: "
+                    "incremental runs start from the ledger balances".format(", ".join(archived))
+                )
+            watermark = connection.execute(select(func.now())).scalar().replace(tzinfo=None)
+            watermark -= timedelta(seconds=RECONCILIATION_LAG)
+            if since is not None and watermark < since:
+                watermark = since
+
+            data = {
+                "watermark": watermark.isoformat(),
+                "is_full": full,
+                "accounts": 0,
+                "mismatches": 0,
+            }
+            ledger_rows = []
+            stmt = _report_stmt(_movements(since, watermark, archived), full=full)
+            # on the statement: Connection.execution_options would stream the ledger writes below as well
+            for row in connection.execute(stmt.execution_options(yield_per=chunk_size)):
+                data["accounts"] += 1
+                if full or row.moved:
+                    ledger_rows.append({"account_id": row.id, "total": to_money(row.ledger_total)})
+                if to_money(row.total) != to_money(row.expected_total):
+                    data["mismatches"] += 1
+                    if on_mismatch is not None:
+                        on_mismatch({
+                            "account_id": str(row.id),
+                            "total": to_money(row.total),
+                            "expected_total": to_money(row.expected_total),
+                            "difference": to_money(Decimal(row.total) - Decimal(row.expected_total)),
+                        })
+                if len(ledger_rows) >= chunk_size:
+                    _save_ledger_balances(connection, ledger_rows)
+                    ledger_rows = []
+                if progress is not None and data["accounts"] % chunk_size == 0:
+                    progress(dict(data))
+            _save_ledger_balances(connection, ledger_rows)
+
+            connection.execute(runs.insert().values(
+                id=str(uuid4()),
+                watermark=watermark,
+                is_full=full,
+                accounts=data["accounts"],
+                mismatches=data["mismatches"],
+            ))
+    return data
+
+
+def reconcile_balances_job(full: bool = False, max_reported: int = 100,
+                           progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    reconcile_balances as a background job: the result keeps the first `max_reported` mismatches.
+    """
+    mismatches = []
+
+    def report(mismatch: Dict[str, Any]):
+        if len(mismatches) < max_reported:
+            mismatches.append({key: str(value) for key, value in mismatch.items()})
+
+    data = reconcile_balances(full=full, on_mismatch=report, progress=progress)
+    data["reported"] = mismatches
+    return data
+
+
+def _daily_movements_stmt(archived: List[str]):
+    legs = _legs(None, archived)
+    accounts = Account.__table__
+    snapshots = AccountBalanceSnapshot.__table__
+    day = cast(legs.c.last_updated, Date)
+    daily = (
+        select(
+            legs.c.account_id,
+            day.label("day"),
+            func.sum(legs.c.delta).label("net"),
+            func.coalesce(func.sum(legs.c.delta).filter(legs.c.delta > 0), 0).label("credits"),
+            func.coalesce(-func.sum(legs.c.delta).filter(legs.c.delta < 0), 0).label("debits"),
+            # settlement counts a transaction once per account it moves, its fee included
+            func.count().filter(legs.c.operation != OperationType.FEE).label("movements"),
+        )
+        .group_by(legs.c.account_id, day)
+        .subquery("daily")
+    )
+    firsts = (
+        select(snapshots.c.account_id, func.min(snapshots.c.day).label("day"))
+        .group_by(snapshots.c.account_id)
+        .subquery("firsts")
+    )
+    first_snapshot = snapshots.alias("first_snapshot")
+    return (
+        select(
+            daily,
+            accounts.c.total,
+            firsts.c.day.label("first_day"),
+            first_snapshot.c.opening_total.label("first_opening_total"),
+        )
+        .select_from(daily)
+        .join(accounts, accounts.c.id == daily.c.account_id)
+        .outerjoin(firsts, firsts.c.account_id == daily.c.account_id)
+        .outerjoin(first_snapshot, and_(
+            first_snapshot.c.account_id == firsts.c.account_id, first_snapshot.c.day == firsts.c.day,
+        ))
+        .order_by(daily.c.account_id, daily.c.day.desc())
+    )
+
+
+def _save_snapshots(connection: Connection, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    table = AccountBalanceSnapshot.__table__
+    # a day already recorded by settlement (or a previous backfill) is kept
+    connection.execute(insert(table).on_conflict_do_nothing(index_elements=[table.c.account_id, table.c.day]), rows)
+
+
+def backfill_balance_snapshots(chunk_size: int = EXPORT_YIELD_PER) -> Dict[str, Any]:
+    """
+    Builds the daily snapshots of the days settled before balance snapshots were recorded, from the DONE
+    transactions (the day of a transaction is the day of its last_updated), so balances and statements
+    before the first snapshot of an account are right. Only the days before the first snapshot of every
+    account (before today for an account without any) are built, walking back from the opening_total of
+    that snapshot (the current total, less what moved today, without one). Those days are never written
+    by settlement again and rows already there are kept, running it twice changes nothing.
+
+    Everything is read from a single REPEATABLE READ snapshot, account totals and transactions are
+    consistent. Archived partitions are read as well, the days of a dropped one can't be rebuilt.
+
+    Returns:
+        Dict[str, Any]: accounts and snapshots backfilled.
+    """
+    data = {"accounts": 0, "snapshots": 0}
+    backfilled = set()
+    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection:
+        with connection.begin():
+            connection.execute(text("SET LOCAL statement_timeout = {:d}".format(RECONCILIATION_STATEMENT_TIMEOUT)))
+            today = connection.execute(select(func.current_date())).scalar()
+            archived = PartitionService().list_archived(connection=connection)
+            stmt = _daily_movements_stmt(archived)
+
+            rows = []
+            account_id = None
+            closing_total = None
+            for row in connection.execute(stmt.execution_options(yield_per=chunk_size)):
+                if row.account_id != account_id:
+                    account_id = row.account_id
+                    cutoff = row.first_day or today
+                    closing_total = Decimal(row.first_opening_total if row.first_day else row.total)
+                if row.day >= cutoff:
+                    if row.first_day is None:
+                        # moved today, before the snapshot of today is recorded
+                        closing_total -= Decimal(row.net)
+                    continue
+                opening_total = closing_total - Decimal(row.net)
+                rows.append({
+                    "account_id": account_id,
+                    "day": row.day,
+                    "opening_total": to_money(opening_total),
+                    "closing_total": to_money(closing_total),
+                    "credits": to_money(row.credits),
+                    "debits": to_money(row.debits),
+                    "movements": row.movements,
+                })
+                closing_total = opening_total
+                backfilled.add(account_id)
+                if len(rows) >= chunk_size:
+                    _save_snapshots(connection, rows)
+                    data["snapshots"] += len(rows)
+                    rows = []
+            _save_snapshots(connection, rows)
+            data["snapshots"] += len(rows)
+    data["accounts"] = len(backfilled)
+    return data
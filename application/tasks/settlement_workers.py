@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import socket
+import time
+from typing import Any, Dict
+
+from app import app, db
+from application.repositories.persistence.unit_of_work import unit_of_work
+from application.services.transaction_event_service import TransactionEventService
+from application.tasks.processes import run_processes
+from application.tasks.transaction_tasks import execute_transactions, search_transaction_created, settle_batch
+from settings import (
+    SETTLEMENT_BATCH_SIZE, SETTLEMENT_POLL_INTERVAL, SETTLEMENT_WORKERS, SETTLEMENT_MICRO_BATCH_SIZE, SETTLEMENT_MAX_BACKOFF,
+    SETTLEMENT_STREAM_MAX_DELIVERIES,
+)
+
+
+def _backoff(failures: int, poll_interval: float) -> float:
+    return min(SETTLEMENT_MAX_BACKOFF, max(poll_interval, 0.1) * 2 ** failures)
+
+
+def drain_transactions(batch_size: int = SETTLEMENT_BATCH_SIZE, poll_interval: float = SETTLEMENT_POLL_INTERVAL,
+                       drain: bool = True, retry_errors: bool = False) -> Dict[str, Any]:
+    """
+    Settles batches until there is nothing left (drain=True) or forever, sleeping `poll_interval`
+    seconds whenever the queue is empty.
+
+    Args:
+        retry_errors (bool): log a batch that raised (database or redis gone...) and retry with an exponential
+            backoff up to SETTLEMENT_MAX_BACKOFF seconds instead of raising. Its transactions were rolled back
+            to CREATED.
+    """
+    data = {
+        "total": 0,
+        "success": 0,
+        "failed": 0,
+        "deferred": 0,
+    }
+    failures = 0
+    with app.app_context():
+        while True:
+            try:
+                result = execute_transactions(batch_size=batch_size)
+            except Exception:
+                if not retry_errors:
+                    raise
+                delay = _backoff(failures, poll_interval)
+                failures += 1
+                app.logger.exception("Settlement batch failed, retrying in {:.1f}s".format(delay))
+                # start over with a new session, the failed one may hold a broken connection
+                db.session.remove()
+                time.sleep(delay)
+                continue
+            failures = 0
+            for key in data:
+                data[key] += result[key]
+            # empty queue, or only transfers still waiting for their rate
+            if result["total"] == result["deferred"]:
+                if drain:
+                    return data
+                time.sleep(poll_interval)
+
+
+def _settlement_worker(batch_size: int, poll_interval: float, drain: bool):
+    try:
+        data = drain_transactions(batch_size=batch_size, poll_interval=poll_interval, drain=drain, retry_errors=True)
+    except KeyboardInterrupt:
+        return
+    app.logger.info("{}: {}".format(multiprocessing.current_process().name, data))
+
+
+def run_settlement_workers(workers: int = SETTLEMENT_WORKERS, batch_size: int = SETTLEMENT_BATCH_SIZE,
+                           poll_interval: float = SETTLEMENT_POLL_INTERVAL, drain: bool = False):
+    """
+    Starts `workers` settlement processes draining the CREATED queue in parallel. Batches are claimed with
+    SKIP LOCKED so the workers never pick the same transaction.
+    """
+    run_processes(_settlement_worker, (batch_size, poll_interval, drain), workers=workers, name="settlement-worker")
+
+
+def _settle_events(events: Dict[str, str]):
+    # ids not CREATED anymore (already settled or taken by the poller) are simply skipped
+    transaction_ids = [transaction_id for transaction_id in events.values() if transaction_id]
+    if transaction_ids:
+        with unit_of_work():
+            settle_batch(search_transaction_created(limit=len(transaction_ids), ids=transaction_ids))
+
+
+def _settle_one_by_one(event_service: TransactionEventService, events: Dict[str, str]) -> Dict[str, str]:
+    """
+    Settles the events of a failed batch one at a time and acks the ones that go through.
+
+    Returns:
+        Dict[str, str]: the events that failed again, left pending.
+    """
+    failed = {}
+    for event_id, transaction_id in events.items():
+        try:
+            _settle_events({event_id: transaction_id})
+        except Exception:
+            app.logger.exception("Settlement failed for event {} (transaction {})".format(event_id, transaction_id))
+            db.session.remove()
+            failed[event_id] = transaction_id
+            continue
+        event_service.ack([event_id])
+    return failed
+
+
+def _dead_letter_exhausted(event_service: TransactionEventService, events: Dict[str, str]):
+    """
+    Moves the events delivered SETTLEMENT_STREAM_MAX_DELIVERIES times to the dead letter stream, so they
+    aren't redelivered forever. Their transactions stay CREATED, the settlement poller still picks them up.
+    """
+    deliveries = event_service.deliveries(list(events))
+    exhausted = {
+        event_id: transaction_id for event_id, transaction_id in events.items()
+        if deliveries.get(event_id, 0) >= SETTLEMENT_STREAM_MAX_DELIVERIES
+    }
+    if exhausted:
+        app.logger.error("Moving events {} to the dead letter stream".format(list(exhausted)))
+        event_service.dead_letter(exhausted)
+
+
+def _consume_events(event_service: TransactionEventService, consumer: str, batch_size: int) -> bool:
+    """
+    Reads and settles one micro-batch of events.
+
+    Returns:
+        bool: False when there were events and none of them could be settled.
+    """
+    events = event_service.read(consumer=consumer, count=batch_size)
+    if not events:
+        return True
+    try:
+        _settle_events(events)
+    except Exception:
+        app.logger.exception("Settlement failed for events {}, settling them one by one".format(list(events)))
+        db.session.remove()
+        failed = _settle_one_by_one(event_service, events)
+        if failed:
+            _dead_letter_exhausted(event_service, failed)
+        return len(failed) < len(events)
+    event_service.ack(list(events))
+    return True
+
+
+def consume_transaction_events(consumer: str, batch_size: int = SETTLEMENT_MICRO_BATCH_SIZE,
+                               poll_interval: float = SETTLEMENT_POLL_INTERVAL):
+    """
+    Settles transactions as soon as they are created: reads their ids from the settlement stream in
+    micro-batches and acks the events once the batch is committed.
+
+    When a batch fails its events are settled one at a time, so a single bad event doesn't hold the others
+    back: the ones that fail again stay pending, are redelivered later and go to the dead letter stream
+    after SETTLEMENT_STREAM_MAX_DELIVERIES deliveries. While nothing goes through (redis or the database
+    gone) the consumer backs off exponentially up to SETTLEMENT_MAX_BACKOFF seconds.
+    """
+    event_service = TransactionEventService()
+    group_ready = False
+    failures = 0
+    with app.app_context():
+        while True:
+            try:
+                if not group_ready:
+                    event_service.ensure_group()
+                    group_ready = True
+                if _consume_events(event_service, consumer, batch_size):
+                    failures = 0
+                    continue
+            except Exception:
+                app.logger.exception("Settlement consumer failed")
+                db.session.remove()
+            delay = _backoff(failures, poll_interval)
+            failures += 1
+            app.logger.warning("Settlement consumer retrying in {:.1f}s".format(delay))
+            time.sleep(delay)
+
+
+def _settlement_consumer(batch_size: int):
+    try:
+        consume_transaction_events(consumer=f"{socket.gethostname()}-{os.getpid()}", batch_size=batch_size)
+    except KeyboardInterrupt:
+        return
+
+
+def run_settlement_consumers(workers: int = SETTLEMENT_WORKERS, batch_size: int = SETTLEMENT_MICRO_BATCH_SIZE):
+    run_processes(_settlement_consumer, (batch_size,), workers=workers, name="settlement-consumer")
@@ -1,148 +1,333 @@
-from typing import List
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from app import db
-from application.models import Transaction, Account, OperationStatus, OperationType, AccountStatus, UserStatus
+from sqlalchemy import update, values, column, cast, String, Numeric
+from sqlalchemy.dialects.postgresql import UUID
+
+from app import app, db
+from application.models import (
+    Transaction, Account, AccountBalanceSnapshot, User, OperationStatus, OperationType, AccountStatus, UserStatus,
+)
 from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.unit_of_work import unit_of_work
 from application.services.transaction_service import TransactionService
-from application.services.api_rate_service import ApiRateService
-from settings import FEE_PERCENTAGE
+from application.services.api_rate_service import ApiRateService, RateUnavailableError
+from application.services.balance_snapshot_service import BalanceSnapshotService
+from application.money import to_money, MONEY_PRECISION, MONEY_SCALE
+from settings import FEE_PERCENTAGE, SETTLEMENT_BATCH_SIZE
 
 
 repository_transaction = EntityRepository(model=Transaction)
 service_transaction = TransactionService(repository=repository_transaction)
 repository_account = EntityRepository(model=Account)
 service_account = TransactionService(repository=repository_account)
+repository_user = EntityRepository(model=User)
 api_rate_Service = ApiRateService()
+service_balance_snapshot = BalanceSnapshotService(repository=EntityRepository(model=AccountBalanceSnapshot))
+fee_percentage = Decimal(str(FEE_PERCENTAGE))
+
+# settlement only reads these columns, rows are loaded instead of entities tracked by the session
+SETTLEMENT_TRANSACTION_COLUMNS = (
+    "id", "operation", "amount", "origin_account_id", "destination_account_id", "linked_transaction_id", "created_at",
+)
+SETTLEMENT_ACCOUNT_COLUMNS = ("id", "total", "status", "currency_name", "user_id")
+
+
+def search_transaction_created(limit: int = SETTLEMENT_BATCH_SIZE, ids: List[str] = None) -> List[Transaction]:
+    """
+    Claims the oldest CREATED transactions (only among `ids` when given) flipping them to PENDING. Rows are
+    locked with SKIP LOCKED until the batch is committed, so parallel workers never settle the same
+    transaction twice and a crashed worker gives its rows back as CREATED.
+    """
+    filters = {"operation_status": OperationStatus.CREATED}
+    if ids is not None:
+        filters["id"] = ids
+    transactions = service_transaction.repository.claim(
+        filters=filters,
+        data={"operation_status": OperationStatus.PENDING},
+        limit=limit,
+        columns=SETTLEMENT_TRANSACTION_COLUMNS,
+    )
+    # UPDATE ... RETURNING gives the rows in no particular order, they are settled in the order they were created
+    return sorted(transactions, key=lambda transaction: (transaction.created_at, str(transaction.id)))
+
+
+def _chunked(iterator: Iterable[Transaction], size: int) -> Iterator[List[Transaction]]:
+    iterator = iter(iterator)
+    while True:
+        chunk = [transaction for transaction in islice(iterator, size) if transaction is not None]
+        if not chunk:
+            return
+        yield chunk
+
+
+def _load_batch_context(transactions: List[Transaction]):
+    """
+    Loads every account and the status of every owner referenced by the batch (two queries in total). Owner
+    statuses are read inside the batch transaction rather than from the account metadata cache: a user
+    blocked a moment ago must not receive money.
+
+    Accounts are locked FOR UPDATE sorted by id: every worker takes its locks in the same order, so parallel
+    settlement never deadlocks, and an account shared by many transactions of the batch is locked only once.
+    """
+    account_ids = set()
+    for transaction in transactions:
+        account_ids.add(str(transaction.origin_account_id))
+        account_ids.add(str(transaction.destination_account_id))
+
+    accounts = {
+        str(account.id): account
+        for account in repository_account.get_many(account_ids, columns=SETTLEMENT_ACCOUNT_COLUMNS, lock=True)
+    }
+
+    user_ids = {account.user_id for account in accounts.values()}
+    users_status = {str(user.id): user.status for user in repository_user.get_many(user_ids, columns=("id", "status"))}
+    return accounts, users_status
+
+
+def _currency_pairs(transactions: List[Transaction]) -> set:
+    """
+    Distinct (origin, destination) currencies of the transfers of the batch, so rates are resolved once per pair.
+    Currencies are read without locking the accounts: rates are fetched before settlement takes the locks.
+    """
+    transfers = [transaction for transaction in transactions if transaction.operation == OperationType.TRANSFER]
+    account_ids = set()
+    for transaction in transfers:
+        account_ids.add(str(transaction.origin_account_id))
+        account_ids.add(str(transaction.destination_account_id))
+    if not account_ids:
+        return set()
+    currencies = {
+        str(account.id): account.currency_name
+        for account in repository_account.get_many(account_ids, columns=("id", "currency_name"))
+    }
+    pairs = set()
+    for transaction in transfers:
+        origin_currency_name = currencies.get(str(transaction.origin_account_id))
+        destination_currency_name = currencies.get(str(transaction.destination_account_id))
+        if origin_currency_name is not None and destination_currency_name is not None:
+            pairs.add((origin_currency_name, destination_currency_name))
+    return pairs
+
+
+def _settle_transaction(
+    transaction: Transaction,
+    accounts: Dict[str, Account],
+    users_status: Dict[str, UserStatus],
+    rates: Dict[Tuple[str, str], float],
+    totals: Dict[str, Decimal],
+    entries: List[Dict[str, Any]],
+) -> Optional[Decimal]:
+    """
+    Applies a single transaction over the in-memory balances of the batch.
+
+    ``totals`` is only modified once the transaction is known to succeed, so a failure never leaves
+    half applied balances behind.
+
+    Returns:
+        Optional[Decimal]: total of the account after the operation, None if it could not be applied.
+
+    Raises:
+        RateUnavailableError: If the transfer is between currencies whose rate is unavailable.
+    """
+    origin_account_instance = accounts[str(transaction.origin_account_id)]
+    destination_account_instance = accounts[str(transaction.destination_account_id)]
+    origin_id = str(origin_account_instance.id)
+    destination_id = str(destination_account_instance.id)
+    amount = to_money(transaction.amount)
+
+    # both user and account of destination have to be active!
+    if destination_account_instance.status != AccountStatus.ACTIVE:
+        return None
+    if users_status.get(str(destination_account_instance.user_id)) != UserStatus.ACTIVE:
+        return None
+
+    if transaction.operation == OperationType.DEPOSIT:
+        # Manual/external process Validate deposit is in out account so we proceed
+        after_deposit_total = to_money(totals[origin_id] + amount)
+        totals[origin_id] = after_deposit_total  # intentionally ignored destination_account_id
+        return after_deposit_total
 
+    if transaction.operation == OperationType.WITHDRAWAL:
+        # Manual/external process execute transfer from our bank to another!
+        new_amount = to_money(totals[origin_id] - amount)
+        if new_amount < 0:
+            return None
+        totals[origin_id] = new_amount  # intentionally ignored destination_account_id
+        return new_amount
 
-def search_transaction_created() -> List[Transaction]:
-    transactions_created = service_transaction.repository.get_all(filters={"operation_status": OperationStatus.CREATED})
-    for transaction_created in transactions_created:
-        data = {"operation_status": OperationStatus.PENDING, "id": transaction_created.id}
-        transaction_created.operation_status = OperationStatus.PENDING
-        service_transaction.repository.update(data)
-        yield transaction_created
+    if transaction.operation == OperationType.TRANSFER:
+        # if it's transfer between currencies we apply charge
+        is_transfer_between_currencies = origin_account_instance.currency_name != destination_account_instance.currency_name
+        pair = (origin_account_instance.currency_name, destination_account_instance.currency_name)
+        if rates.get(pair) is None:
+            raise RateUnavailableError("no rate for {}".format(pair))
+        conversion_rate = Decimal(str(rates[pair]))
+        transaction_fee = to_money(amount * fee_percentage) if is_transfer_between_currencies else to_money(0)
+        converted_amount = to_money(amount * conversion_rate)
+        origin_total = totals[origin_id]
+        fee_total = to_money(origin_total - transaction_fee)
+        # sender has enough money to transfer? balance - amount of transaction + fee (if apply)
+        if origin_total - (amount + transaction_fee) < 0:
+            return None
+
+        # with fee
+        transaction_total = to_money(origin_total - (amount + transaction_fee))
+        # destination receive: total of money (already have) + (transaction amount * conversion rate)
+        destination_total = transaction_total if destination_id == origin_id else totals[destination_id]
+        destination_new_total = to_money(destination_total + converted_amount)
+
+        #  CREATE a transaction that do not affect the balance but the user will see it in his movements
+        reference = f"Exchange from {origin_account_instance.currency_name}" if is_transfer_between_currencies else f"Transferencia regular"
+        transaction_entries = [dict(
+            amount=converted_amount,
+            total=destination_new_total,
+            operation=OperationType.TRANSFER,
+            operation_status=OperationStatus.DONE,
+            origin_account_id=origin_account_instance.id,
+            destination_account_id=destination_account_instance.id,
+            user_id=destination_account_instance.user_id,
+            currency_name=destination_account_instance.currency_name,
+            linked_transaction_id=transaction.linked_transaction_id,
+            reference=reference
+        )]
+        if is_transfer_between_currencies:
+            # create transaction fee so the user known what was charged
+            transaction_entries.append(dict(
+                amount=transaction_fee,
+                total=fee_total,
+                operation=OperationType.FEE,
+                operation_status=OperationStatus.DONE,
+                origin_account_id=origin_account_instance.id,
+                destination_account_id=origin_account_instance.id,
+                user_id=origin_account_instance.user_id,
+                currency_name=origin_account_instance.currency_name,
+                linked_transaction_id=transaction.linked_transaction_id,
+                reference=None,
+            ))
+
+        totals[origin_id] = transaction_total
+        totals[destination_id] = destination_new_total
+        entries.extend(transaction_entries)
+        return transaction_total
+
+    # type is not valid
     return None
 
 
-def execute_transactions(iterator=None):
+def _apply_account_deltas(deltas: Dict[str, Decimal]):
+    """
+    Applies the net change of every account touched by the batch with a single
+    UPDATE accounts ... FROM (VALUES ...) statement, one row write per account whatever the number of
+    transactions that hit it.
+    """
+    if not deltas:
+        return
+    deltas_values = values(
+        column("id", String), column("delta", Numeric(MONEY_PRECISION, MONEY_SCALE)), name="deltas"
+    ).data([(account_id, delta) for account_id, delta in sorted(deltas.items())])
+    stmt = (
+        update(Account.__table__)
+        .where(Account.__table__.c.id == cast(deltas_values.c.id, UUID))
+        .values(total=Account.__table__.c.total + cast(deltas_values.c.delta, Numeric(MONEY_PRECISION, MONEY_SCALE)))
+    )
+    db.session.execute(stmt)
+
+
+def _add_flow(flows: Dict[str, Dict[str, Any]], account_id: str, change: Decimal):
+    flow = flows.setdefault(account_id, {"credits": Decimal(0), "debits": Decimal(0), "movements": 0})
+    if change > 0:
+        flow["credits"] += change
+    else:
+        flow["debits"] -= change
+    flow["movements"] += 1
+
+
+def settle_batch(transactions: List[Transaction]) -> Dict[str, int]:
+    """
+    Settles a batch of transactions in a single unit of work (one commit, joined to the caller's when
+    there is one open).
+
+    Accounts and owners are bulk loaded once, every balance change is computed in memory (in order, so
+    several transactions over the same account see each other) and account totals, transaction statuses,
+    the DONE/FEE rows generated by transfers and the daily balance snapshots are written together.
+    Transfers whose rate is unavailable are put back to CREATED (`deferred`) and settled by a later batch.
+    """
+    data = {
+        "total": len(transactions),
+        "success": 0,
+        "failed": 0,
+        "deferred": 0,
+    }
+    if not transactions:
+        return data
+
+    with unit_of_work():
+        # upstream rate calls can be slow, they run before the accounts are locked: only in memory work
+        # happens while the locks are held
+        rates = api_rate_Service.get_rates(_currency_pairs(transactions))
+        accounts, users_status = _load_batch_context(transactions)
+        totals = {account_id: to_money(account.total) for account_id, account in accounts.items()}
+        entries = []
+        updates = []
+        flows = {}
+        for transaction in transactions:
+            transaction_total = None
+            previous_totals = {
+                account_id: totals.get(account_id)
+                for account_id in (str(transaction.origin_account_id), str(transaction.destination_account_id))
+            }
+            try:
+                transaction_total = _settle_transaction(transaction, accounts, users_status, rates, totals, entries)
+            except RateUnavailableError:
+                updates.append({"id": transaction.id, "operation_status": OperationStatus.CREATED})
+                data["deferred"] += 1
+                continue
+            except Exception:
+                app.logger.exception("Settlement failed for transaction {}".format(transaction.id))
+
+            if transaction_total is not None:
+                updates.append({"id": transaction.id, "total": transaction_total, "operation_status": OperationStatus.DONE})
+                data["success"] += 1
+                for account_id, previous_total in previous_totals.items():
+                    if totals[account_id] != previous_total:
+                        _add_flow(flows, account_id, totals[account_id] - previous_total)
+            else:
+                updates.append({"id": transaction.id, "operation_status": OperationStatus.FAILED})
+                data["failed"] += 1
+
+        deltas = {
+            account_id: totals[account_id] - account.total
+            for account_id, account in accounts.items()
+            if totals[account_id] != account.total
+        }
+        _apply_account_deltas(deltas)
+        for account_id, flow in flows.items():
+            flow["opening_total"] = to_money(accounts[account_id].total)
+            flow["closing_total"] = totals[account_id]
+        service_balance_snapshot.record(flows)
+        repository_transaction.update_many(updates)
+        repository_transaction.create_many(entries)
+    return data
+
+
+def execute_transactions(iterator: Iterable[Transaction] = None, batch_size: int = SETTLEMENT_BATCH_SIZE) -> Dict[str, Any]:
     if iterator is None:
-        iterator = search_transaction_created()
+        # claim and settlement commit together
+        with unit_of_work():
+            return settle_batch(search_transaction_created(limit=batch_size))
+
+    batches = _chunked(iterator, batch_size)
     data = {
         "total": 0,
         "success": 0,
         "failed": 0,
+        "deferred": 0,
     }
-    for transaction in iterator:
-        if transaction is None:
-            break
-        data["total"] += 1
-        transaction_is_done: bool = False
-        transaction_total: float = 0.0
-        try:
-            origin_account_instance = service_account.repository.get(key=transaction.origin_account_id)
-            destination_account_instance = service_account.repository.get(key=transaction.destination_account_id)
-            # both user and account of destination have to be active!
-            if destination_account_instance.status == AccountStatus.ACTIVE and destination_account_instance.user.status == UserStatus.ACTIVE:
-                if transaction.operation == OperationType.DEPOSIT:
-                    # Manual/external process Validate deposit is in out account so we proceed
-                    after_deposit_total = round(origin_account_instance.total + transaction.amount, 4)
-                    service_account.repository.update(
-                        data=dict(
-                            id=origin_account_instance.id,  # intentionally ignored destination_account_id
-                            total=after_deposit_total,
-                        )
-                    )
-                    transaction_total = after_deposit_total
-                    transaction_is_done = True
-                elif transaction.operation == OperationType.WITHDRAWAL:
-                    # Manual/external process execute transfer from our bank to another!
-                    new_amount = round(origin_account_instance.total - transaction.amount, 4)
-                    if new_amount >= 0:
-                        service_account.repository.update(
-                            data=dict(
-                                id=origin_account_instance.id,  # intentionally ignored destination_account_id
-                                total=new_amount,
-                            )
-                        )
-                        transaction_is_done = True
-                        transaction_total = new_amount
-                elif transaction.operation == OperationType.TRANSFER:
-                    # if it's transfer between currencies we apply charge
-                    is_transfer_between_currencies = origin_account_instance.currency_name != destination_account_instance.currency_name
-                    conversion_rate = api_rate_Service.get_rate(
-                        origin_currency_name=origin_account_instance.currency_name,
-                        destination_currency_name=destination_account_instance.currency_name
-                    )
-                    transaction_fee = transaction.amount * FEE_PERCENTAGE if is_transfer_between_currencies else 0.0
-                    fee_total = round(origin_account_instance.total - transaction_fee, 4)
-                    # sender has enough money to transfer? balance - amount of transaction + fee (if apply)
-                    if origin_account_instance.total - (transaction.amount + transaction_fee) >= 0:
-                        # destination receive: total of money (already have) + (transaction amount * conversion rate)
-                        destination_new_total = round(
-                                destination_account_instance.total + (transaction.amount * conversion_rate), 4
-                        )
-                        # with fee
-                        transaction_total = round(origin_account_instance.total - (transaction.amount + transaction_fee), 4)
-                        #  CREATE a transaction that do not affect the balance but the user will see it in his movements
-                        reference = f"Exchange from {origin_account_instance.currency_name}" if is_transfer_between_currencies else f"Transferencia regular"
-                        transaction_transfer = Transaction(
-                            amount=round(transaction.amount * conversion_rate, 4),
-                            total=destination_new_total,
-                            operation=OperationType.TRANSFER,
-                            operation_status=OperationStatus.DONE,
-                            origin_account_id=origin_account_instance.id,
-                            destination_account_id=destination_account_instance.id,
-                            user_id=destination_account_instance.user_id,
-                            currency_name=destination_account_instance.currency_name,
-                            linked_transaction_id=transaction.linked_transaction_id,
-                            reference=reference
-                        )
-                        db.session.add(transaction_transfer)
-                        accounts = [
-                            {
-                                "id": origin_account_instance.id,
-                                "total" : transaction_total,
-                             },
-                            {
-                                "id": destination_account_instance.id,
-                                "total": destination_new_total
-                            }
-                        ]
-                        db.session.bulk_update_mappings(Account, accounts)
-                        db.session.commit()
-                        if is_transfer_between_currencies:
-                            # create transaction fee so the user known what was charged
-                            transaction_fee_instance = Transaction(
-                                amount=transaction_fee,
-                                total=fee_total,
-                                operation = OperationType.FEE,
-                                operation_status = OperationStatus.DONE,
-                                origin_account_id =origin_account_instance.id,
-                                destination_account_id =origin_account_instance.id,
-                                user_id=origin_account_instance.user_id,
-                                currency_name=origin_account_instance.currency_name,
-                                linked_transaction_id=transaction.linked_transaction_id,
-                            )
-                            db.session.add(transaction_fee_instance)
-                            db.session.commit()
-                        
-                        transaction_is_done = True
-            else:
-                # type is not valid
-                pass
-        except Exception as e:
-            print(e)  # TODO: log error!
-            db.session.rollback()
-
-        if transaction_is_done:
-            transaction.total = transaction_total
-            transaction.operation_status = OperationStatus.DONE
-            data["success"] += 1
-        else:
-            transaction.operation_status = OperationStatus.FAILED
-            data["failed"] += 1
-        db.session.add(transaction)
-        db.session.commit()
-
-    return data
\ No newline at end of file
+    for batch in batches:
+        result = settle_batch(batch)
+        for key in data:
+            data[key] += result[key]
+
+    return data
@@ -1,26 +1,31 @@
-from app import db
+from typing import Any, Callable, Dict, Optional
+
 from application.models import User, UserStatus
 from application.repositories.persistence.entity_repository import EntityRepository
 from application.services.user_service import UserService
+from application.tasks.validation_tasks import validate_created
+from settings import VALIDATION_CHUNK_SIZE
 
 repository = EntityRepository(model=User)
 service = UserService(repository=repository)
 
 
-def validate_users_created():
-    users_created = service.repository.get_all(filters={"status": UserStatus.CREATED})
-    if len(users_created) == 0:
-        return {"total": 0}
+def validate_user(user: User) -> bool:
+    # Simulate a validation automated process!!
+    return True
 
-    users_validated = []
-    for user_created in users_created:
-        # Simulate a validation automated process!!
-        user_created = {
-            "status": UserStatus.ACTIVE,
-            "id": user_created.id
-        }
-        users_validated.append(user_created)
 
-    db.session.bulk_update_mappings(User, users_validated)
-    db.session.commit()
-    return {"total": len(users_validated)}
+def validate_users_created(chunk_size: int = VALIDATION_CHUNK_SIZE, validator: Callable[[User], bool] = validate_user,
+                           progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, int]:
+    """
+    Activates every CREATED user, the ones rejected by `validator` are blocked.
+    """
+    return validate_created(
+        service.repository,
+        created_status=UserStatus.CREATED,
+        active_status=UserStatus.ACTIVE,
+        rejected_status=UserStatus.BLOCKED,
+        validator=validator,
+        chunk_size=chunk_size,
+        progress=progress,
+    )
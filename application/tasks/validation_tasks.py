@@ -0,0 +1,64 @@
+from typing import Any, Callable, Dict, Optional
+
+from app import app, db
+from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.unit_of_work import unit_of_work, savepoint
+from settings import VALIDATION_CHUNK_SIZE
+
+
+def validate_created(repository: EntityRepository, created_status, active_status, rejected_status,
+                     validator: Optional[Callable[[db.Model], bool]] = None, chunk_size: int = VALIDATION_CHUNK_SIZE,
+                     progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, int]:
+    """
+    Promotes the whole CREATED backlog of a model, `chunk_size` records per commit: every chunk is claimed
+    and flipped to `active_status` with a single UPDATE ... RETURNING, then the records the validator
+    rejects are moved to `rejected_status`. Running it twice at once is safe, chunks are claimed with
+    SKIP LOCKED.
+
+    Every validator call runs in its own savepoint: a validator that raises only rolls back what it wrote
+    for that record, which is rejected (and counted in `errors`) while the rest of the chunk goes on.
+
+    Args:
+        repository (EntityRepository): repository of the model validated.
+        validator (Callable, optional): receives every claimed record, False rejects it. Defaults to accept all.
+            It may write to the database, inside the savepoint of the record.
+        chunk_size (int): records claimed per chunk.
+        progress (Callable, optional): called with the counters after every chunk.
+
+    Returns:
+        Dict[str, int]: total, active and rejected records, and the validator calls that raised.
+    """
+    data = {
+        "total": 0,
+        "active": 0,
+        "rejected": 0,
+        "errors": 0,
+    }
+    while True:
+        with unit_of_work():
+            records = repository.claim(
+                filters={"status": created_status},
+                data={"status": active_status},
+                limit=chunk_size,
+            )
+            rejected = []
+            if validator is not None:
+                for record in records:
+                    try:
+                        with savepoint():
+                            accepted = validator(record)
+                    except Exception:
+                        app.logger.exception("Validation failed for {}".format(record.id))
+                        data["errors"] += 1
+                        accepted = False
+                    if not accepted:
+                        rejected.append({"id": record.id, "status": rejected_status})
+                repository.update_many(rejected)
+
+        if not records:
+            return data
+        data["total"] += len(records)
+        data["active"] += len(records) - len(rejected)
+        data["rejected"] += len(rejected)
+        if progress is not None:
+            progress(dict(data))
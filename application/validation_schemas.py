@@ -1,7 +1,26 @@
+from decimal import ROUND_HALF_EVEN
+
 from marshmallow import Schema, fields, validate, ValidationError
 from marshmallow_enum import EnumField
 
 from application.default import AccountStatus, UserStatus, OperationStatus, OperationType
+from application.money import MONEY_SCALE
+
+
+class Money(fields.Decimal):
+    """
+    Amount loaded as an exact Decimal of MONEY_SCALE places (banker's rounding), dumped as a float like
+    the other amounts of the api.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(places=MONEY_SCALE, rounding=ROUND_HALF_EVEN, **kwargs)
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is None:
+            return None
+        return float(value)
+
 
 class UserSchema(Schema):
     id = fields.Str(dump_only=True)
@@ -32,7 +51,7 @@ class LoginSchema(Schema):
 class TransactionSchema(Schema):
     id = fields.UUID(dump_only=True)
     total = fields.Float(dump_only=True)
-    amount = fields.Float(required=True, validate=validate.Range(min=0))
+    amount = Money(required=True, validate=validate.Range(min=0))
     operation = EnumField(OperationType, by_value=True, required=True)
     operation_status = EnumField(OperationStatus, by_value=True, dump_only=True)
     origin_account_id = fields.UUID(required=True)
@@ -65,3 +84,33 @@ class AccountSchema(Schema):
 
 class CurrencySchema(Schema):
     name = fields.Str(required=True)
+
+
+class BalanceQuerySchema(Schema):
+    date = fields.Date()
+
+
+class StatementQuerySchema(Schema):
+    date_from = fields.Date(required=True, data_key="from")
+    date_to = fields.Date(required=True, data_key="to")
+
+
+class BalanceSnapshotSchema(Schema):
+    day = fields.Date(dump_only=True)
+    opening_total = fields.Float(dump_only=True)
+    closing_total = fields.Float(dump_only=True)
+    credits = fields.Float(dump_only=True)
+    debits = fields.Float(dump_only=True)
+    movements = fields.Int(dump_only=True)
+
+
+class StatementSchema(Schema):
+    account_id = fields.UUID(dump_only=True)
+    date_from = fields.Date(dump_only=True)
+    date_to = fields.Date(dump_only=True)
+    opening_total = fields.Float(dump_only=True)
+    closing_total = fields.Float(dump_only=True)
+    credits = fields.Float(dump_only=True)
+    debits = fields.Float(dump_only=True)
+    movements = fields.Int(dump_only=True)
+    days = fields.Nested(BalanceSnapshotSchema, many=True, dump_only=True)
@@ -1,5 +1,6 @@
 from application.views.accounts_view import *
 from application.views.currency_view import *
 from application.views.health_checks_view import *
+from application.views.jobs_view import *
 from application.views.transactions_view import *
 from application.views.users_view import *
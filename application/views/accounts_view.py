@@ -1,29 +1,59 @@
+from datetime import date
+
 from app import app
 from flask import request, jsonify, g
 
-from application.models import Account, AccountStatus
+from application.models import Account, AccountStatus, AccountBalanceSnapshot
 from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.replicas import read_replica
 from application.services.account_service import AccountService
-from application.validation_schemas import AccountSchema
+from application.validation_schemas import AccountSchema, BalanceQuerySchema, StatementQuerySchema, StatementSchema
+from application.serializers import get_serializer
 from application.authentication import token_required
-from application.tasks.account_tasks import validate_accounts_created
+from application.tasks.job_tasks import VALIDATE_ACCOUNTS_JOB
 from application.services.auth_service import AuthService
+from application.services.job_service import JobService
+from application.services.balance_snapshot_service import BalanceSnapshotService
+from application.services.account_metadata_service import account_metadata_service
 
 
 repository = EntityRepository(model=Account)
 service = AccountService(repository=repository)
 auth = AuthService()
+job_service = JobService()
+balance_snapshot_service = BalanceSnapshotService(repository=EntityRepository(model=AccountBalanceSnapshot))
+
+
+def _get_owned_account(pk: str):
+    # ownership comes from the metadata cache, the account is only loaded for its owner
+    metadata = account_metadata_service.get(pk)
+    if metadata is None:
+        raise ValueError(f"account {pk} not found")
+    if not auth.is_admin() and metadata.user_id != g.user_id:
+        return None
+    account = repository.get(key=pk)
+    if account is None:
+        # known by the primary, not by the replica yet
+        raise ValueError(f"account {pk} not found")
+    return account
 
 
 @app.route("/account/", methods=["GET"])
 @token_required
+@read_replica
 def get_accounts():
     user_id = request.args.get('user_id')
     alias = request.args.get('alias')
     limit = request.args.get("limit") or 10
     skip = request.args.get('skip') or 0
+    cursor = request.args.get('cursor') or None
     status = request.args.get('status') or None
     currency_name = request.args.get('currency_name') or None
+    if not auth.is_admin():
+        # users only list their own accounts
+        if user_id and user_id != g.user_id:
+            return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+        user_id = g.user_id
     filters = {}
     if user_id:
         filters["user_id"] = user_id
@@ -33,10 +63,10 @@ def get_accounts():
         filters["currency_name"] = currency_name
     if status:
         filters["status"] = AccountStatus[status.upper()]
-    accounts = repository.get_all(filters=filters, limit=limit, skip=skip)
-    account_schema = AccountSchema(many=True)
-    serialized_accounts = account_schema.dump(accounts)
-    return jsonify({"status": "success", "data": serialized_accounts}), 200
+    accounts = repository.get_all(filters=filters, limit=limit, skip=skip, cursor=cursor, readonly=True)
+    serialized_accounts = get_serializer(AccountSchema).dump_many(accounts)
+    next_cursor = repository.next_cursor(accounts, limit)
+    return jsonify({"status": "success", "data": serialized_accounts, "next_cursor": next_cursor}), 200
 
 
 @app.route("/account/", methods=["POST"])
@@ -45,8 +75,13 @@ def create_account():
     data = request.json
     account_schema = AccountSchema()
     validated_data = account_schema.load(data)
+    if not auth.is_admin():
+        # users only open accounts for themselves, admins for anyone
+        if "user_id" in validated_data and str(validated_data["user_id"]) != g.user_id:
+            return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+        validated_data["user_id"] = g.user_id
+    validated_data.setdefault("user_id", g.user_id)
     account = repository.create(data=validated_data)
-    validated_data["user_id"] = g.user_id
     return jsonify({"status": "success", "data": account_schema.dump(account)}), 200
 
 
@@ -69,5 +104,33 @@ def update_account(pk: str):
 @token_required
 def validate_accounts():
     if auth.is_admin():
-        return jsonify({"status": "success", "data": validate_accounts_created()}), 200
+        job_id = job_service.enqueue(VALIDATE_ACCOUNTS_JOB)
+        return jsonify({"status": "success", "data": {"job_id": job_id}}), 202
     return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+
+
+@app.route("/account/<string:pk>/balance/", methods=["GET"])
+@token_required
+@read_replica
+def get_account_balance(pk: str):
+    validated_data = BalanceQuerySchema().load(request.args)
+    account = _get_owned_account(pk)
+    if account is None:
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+    day = validated_data.get("date") or date.today()
+    total = balance_snapshot_service.balance_as_of(account, day)
+    return jsonify({"status": "success", "data": {"account_id": pk, "date": day.isoformat(), "total": float(total)}}), 200
+
+
+@app.route("/account/<string:pk>/statement/", methods=["GET"])
+@token_required
+@read_replica
+def get_account_statement(pk: str):
+    validated_data = StatementQuerySchema().load(request.args)
+    if validated_data["date_from"] > validated_data["date_to"]:
+        return jsonify({"status": "failure", "message": "from must be before to"}), 400
+    account = _get_owned_account(pk)
+    if account is None:
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+    statement = balance_snapshot_service.statement(account, validated_data["date_from"], validated_data["date_to"])
+    return jsonify({"status": "success", "data": StatementSchema().dump(statement)}), 200
@@ -3,7 +3,9 @@ from flask import request, jsonify
 
 from application.models import Currency
 from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.replicas import read_replica
 from application.validation_schemas import CurrencySchema
+from application.serializers import get_serializer
 from application.authentication import token_required
 
 repository = EntityRepository(model=Currency)
@@ -11,18 +13,22 @@ repository = EntityRepository(model=Currency)
 
 @app.route("/currency/", methods=["GET"])
 @token_required
+@read_replica
 def get():
     name = request.args.get('name')
     limit = request.args.get("limit") or 10
     skip = request.args.get('skip') or 0
+    cursor = request.args.get('cursor') or None
+    next_cursor = None
     if name is None:
-        currencies = repository.get_all(filters={}, limit=limit, skip=skip)
+        currencies = repository.get_all(filters={}, limit=limit, skip=skip, cursor=cursor, readonly=True)
+        next_cursor = repository.next_cursor(currencies, limit)
     else:
-        currencies = repository.get(key=name, field="name")
+        currency = repository.get(key=name, field="name", readonly=True)
+        currencies = [currency] if currency is not None else []
 
-    schema = CurrencySchema(many=True)
-    serialized_data = schema.dump(currencies)
-    return jsonify({"status": "success", "data": serialized_data}), 200
+    serialized_data = get_serializer(CurrencySchema).dump_many(currencies)
+    return jsonify({"status": "success", "data": serialized_data, "next_cursor": next_cursor}), 200
 
 
 @app.route("/currency/", methods=["POST"])
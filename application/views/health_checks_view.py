@@ -1,7 +1,40 @@
-from app import app
-from flask import jsonify
+import os
+
+from app import app, db
+from flask import jsonify, Response
+
+from application.repositories.persistence.replicas import router
+from application.services.cache_service import get_connection_pool
 
 
 @app.route("/")
 def ping():
     return jsonify({"status": "success", "data": "pong"})
+
+
+def _pool_metrics():
+    engine_pool = db.engine.pool
+    redis_pool = get_connection_pool()
+    metrics = {
+        "db_pool_size": engine_pool.size(),
+        "db_pool_checked_in": engine_pool.checkedin(),
+        "db_pool_checked_out": engine_pool.checkedout(),
+        "db_pool_overflow": engine_pool.overflow(),
+        "redis_pool_max_connections": redis_pool.max_connections,
+    }
+    # private attributes of redis-py's ConnectionPool, left out when the pool (or its version) has none
+    for name, attribute in (("redis_pool_in_use", "_in_use_connections"), ("redis_pool_available", "_available_connections")):
+        connections = getattr(redis_pool, attribute, None)
+        if connections is not None:
+            metrics[name] = len(connections)
+    return metrics
+
+
+@app.route("/metrics/")
+def metrics():
+    # prometheus text format, values are per gunicorn worker
+    labels = '{{pid="{}"}}'.format(os.getpid())
+    lines = ["{}{} {}".format(name, labels, value) for name, value in _pool_metrics().items()]
+    for bind_key in router.bind_keys:
+        lines.append('db_replica_healthy{{pid="{}",replica="{}"}} {}'.format(os.getpid(), bind_key, int(router.is_healthy(bind_key))))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain")
@@ -0,0 +1,20 @@
+from app import app
+from flask import jsonify
+
+from application.authentication import token_required
+from application.services.auth_service import AuthService
+from application.services.job_service import JobService
+
+auth_service = AuthService()
+job_service = JobService()
+
+
+@app.route("/job/<string:job_id>", methods=["GET"])
+@token_required
+def get_job(job_id: str):
+    if not auth_service.is_admin():
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+    job = job_service.get(job_id)
+    if job is None:
+        return jsonify({"status": "failure", "message": "Not found"}), 404
+    return jsonify({"status": "success", "data": job}), 200
@@ -1,20 +1,37 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List
 from app import app
-from flask import request, jsonify, g
+from flask import request, jsonify, g, Response, stream_with_context
 from uuid import uuid4
+from marshmallow import ValidationError
 
 from application.models import Transaction, OperationStatus
-from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.entity_repository import EntityRepository, Range
+from application.repositories.persistence.replicas import read_replica, read_from_replica
 from application.services.transaction_service import TransactionService
 from application.validation_schemas import TransactionSchema
+from application.serializers import get_serializer
 from application.authentication import token_required
-from application.tasks.transaction_tasks import execute_transactions
+from application.idempotency import idempotent
+from application.tasks.job_tasks import SETTLE_TRANSACTIONS_JOB, RECONCILE_BALANCES_JOB
 from application.services.auth_service import AuthService
 from application.services.api_rate_service import ApiRateService
+from application.services.job_service import JobService
+from application.services.transaction_event_service import TransactionEventService
+from application.services.account_metadata_service import account_metadata_service, AccountMetadata
+from settings import SETTLEMENT_BATCH_SIZE, EXPORT_YIELD_PER, BULK_TRANSACTIONS_MAX
 
 repository = EntityRepository(model=Transaction)
 service = TransactionService(repository=repository)
 auth_service = AuthService()
 api_rate_service = ApiRateService()
+job_service = JobService()
+transaction_event_service = TransactionEventService()
+transaction_serializer = get_serializer(TransactionSchema)
 
 
 def _get_transaction_input():
@@ -29,37 +46,219 @@ def _get_transaction_input():
         raise ValueError("currency_name is not provide")
     else:
         filters["currency_name"] = currency_name
+    # creation window, the partitions of transactions out of it are not scanned
+    created_from = request.args.get('from')
+    created_to = request.args.get('to')
+    if created_from or created_to:
+        filters["created_at"] = Range(
+            datetime.fromisoformat(created_from) if created_from else None,
+            datetime.fromisoformat(created_to) if created_to else None,
+        )
     return filters
 
 
+def _is_own_movements(filters: dict) -> bool:
+    """
+    Non admins only read their own movements: user_id defaults to the caller and can't be anyone else.
+    """
+    if auth_service.is_admin():
+        return True
+    filters.setdefault("user_id", g.user_id)
+    return str(filters["user_id"]) == g.user_id
+
+
 @app.route("/movements/", methods=["GET"])
 @token_required
+@read_replica
 def get_transactions():
     filters = _get_transaction_input()
+    if not _is_own_movements(filters):
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
     limit = request.args.get("limit") or 10
     skip = request.args.get('skip') or 0
-    transactions = repository.get_all(filters=filters, limit=limit, skip=skip)
-    schema = TransactionSchema(many=True)
-    serialized_transactions = schema.dump(transactions)
-    return jsonify({"status": "success", "data": serialized_transactions}), 200
+    cursor = request.args.get('cursor') or None
+    transactions = repository.get_all(filters=filters, limit=limit, skip=skip, cursor=cursor, readonly=True)
+    serialized_transactions = transaction_serializer.dump_many(transactions)
+    next_cursor = repository.next_cursor(transactions, limit)
+    return jsonify({"status": "success", "data": serialized_transactions, "next_cursor": next_cursor}), 200
+
+
+def _export_ndjson(transactions):
+    for transaction in transactions:
+        yield app.json.dumps(transaction_serializer.dump(transaction)) + "\n"
+
+
+def _export_csv(transactions):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(transaction_serializer.schema.dump_fields))
+    writer.writeheader()
+    for transaction in transactions:
+        writer.writerow(transaction_serializer.dump(transaction))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _iterate_from_replica(filters):
+    # the rows are read while the response streams, after the view has returned
+    with read_from_replica():
+        yield from repository.iterate(filters=filters, yield_per=EXPORT_YIELD_PER, readonly=True)
+
+
+@app.route("/movements/export/", methods=["GET"])
+@token_required
+def export_transactions():
+    filters = _get_transaction_input()
+    if not _is_own_movements(filters):
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+    export_format = (request.args.get("format") or "ndjson").lower()
+    if export_format not in {"ndjson", "csv"}:
+        return jsonify({"status": "failure", "message": "format must be ndjson or csv"}), 400
+
+    transactions = _iterate_from_replica(filters)
+    if export_format == "csv":
+        rows, mimetype = _export_csv(transactions), "text/csv"
+    else:
+        rows, mimetype = _export_ndjson(transactions), "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=movements.{export_format}"}
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
+
+
+def _publish_created(transaction_ids):
+    try:
+        transaction_event_service.publish_created(transaction_ids)
+    except Exception:
+        # not lost, the settlement poller still picks CREATED transactions up
+        app.logger.exception("Could not publish created transactions {}".format(transaction_ids))
+
+
+NOT_OWNER = "account does not belong to the user"
+
+
+def _account_errors(validated_data: dict, accounts: Dict[str, AccountMetadata], is_admin: bool) -> Dict[str, List[str]]:
+    """
+    Checks a transaction against the cached metadata of its accounts: both have to exist and, unless the
+    caller is an admin, the origin account and the user_id have to be the caller's.
+    """
+    errors = {}
+    for field in ("origin_account_id", "destination_account_id"):
+        if str(validated_data[field]) not in accounts:
+            errors[field] = ["account not found"]
+    origin_account = accounts.get(str(validated_data["origin_account_id"]))
+    if not is_admin and origin_account is not None:
+        if origin_account.user_id != g.user_id or str(validated_data["user_id"]) != g.user_id:
+            errors["origin_account_id"] = [NOT_OWNER]
+    return errors
+
+
+def _get_json():
+    # numbers are parsed as Decimal, a float would already have rounded amounts with many digits
+    try:
+        return json.loads(request.get_data(as_text=True), parse_float=Decimal)
+    except ValueError:
+        raise ValidationError("invalid json body")
 
 
 @app.route("/transaction/", methods=["POST"])
 @token_required
+@idempotent
 def create_transaction():
-    data = request.json
+    data = _get_json()
     schema = TransactionSchema()
     validated_data = schema.load(data)
+    accounts = account_metadata_service.get_many(
+        [validated_data["origin_account_id"], validated_data["destination_account_id"]]
+    )
+    errors = _account_errors(validated_data, accounts, auth_service.is_admin())
+    if errors:
+        status_code = 403 if errors.get("origin_account_id") == [NOT_OWNER] else 400
+        return jsonify({"status": "failure", "errors": errors}), status_code
     validated_data["linked_transaction_id"] = str(uuid4())
     transaction = service.repository.create(data=validated_data)
+    _publish_created([transaction.id])
     return jsonify({"status": "success", "data": schema.dump(transaction)}), 200
 
 
+def _get_bulk_input() -> list:
+    # a json array or one json document per line (application/x-ndjson)
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if line.strip():
+                try:
+                    items.append(json.loads(line, parse_float=Decimal))
+                except ValueError:
+                    items.append(None)
+        return items
+    items = _get_json()
+    if not isinstance(items, list):
+        raise ValidationError("a list of transactions is expected")
+    return items
+
+
+@app.route("/transaction/bulk/", methods=["POST"])
+@token_required
+@idempotent
+def create_transactions():
+    items = _get_bulk_input()
+    if len(items) > BULK_TRANSACTIONS_MAX:
+        return jsonify({"status": "failure", "message": f"at most {BULK_TRANSACTIONS_MAX} transactions per request"}), 413
+
+    schema = TransactionSchema()
+    loaded = []
+    for item in items:
+        try:
+            loaded.append(schema.load(item))
+        except ValidationError as e:
+            loaded.append(e)
+
+    # the accounts of the whole request are checked with a single lookup
+    account_ids = set()
+    for validated_data in loaded:
+        if not isinstance(validated_data, ValidationError):
+            account_ids.update((validated_data["origin_account_id"], validated_data["destination_account_id"]))
+    accounts = account_metadata_service.get_many(account_ids)
+    is_admin = auth_service.is_admin()
+
+    results = []
+    validated_items = []
+    for index, validated_data in enumerate(loaded):
+        if isinstance(validated_data, ValidationError):
+            results.append({"index": index, "status": "failure", "errors": validated_data.messages})
+            continue
+        errors = _account_errors(validated_data, accounts, is_admin)
+        if errors:
+            results.append({"index": index, "status": "failure", "errors": errors})
+            continue
+        validated_data["linked_transaction_id"] = str(uuid4())
+        validated_items.append(validated_data)
+        results.append({"index": index, "status": "success"})
+
+    transaction_ids = iter(service.create_many(validated_items))
+    for result in results:
+        if result["status"] == "success":
+            result["id"] = next(transaction_ids)
+    _publish_created([result["id"] for result in results if result["status"] == "success"])
+    return jsonify({"status": "success", "data": results}), 200
+
+
 @app.route("/transaction/execute/", methods=["GET"])
 @token_required
 def execute_transaction():
     if auth_service.is_admin():
-        return jsonify({"status": "success", "data": execute_transactions()}), 200
+        batch_size = int(request.args.get("batch_size") or SETTLEMENT_BATCH_SIZE)
+        job_id = job_service.enqueue(SETTLE_TRANSACTIONS_JOB, batch_size=batch_size)
+        return jsonify({"status": "success", "data": {"job_id": job_id}}), 202
+    return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+
+
+@app.route("/transaction/reconcile/", methods=["GET"])
+@token_required
+def reconcile_transactions():
+    if auth_service.is_admin():
+        full = (request.args.get("full") or "").lower() in {"1", "true"}
+        job_id = job_service.enqueue(RECONCILE_BALANCES_JOB, full=full)
+        return jsonify({"status": "success", "data": {"job_id": job_id}}), 202
     return jsonify({"status": "failure", "message": "Unauthorized"}), 403
 
 
@@ -71,4 +270,6 @@ def calculate_rate():
         origin_currency_name=data["origin_currency_name"],
         destination_currency_name=data["destination_currency_name"]
     )
+    if rate is None:
+        return jsonify({"status": "failure", "message": "rate unavailable, try again later"}), 503
     return jsonify({"status": "success", "data": {"rate": rate}}), 200
@@ -3,16 +3,21 @@ from flask import request, jsonify, g
 
 from application.models import User, UserStatus
 from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.replicas import read_replica
+from application.repositories.persistence.unit_of_work import unit_of_work
 from application.services.user_service import UserService
 from application.validation_schemas import UserSchema, LoginSchema, UserUpdateSchema
+from application.serializers import get_serializer
 from application.services.auth_service import AuthService
+from application.services.job_service import JobService
 from application.authentication import token_required
-from application.tasks.user_tasks import validate_users_created
+from application.tasks.job_tasks import VALIDATE_USERS_JOB
 
 
 repository = EntityRepository(model=User)
 service = UserService(repository=repository)
 auth_service = AuthService()
+job_service = JobService()
 user_schema = UserSchema()
 
 
@@ -35,6 +40,13 @@ def login():
 
 
 
+@app.route("/logout/", methods=["POST"])
+@token_required
+def logout():
+    auth_service.revoke_token(request.headers.get('X-Auth-Token'))
+    return jsonify({"status": "success", "data": "ok"}), 200
+
+
 @app.route("/user/", methods=["POST"])
 def create_user():
     data = request.json
@@ -48,10 +60,13 @@ def create_user():
 @app.route("/user/<string:pk>", methods=["GET"])
 @app.route("/user/", methods=["GET"])
 @token_required
+@read_replica
 def get_user(pk: str = None):
+    next_cursor = None
     if pk is None:
         limit = request.args.get("limit") or 10
         skip = request.args.get('skip') or 0
+        cursor = request.args.get('cursor') or None
         is_deleted = request.args.get('is_deleted') or None
         status = request.args.get('status') or None
         email = request.args.get('email') or None
@@ -62,18 +77,20 @@ def get_user(pk: str = None):
             filters["status"] = UserStatus[status.upper()]
         if email is not None:
             filters["email"] = email
-        user_schema = UserSchema(many=True)
-        user_object = service.repository.get_all(filters=filters, limit=limit, skip=skip)
+        user_object = service.repository.get_all(filters=filters, limit=limit, skip=skip, cursor=cursor, readonly=True)
+        next_cursor = service.repository.next_cursor(user_object, limit)
+        serialized_data = get_serializer(UserSchema).dump_many(user_object)
     else:
-        user_schema = UserSchema()
-        user_object = service.repository.get(key=pk)
+        serialized_data = UserSchema().dump(service.repository.get(key=pk))
 
-    return jsonify({"status": "success", "data": user_schema.dump(user_object) }), 200
+    return jsonify({"status": "success", "data": serialized_data, "next_cursor": next_cursor}), 200
 
 
 @app.route("/user/<string:pk>", methods=["PATCH"])
 @token_required
 def update_user(pk: str):
+    if not auth_service.is_admin() and pk != g.user_id:
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
     data = request.json
     validated_data = UserUpdateSchema().load(data)
     if not auth_service.is_admin():
@@ -88,8 +105,11 @@ def update_user(pk: str):
 @app.route("/user/<string:pk>", methods=["DELETE"])
 @token_required
 def delete_user(pk: str):
-    service.repository.update(data={"id": pk, "status": UserStatus.INACTIVE})
-    service.repository.delete(pk=pk)
+    if not auth_service.is_admin() and pk != g.user_id:
+        return jsonify({"status": "failure", "message": "Unauthorized"}), 403
+    with unit_of_work():
+        service.repository.update(data={"id": pk, "status": UserStatus.INACTIVE})
+        service.repository.delete(pk=pk)
     return jsonify({"status": "success", "data":"ok"}), 204
 
 
@@ -98,5 +118,6 @@ def delete_user(pk: str):
 @token_required
 def validate_users():
     if auth_service.is_admin():
-        return jsonify({"status": "success", "data": validate_users_created()}), 200
+        job_id = job_service.enqueue(VALIDATE_USERS_JOB)
+        return jsonify({"status": "success", "data": {"job_id": job_id}}), 202
     return jsonify({"status": "failure", "message": "Unauthorized"}), 403
@@ -25,7 +25,25 @@ SQLALCHEMY_DATABASE_URI = (
     )
 )
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-STATEMENT_TIMEOUT = 105000
+STATEMENT_TIMEOUT = int(os.getenv("STATEMENT_TIMEOUT", 105000))  # milliseconds
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": True,
+    "connect_args": {"options": f"-c statement_timeout={STATEMENT_TIMEOUT}"},
+}
+# read replicas, comma separated uris: GET endpoints read from them round robin, writes stay on the primary
+REPLICA_DATABASE_URIS = [uri.strip() for uri in os.getenv("REPLICA_DATABASE_URIS", "").split(",") if uri.strip()]
+REPLICA_BINDS = [f"replica_{index}" for index in range(len(REPLICA_DATABASE_URIS))]
+SQLALCHEMY_BINDS = dict(zip(REPLICA_BINDS, REPLICA_DATABASE_URIS))
+REPLICA_RETRY_INTERVAL = int(os.getenv("REPLICA_RETRY_INTERVAL", 30))  # seconds a failing replica is left out
+# monthly range partitions of transactions on created_at, only applies to tables created with it enabled
+TRANSACTIONS_PARTITIONED = bool(os.getenv("TRANSACTIONS_PARTITIONED")) or False
+TRANSACTIONS_PARTITIONS_AHEAD = int(os.getenv("TRANSACTIONS_PARTITIONS_AHEAD", 3))  # months created ahead of time
+TRANSACTIONS_RETENTION_MONTHS = int(os.getenv("TRANSACTIONS_RETENTION_MONTHS", 24))  # months kept attached
+TRANSACTIONS_ARCHIVE_SCHEMA = os.getenv("TRANSACTIONS_ARCHIVE_SCHEMA", "archive")
 DEBUG_MODE = bool(os.getenv("DEBUG_MODE")) or False
 API_KEY_FOREX = os.getenv("API_KEY_FOREX")
 FEE_PERCENTAGE = 0.001  # 2 dollars for each 1000
@@ -36,3 +54,52 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = os.getenv('REDIS_PORT', 6379)
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_SOCKET_PATH = os.getenv('REDIS_SOCKET_PATH')  # unix socket, takes precedence over host/port
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))  # per process
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+SETTLEMENT_BATCH_SIZE = int(os.getenv("SETTLEMENT_BATCH_SIZE", 500))
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", 2))
+SETTLEMENT_POLL_INTERVAL = float(os.getenv("SETTLEMENT_POLL_INTERVAL", 1.0))
+SETTLEMENT_MAX_BACKOFF = float(os.getenv("SETTLEMENT_MAX_BACKOFF", 60))  # seconds a worker waits at most after failures
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 1000))
+# seconds behind now() a reconciliation checkpoint is taken, must outlast the longest settlement transaction
+RECONCILIATION_LAG = int(os.getenv("RECONCILIATION_LAG", 300))
+# milliseconds the reconciliation transaction may run instead of STATEMENT_TIMEOUT, 0 disables the limit
+RECONCILIATION_STATEMENT_TIMEOUT = int(os.getenv("RECONCILIATION_STATEMENT_TIMEOUT", 0))
+
+RATE_CACHE_TTL = int(os.getenv("RATE_CACHE_TTL", 3600))  # seconds a rate is fresh
+RATE_STALE_TTL = int(os.getenv("RATE_STALE_TTL", 86400))  # seconds a stale rate can be served while it's refreshed
+RATE_LOCAL_TTL = float(os.getenv("RATE_LOCAL_TTL", 30))  # seconds a rate is kept in the process before asking redis
+RATE_LOCAL_CACHE_SIZE = int(os.getenv("RATE_LOCAL_CACHE_SIZE", 1024))
+RATE_REQUEST_TIMEOUT = float(os.getenv("RATE_REQUEST_TIMEOUT", 5))
+RATE_FETCH_WORKERS = int(os.getenv("RATE_FETCH_WORKERS", 8))
+
+AUTH_LOCAL_TTL = float(os.getenv("AUTH_LOCAL_TTL", 0))  # seconds a validated token is kept in the process, 0 disables it
+AUTH_LOCAL_CACHE_SIZE = int(os.getenv("AUTH_LOCAL_CACHE_SIZE", 10000))
+# seconds account owner/status/currency stay cached, changes through the repositories invalidate them right away
+ACCOUNT_METADATA_TTL = int(os.getenv("ACCOUNT_METADATA_TTL", 3600))
+
+JOB_TTL = int(os.getenv("JOB_TTL", 86400))  # seconds a job and its result are kept
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_TIMEOUT = int(os.getenv("JOB_POLL_TIMEOUT", 1))  # seconds, must stay below REDIS_SOCKET_TIMEOUT
+# seconds without heartbeat after which a job worker is considered dead and its running job is queued again
+JOB_WORKER_TTL = int(os.getenv("JOB_WORKER_TTL", 30))
+VALIDATION_CHUNK_SIZE = int(os.getenv("VALIDATION_CHUNK_SIZE", 1000))  # users/accounts promoted per commit
+
+SETTLEMENT_STREAM = os.getenv("SETTLEMENT_STREAM", "transactions:created")
+SETTLEMENT_STREAM_GROUP = os.getenv("SETTLEMENT_STREAM_GROUP", "settlement")
+SETTLEMENT_STREAM_MAXLEN = int(os.getenv("SETTLEMENT_STREAM_MAXLEN", 1000000))
+SETTLEMENT_STREAM_BLOCK_MS = int(os.getenv("SETTLEMENT_STREAM_BLOCK_MS", 1000))  # must stay below REDIS_SOCKET_TIMEOUT
+SETTLEMENT_STREAM_CLAIM_IDLE_MS = int(os.getenv("SETTLEMENT_STREAM_CLAIM_IDLE_MS", 60000))  # redeliver unacked events after
+SETTLEMENT_MICRO_BATCH_SIZE = int(os.getenv("SETTLEMENT_MICRO_BATCH_SIZE", 100))
+# deliveries of an event that keeps failing before it is moved to the dead letter stream
+SETTLEMENT_STREAM_MAX_DELIVERIES = int(os.getenv("SETTLEMENT_STREAM_MAX_DELIVERIES", 5))
+SETTLEMENT_DEAD_LETTER_STREAM = os.getenv("SETTLEMENT_DEAD_LETTER_STREAM", "transactions:created:dead")
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 86400))  # seconds a response is replayed for the same key
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", 60))  # seconds a key stays reserved while in progress
+
+BULK_TRANSACTIONS_MAX = int(os.getenv("BULK_TRANSACTIONS_MAX", 10000))  # items per bulk request
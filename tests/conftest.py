@@ -0,0 +1,149 @@
+import os
+from decimal import Decimal
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import pytest
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+
+# the tests get their own database next to the one of the api (POSTGRES_DB), created on the first run
+load_dotenv()
+os.environ.setdefault("SECRET_KEY", Fernet.generate_key().decode())
+os.environ["POSTGRES_DB"] = os.getenv("TEST_POSTGRES_DB") or "{}_pytest".format(os.getenv("POSTGRES_DB", "digital_bank"))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import app, db  # noqa: E402
+from application import authentication  # noqa: E402
+from application.models import Account, Currency, User, AccountStatus, UserStatus  # noqa: E402
+from application.services.account_metadata_service import account_metadata_service  # noqa: E402
+
+
+class FakeCache:
+    """
+    In memory stand-in of CacheService for the commands the tests go through.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, str] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key: str, value: str, exp=None):
+        self.data[key] = value
+
+    def set_many(self, mapping: Dict[str, str], exp=None):
+        self.data.update(mapping)
+
+    def set_nx(self, key: str, value: str, exp=None) -> bool:
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key: str):
+        self.data.pop(key, None)
+
+    def delete_many(self, keys: List[str]):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def delete_if_equals(self, key: str, value: str) -> bool:
+        if self.data.get(key) != value:
+            return False
+        del self.data[key]
+        return True
+
+
+def create_database(url) -> bool:
+    """
+    Creates the database of `url` if missing, False when the server can't be reached.
+    """
+    url = make_url(url)
+    engine = create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": url.database}
+            ).scalar()
+            if not exists:
+                connection.execute(text('CREATE DATABASE "{}"'.format(url.database)))
+    except OperationalError:
+        return False
+    finally:
+        engine.dispose()
+    return True
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not create_database(app.config["SQLALCHEMY_DATABASE_URI"]):
+        pytest.skip("postgres is not reachable, run the tests with `docker compose run tests`")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield db
+
+
+@pytest.fixture
+def fake_cache(monkeypatch) -> FakeCache:
+    cache = FakeCache()
+    monkeypatch.setattr(account_metadata_service, "cache", cache)
+    return cache
+
+
+@pytest.fixture
+def session(database, fake_cache):
+    """
+    App context over an empty database, every table is truncated after the test.
+    """
+    with app.app_context():
+        yield db.session
+        db.session.remove()
+        tables = ", ".join(table.name for table in db.metadata.sorted_tables)
+        with db.engine.begin() as connection:
+            connection.execute(text("TRUNCATE {} CASCADE".format(tables)))
+
+
+@pytest.fixture
+def make_account(session):
+    """
+    Creates an ACTIVE account (and its ACTIVE owner) with the given currency and total.
+    """
+    def make(currency_name: str = "USD", total="0", status: AccountStatus = AccountStatus.ACTIVE,
+             user_status: UserStatus = UserStatus.ACTIVE) -> Account:
+        if session.get(Currency, currency_name) is None:
+            session.add(Currency(name=currency_name))
+        # ids are generated on insert (models.before_insert)
+        user = User(email="{}@example.com".format(uuid4()), name="user", password="password", status=user_status)
+        session.add(user)
+        session.flush()
+        account = Account(
+            alias=str(uuid4()), user_id=user.id, currency_name=currency_name, total=Decimal(total), status=status,
+        )
+        session.add(account)
+        session.commit()
+        return account
+
+    return make
+
+
+@pytest.fixture
+def login(monkeypatch):
+    """
+    Makes every token valid for the given user and profile, returns the headers of a request.
+    """
+    def login_as(user_id: str, profile: str = "user") -> dict:
+        monkeypatch.setattr(
+            authentication.auth_service, "validate_token", lambda token: {"id": str(user_id), "profile": profile}
+        )
+        return {"X-Auth-Token": "token"}
+
+    return login_as
@@ -0,0 +1,41 @@
+from sqlalchemy import select
+
+from app import app
+from application.models import Account
+
+
+def test_accounts_default_to_the_caller(session, make_account, login):
+    owner = make_account()
+    make_account()
+    client = app.test_client()
+
+    response = client.get("/account/", headers=login(owner.user_id))
+    assert response.status_code == 200
+    assert [account["id"] for account in response.get_json()["data"]] == [str(owner.id)]
+
+
+def test_accounts_of_another_user_are_forbidden(session, make_account, login):
+    owner = make_account()
+    other = make_account()
+    client = app.test_client()
+
+    assert client.get(f"/account/?user_id={other.user_id}", headers=login(owner.user_id)).status_code == 403
+    response = client.get(f"/account/?user_id={other.user_id}", headers=login(owner.user_id, profile="admin"))
+    assert [account["id"] for account in response.get_json()["data"]] == [str(other.id)]
+
+
+def test_accounts_are_created_for_the_caller(session, make_account, login):
+    owner = make_account()
+    other = make_account()
+    client = app.test_client()
+    headers = login(owner.user_id)
+
+    response = client.post("/account/", json={"alias": "savings", "currency_name": "USD"}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["data"]["user_id"] == str(owner.user_id)
+
+    response = client.post(
+        "/account/", json={"alias": "theirs", "currency_name": "USD", "user_id": str(other.user_id)}, headers=headers
+    )
+    assert response.status_code == 403
+    assert session.execute(select(Account).where(Account.alias == "theirs")).first() is None
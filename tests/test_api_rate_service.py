@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from application.services import api_rate_service
+from application.services.api_rate_service import ApiRateService
+from tests.conftest import FakeCache
+
+PAIR = ("USD", "EUR")
+KEY = "C:USDEUR"
+
+
+@pytest.fixture
+def service() -> ApiRateService:
+    # the local tier and the in flight refreshes are shared by every instance
+    ApiRateService.local_cache.clear()
+    ApiRateService._key_locks.clear()
+    ApiRateService._refreshing.clear()
+    service = ApiRateService()
+    service.cache = FakeCache()
+    yield service
+    ApiRateService.local_cache.clear()
+
+
+class Upstream:
+    """
+    Stand-in of the rates api: counts the calls, answers `rate` after `delay` seconds or raises `error`.
+    """
+
+    def __init__(self, rate: float = 0.9, delay: float = 0, error: Exception = None):
+        self.rate = rate
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, key: str) -> float:
+        with self._lock:
+            self.calls.append(key)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.rate
+
+
+def test_concurrent_misses_call_upstream_once(service, monkeypatch):
+    upstream = Upstream(delay=0.2)
+    monkeypatch.setattr(service, "_fetch_rate", upstream)
+    results = []
+
+    def resolve():
+        results.append(service.get_rates([PAIR, ("EUR", "EUR")]))
+
+    threads = [threading.Thread(target=resolve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert upstream.calls == [KEY]
+    assert results == [{PAIR: 0.9, ("EUR", "EUR"): 1.0}] * 8
+    assert "lock:{}".format(KEY) not in service.cache.data
+
+
+def test_upstream_error_leaves_the_pair_out(service, monkeypatch):
+    def fetch(key):
+        if key == "C:USDJPY":
+            raise requests.ConnectionError()
+        return 0.9
+
+    monkeypatch.setattr(service, "_fetch_rate", fetch)
+    service.cache.set("C:GBPUSD", json.dumps({"rate": 1.25, "fetched_at": time.time()}))
+
+    rates = service.get_rates([PAIR, ("USD", "JPY"), ("GBP", "USD"), ("USD", "USD")])
+
+    # no made up rate for the pair that failed, the others are resolved
+    assert rates == {PAIR: 0.9, ("GBP", "USD"): 1.25, ("USD", "USD"): 1.0}
+    assert service.get_rate("USD", "JPY") is None
+
+
+def test_upstream_error_serves_the_stale_rate(service, monkeypatch):
+    monkeypatch.setattr(service, "_fetch_rate", Upstream(error=requests.HTTPError()))
+    service.cache.set(KEY, json.dumps({"rate": 0.8, "fetched_at": 0}))
+
+    assert service._calculate_rate(KEY) == 0.8
+
+
+def test_upstream_timeout(service, monkeypatch):
+    def get(url, timeout):
+        raise requests.Timeout()
+
+    monkeypatch.setattr(api_rate_service.requests, "get", get)
+
+    assert service.get_rates([PAIR]) == {}
+    assert service.get_rate(*PAIR) is None
+    assert "lock:{}".format(KEY) not in service.cache.data
+
+
+def test_waiting_for_another_process_times_out(service, monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(service, "_fetch_rate", upstream)
+    monkeypatch.setattr(api_rate_service, "RATE_REQUEST_TIMEOUT", 0.2)
+    # another process holds the upstream call and never stores its result
+    service.cache.set("lock:{}".format(KEY), "other-process")
+
+    assert service.get_rates([PAIR]) == {}
+    assert upstream.calls == []
+    assert service.cache.get("lock:{}".format(KEY)) == "other-process"
+
+
+def test_expired_lock_is_not_released_by_its_former_owner(service, monkeypatch):
+    def slow_fetch(key):
+        # the call outlived the lock and another process took it over
+        service.cache.set("lock:{}".format(key), "other-process")
+        return 0.9
+
+    monkeypatch.setattr(service, "_fetch_rate", slow_fetch)
+
+    assert service.get_rate(*PAIR) == 0.9
+    assert service.cache.get("lock:{}".format(KEY)) == "other-process"
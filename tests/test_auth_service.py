@@ -0,0 +1,123 @@
+import json
+import time
+from uuid import uuid4
+
+import pytest
+import redis
+
+from application.services import cache_service
+from application.services.auth_service import AuthService
+from application.services.cache_service import LocalCache
+from tests.conftest import FakeCache
+
+KEY = "auth:token"
+USER = {"id": "user", "profile": "user"}
+
+
+class Stub:
+    """
+    Stand-in of the pub/sub and of its thread, records what was called.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(name)
+
+
+@pytest.fixture
+def service(monkeypatch) -> AuthService:
+    """
+    AuthService with a local cache of 60 seconds over a fake redis holding a valid token, no subscriber.
+    """
+    AuthService.local_cache.clear()
+    service = AuthService(local_ttl=60)
+    service.cache = FakeCache()
+    service.cache.set(KEY, json.dumps(USER))
+    monkeypatch.setattr(service, "_listen_revocations", lambda: None)
+    yield service
+    AuthService.local_cache.clear()
+
+
+def test_tokens_are_served_locally_until_the_ttl(service, monkeypatch):
+    assert service.validate_token("token") == USER
+    # gone from redis, still cached
+    service.cache.delete(KEY)
+    assert service.validate_token("token") == USER
+
+    now = time.monotonic()
+    monkeypatch.setattr(cache_service.time, "monotonic", lambda: now + 61)
+    assert service.validate_token("token") is None
+
+
+def test_local_cache_evicts_the_least_recently_used():
+    cache = LocalCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_revocations_evict_the_token(service):
+    service.validate_token("token")
+    service.cache.delete(KEY)
+
+    AuthService._on_revoked({"data": KEY})
+
+    assert service.validate_token("token") is None
+
+
+def test_a_token_revoked_while_read_is_not_cached(service, monkeypatch):
+    read = service.cache.get
+
+    def get(key):
+        value = read(key)
+        # revoked by another process right after the read
+        service.cache.delete(key)
+        AuthService._on_revoked({"data": key})
+        return value
+
+    monkeypatch.setattr(service.cache, "get", get)
+    assert service.validate_token("token") == USER
+    monkeypatch.setattr(service.cache, "get", read)
+
+    assert service.validate_token("token") is None
+
+
+def test_a_disconnected_subscriber_clears_the_cache(service, monkeypatch):
+    monkeypatch.setattr(AuthService, "_subscriber", Stub())
+    service.validate_token("token")
+    service.cache.delete(KEY)
+    pubsub, thread = Stub(), Stub()
+
+    AuthService._on_subscriber_error(redis.ConnectionError(), pubsub, thread)
+
+    assert (pubsub.calls, thread.calls) == (["close"], ["stop"])
+    assert AuthService._subscriber is None
+    assert service.validate_token("token") is None
+
+
+def test_revocations_reach_other_processes(monkeypatch):
+    monkeypatch.setattr(AuthService, "_subscriber", None)
+    AuthService.local_cache.clear()
+    service = AuthService(local_ttl=60)
+    token = str(uuid4())
+    key = "auth:{}".format(token)
+    try:
+        service.cache.set(key, json.dumps(USER), exp=60)
+    except redis.ConnectionError:
+        pytest.skip("redis is not reachable, run the tests with `docker compose run tests`")
+    assert service.validate_token(token) == USER
+    # another process revokes it: the key and the message only
+    service.cache.delete(key)
+    service.cache.publish(AuthService.revocation_channel, key)
+
+    deadline = time.monotonic() + 5
+    while AuthService.local_cache.get(key) is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert service.validate_token(token) is None
+    AuthService._subscriber.stop()
@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from uuid import uuid4
+
+from sqlalchemy import delete, select, update
+
+from application.models import Account, AccountBalanceSnapshot, Transaction, OperationType
+from application.repositories.persistence.entity_repository import EntityRepository
+from application.services.balance_snapshot_service import BalanceSnapshotService
+from application.tasks.reconciliation_tasks import backfill_balance_snapshots
+from application.tasks.transaction_tasks import execute_transactions
+
+service = BalanceSnapshotService(repository=EntityRepository(model=AccountBalanceSnapshot))
+
+
+def settle(session, account: Account, operation: OperationType, amount: str, days_ago: int):
+    """
+    Settles the transaction and moves it `days_ago` days back, as if settled before snapshots were recorded.
+    """
+    transaction = Transaction(
+        linked_transaction_id=str(uuid4()), amount=Decimal(amount), operation=operation,
+        origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+        user_id=account.user_id,
+    )
+    session.add(transaction)
+    session.commit()
+    execute_transactions()
+    day = date.today() - timedelta(days=days_ago)
+    session.execute(update(Transaction).where(Transaction.id == transaction.id).values(last_updated=day))
+    session.commit()
+
+
+def test_snapshots_are_backfilled_from_the_transactions(session, make_account):
+    account = make_account(total="0")
+    settle(session, account, OperationType.DEPOSIT, "100", days_ago=3)
+    settle(session, account, OperationType.DEPOSIT, "50", days_ago=1)
+    settle(session, account, OperationType.WITHDRAWAL, "30", days_ago=0)
+    # the history from before the snapshots: only what moved today is recorded
+    session.execute(delete(AccountBalanceSnapshot))
+    session.commit()
+    today = date.today()
+
+    assert backfill_balance_snapshots() == {"accounts": 1, "snapshots": 2}
+
+    account = session.execute(select(Account).where(Account.id == account.id)).scalar()
+    assert service.balance_as_of(account, today - timedelta(days=4)) == Decimal("0")
+    assert service.balance_as_of(account, today - timedelta(days=2)) == Decimal("100")
+    assert service.balance_as_of(account, today - timedelta(days=1)) == Decimal("150")
+    statement = service.statement(account, today - timedelta(days=3), today - timedelta(days=1))
+    assert (statement["opening_total"], statement["closing_total"]) == (Decimal("0"), Decimal("150"))
+    assert (statement["credits"], statement["debits"], statement["movements"]) == (Decimal("150"), Decimal("0"), 2)
+    # days already there are kept
+    assert backfill_balance_snapshots() == {"accounts": 0, "snapshots": 0}
+
+
+def test_backfill_walks_back_from_the_first_snapshot(session, make_account):
+    account = make_account(total="0")
+    settle(session, account, OperationType.DEPOSIT, "100", days_ago=2)
+    session.execute(delete(AccountBalanceSnapshot))
+    session.commit()
+    # the first snapshot, recorded once settlement started keeping them
+    settle(session, account, OperationType.DEPOSIT, "50", days_ago=0)
+
+    assert backfill_balance_snapshots() == {"accounts": 1, "snapshots": 1}
+
+    snapshots = session.execute(
+        select(AccountBalanceSnapshot).order_by(AccountBalanceSnapshot.day)
+    ).scalars().all()
+    assert [(snapshot.opening_total, snapshot.closing_total) for snapshot in snapshots] == [
+        (Decimal("0"), Decimal("100")), (Decimal("100"), Decimal("150")),
+    ]
@@ -0,0 +1,17 @@
+from app import app
+from application.models import Currency
+
+
+def test_get_by_name(session, login):
+    session.add_all([Currency(name="USD"), Currency(name="EUR")])
+    session.commit()
+    client = app.test_client()
+    headers = login("user")
+
+    response = client.get("/currency/?name=EUR", headers=headers)
+    assert response.status_code == 200
+    assert [currency["name"] for currency in response.get_json()["data"]] == ["EUR"]
+
+    response = client.get("/currency/?name=GBP", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["data"] == []
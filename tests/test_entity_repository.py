@@ -0,0 +1,61 @@
+from uuid import uuid4
+
+from sqlalchemy import select
+
+from application.models import User, UserStatus
+from application.repositories.persistence.entity_repository import EntityRepository
+
+repository = EntityRepository(model=User)
+
+
+def user_data(name: str = "user", email: str = None) -> dict:
+    return {
+        "email": email or "{}@example.com".format(uuid4()), "name": name, "password": "password",
+        "status": UserStatus.CREATED,
+    }
+
+
+def names_by_id(session) -> dict:
+    session.expire_all()
+    return {str(user_id): name for user_id, name in session.execute(select(User.id, User.name))}
+
+
+def test_create_many_returns_the_ids_in_order(session):
+    ids = repository.create_many([user_data("first"), user_data("second")])
+
+    assert len(set(ids)) == 2
+    assert names_by_id(session) == {ids[0]: "first", ids[1]: "second"}
+    assert repository.create_many([]) == []
+
+
+def test_update_many_updates_by_primary_key(session):
+    first, second = repository.create_many([user_data("first"), user_data("second")])
+    before = session.execute(select(User.last_updated).where(User.id == first)).scalar()
+
+    assert repository.update_many([{"id": first, "name": "renamed", "unknown": 1}]) == 1
+
+    assert names_by_id(session) == {first: "renamed", second: "second"}
+    assert session.execute(select(User.last_updated).where(User.id == first)).scalar() > before
+
+
+def test_upsert_many_returns_the_stored_ids(session):
+    existing, = repository.create_many([user_data("existing", email="taken@example.com")])
+
+    ids = repository.upsert_many(
+        [user_data("new"), user_data("updated", email="taken@example.com")], index_elements=["email"],
+    )
+
+    # the conflicting item keeps the id already stored, not the one generated for it
+    assert str(ids[1]) == existing
+    assert names_by_id(session) == {str(ids[0]): "new", existing: "updated"}
+
+
+def test_get_or_create(session):
+    data = user_data("first")
+
+    created, is_created = repository.get_or_create(field="email", data=data)
+    retrieved, is_retrieved_created = repository.get_or_create(field="email", data={**data, "name": "second"})
+
+    assert (is_created, is_retrieved_created) == (True, False)
+    assert retrieved.id == created.id
+    assert names_by_id(session) == {str(created.id): "first"}
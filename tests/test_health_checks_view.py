@@ -0,0 +1,28 @@
+from app import app
+from application.views import health_checks_view
+
+
+def metric_names(response) -> set:
+    return {line.split("{")[0] for line in response.get_data(as_text=True).splitlines()}
+
+
+def test_metrics(session):
+    response = app.test_client().get("/metrics/")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert {"db_pool_size", "db_pool_checked_out", "redis_pool_max_connections", "redis_pool_in_use"} <= metric_names(response)
+
+
+def test_metrics_without_the_private_pool_attributes(session, monkeypatch):
+    class Pool:
+        max_connections = 10
+
+    monkeypatch.setattr(health_checks_view, "get_connection_pool", lambda: Pool())
+
+    response = app.test_client().get("/metrics/")
+
+    assert response.status_code == 200
+    names = metric_names(response)
+    assert "redis_pool_max_connections" in names
+    assert not {"redis_pool_in_use", "redis_pool_available"} & names
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+from flask import g, jsonify, make_response
+from sqlalchemy import event
+
+from app import app, db
+from application import idempotency
+from application.idempotency import idempotent
+from tests.conftest import FakeCache
+
+
+@pytest.fixture
+def cache(monkeypatch) -> FakeCache:
+    cache = FakeCache()
+    monkeypatch.setattr(idempotency.idempotency_service, "cache", cache)
+    return cache
+
+
+class View:
+    """
+    An idempotent view counting its calls, answering `status_code` or raising `error`.
+    """
+
+    def __init__(self, status_code: int = 200, error: Exception = None):
+        self.calls = 0
+        self.status_code = status_code
+        self.error = error
+        self.view = idempotent(self.respond)
+
+    def respond(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return jsonify({"call": self.calls}), self.status_code
+
+    def __call__(self, key: str = "key", user_id: str = "user", path: str = "/transaction/", body: dict = None):
+        body = json.dumps(body or {"amount": 10})
+        with app.test_request_context(path, method="POST", data=body, headers={"Idempotency-Key": key}):
+            g.user_id = user_id
+            return make_response(self.view())
+
+
+def test_retries_replay_the_stored_response(cache):
+    view = View(status_code=201)
+
+    first = view()
+    retry = view()
+
+    assert view.calls == 1
+    assert (retry.status_code, retry.get_json()) == (201, {"call": 1})
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+
+def test_a_request_in_flight_answers_409(cache):
+    retry = View()
+    responses = []
+
+    def running():
+        # the retry arrives while the first request is still running
+        responses.append(retry())
+        return jsonify({}), 200
+
+    first = View()
+    first.view = idempotent(running)
+    first()
+
+    assert responses[0].status_code == 409
+    assert retry.calls == 0
+
+
+def test_a_key_reused_for_another_body_answers_422(cache):
+    view = View()
+    view(body={"amount": 10})
+
+    response = view(body={"amount": 11})
+
+    assert response.status_code == 422
+    assert view.calls == 1
+
+
+def test_failed_requests_give_their_key_back(cache):
+    crashing = View(error=RuntimeError("boom"))
+    with pytest.raises(RuntimeError):
+        crashing()
+    assert cache.data == {}
+
+    failing = View(status_code=503)
+    assert failing().status_code == 503
+    assert cache.data == {}
+    # the retry runs again
+    assert failing().status_code == 503
+    assert failing.calls == 2
+
+
+def test_keys_are_scoped_per_user_and_path(cache):
+    view = View()
+
+    view(user_id="first")
+    view(user_id="second")
+    view(user_id="first", path="/transaction/bulk/")
+
+    assert view.calls == 3
+
+
+def test_replays_do_not_touch_the_database(session, make_account, login, cache):
+    account = make_account()
+    body = {
+        "amount": 10, "operation": "Deposit", "origin_account_id": account.id, "destination_account_id": account.id,
+        "user_id": account.user_id, "currency_name": "USD",
+    }
+    client = app.test_client()
+    headers = {**login(account.user_id), "Idempotency-Key": "key"}
+    first = client.post("/transaction/", json=body, headers=headers)
+    statements = []
+
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_execute)
+    try:
+        retry = client.post("/transaction/", json=body, headers=headers)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_execute)
+
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == first.get_json()
+    assert statements == []
@@ -0,0 +1,71 @@
+from uuid import uuid4
+
+import pytest
+import redis
+
+from app import app
+from application.default import JobStatus
+from application.services.job_service import JobService
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """
+    Makes JobService use a queue of its own in the redis of the settings, with an `add` job registered.
+    """
+    prefix = "test:{}".format(uuid4())
+    monkeypatch.setattr(JobService, "queue_key", "{}:queue".format(prefix))
+    monkeypatch.setattr(JobService, "workers_key", "{}:workers".format(prefix))
+    monkeypatch.setitem(JobService.registry, "add", lambda a, b: {"sum": a + b})
+    service = JobService()
+    try:
+        service.cache.redis.ping()
+    except redis.ConnectionError:
+        pytest.skip("redis is not reachable, run the tests with `docker compose run tests`")
+    with app.app_context():
+        yield prefix
+    keys = list(service.cache.redis.scan_iter("{}:*".format(prefix)))
+    keys += list(service.cache.redis.scan_iter("jobs:*:{}-*".format(prefix)))
+    service.cache.delete_many(keys)
+
+
+def worker(prefix: str, name: str) -> JobService:
+    service = JobService(worker_id="{}-{}".format(prefix, name))
+    service.heartbeat()
+    return service
+
+
+def test_a_finished_job_leaves_the_processing_list(queue):
+    service = worker(queue, "first")
+    job_id = service.enqueue("add", a=1, b=2)
+
+    assert service.run_next(timeout=1) == job_id
+    assert service.get(job_id)["status"] == JobStatus.DONE.value
+    assert service.get(job_id)["result"] == {"sum": 3}
+    assert service.cache.redis.llen(service._processing_key(service.worker_id)) == 0
+
+
+def test_jobs_of_a_dead_worker_are_queued_again(queue):
+    dead = worker(queue, "dead")
+    alive = worker(queue, "alive")
+    job_id = dead.enqueue("add", a=1, b=2)
+    # taken, then the worker is killed before finishing it and its heartbeat expires
+    dead.cache.blmove(dead.queue_key, dead._processing_key(dead.worker_id), timeout=1)
+    dead._save(job_id, status=JobStatus.RUNNING.value)
+    dead.cache.delete(dead._worker_key(dead.worker_id))
+
+    assert alive.requeue_stale() == [job_id]
+    assert alive.get(job_id)["status"] == JobStatus.QUEUED.value
+    assert alive.cache.smembers(alive.workers_key) == {alive.worker_id}
+    assert alive.run_next(timeout=1) == job_id
+    assert alive.get(job_id)["status"] == JobStatus.DONE.value
+
+
+def test_jobs_of_a_live_worker_are_left_alone(queue):
+    busy = worker(queue, "busy")
+    other = worker(queue, "other")
+    busy.enqueue("add", a=1, b=2)
+    busy.cache.blmove(busy.queue_key, busy._processing_key(busy.worker_id), timeout=1)
+
+    assert other.requeue_stale() == []
+    assert busy.cache.redis.llen(busy._processing_key(busy.worker_id)) == 1
@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event, text
+
+from app import db
+from application.services.partition_service import PartitionService
+
+
+@pytest.fixture
+def partitioned(session) -> PartitionService:
+    """
+    PartitionService over a table of its own, partitioned on created_at like transactions.
+    """
+    session.execute(text("CREATE TABLE partition_test (created_at timestamp NOT NULL) PARTITION BY RANGE (created_at)"))
+    session.commit()
+    yield PartitionService(table="partition_test")
+    session.rollback()
+    session.execute(text("DROP TABLE IF EXISTS partition_test, partition_test_y2024m05"))
+    session.commit()
+
+
+def test_detach_runs_without_statement_timeout(partitioned):
+    partitioned.create(date(2024, 5, 1))
+    timeouts = []
+
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        if "DETACH PARTITION" in statement:
+            cursor.execute("SHOW statement_timeout")
+            timeouts.append(cursor.fetchone()[0])
+
+    event.listen(db.engine, "before_cursor_execute", before_execute)
+    try:
+        partitioned.detach(date(2024, 5, 1), concurrently=False)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_execute)
+
+    assert timeouts == ["0"]
+    assert partitioned.list_partitions() == []
+    # the pooled connection is back to STATEMENT_TIMEOUT
+    with db.engine.connect() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar() != "0"
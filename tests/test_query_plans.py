@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import insert, text
+
+from app import db
+from application.models import Transaction, OperationStatus, OperationType
+from application.tasks.query_plan_tasks import query_shapes, sequential_scans
+
+SHAPES = query_shapes()
+
+
+@pytest.fixture
+def seeded(session, make_account):
+    accounts = [make_account(currency_name=currency_name, total="100") for currency_name in ("USD", "EUR") * 5]
+    created_at = datetime(2024, 1, 1)
+    session.execute(insert(Transaction.__table__), [
+        dict(
+            id=str(uuid4()), linked_transaction_id=str(uuid4()), amount=Decimal(1), operation=OperationType.DEPOSIT,
+            operation_status=OperationStatus.DONE if index % 10 else OperationStatus.CREATED,
+            origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+            user_id=account.user_id, is_deleted=False,
+            created_at=created_at + timedelta(minutes=index), last_updated=created_at + timedelta(minutes=index),
+        )
+        for index in range(2000)
+        for account in [accounts[index % len(accounts)]]
+    ])
+    session.commit()
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE"))
+
+
+@pytest.mark.parametrize("name", sorted(SHAPES))
+def test_query_shape_is_served_by_an_index(seeded, name):
+    # with sequential scans disabled postgres only falls back to one when no index can serve the query
+    with db.engine.connect() as connection:
+        with connection.begin() as transaction:
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            assert sequential_scans(connection, SHAPES[name]) == []
+            transaction.rollback()
@@ -0,0 +1,121 @@
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import event, text, update
+
+from app import db
+from application.models import Account, Transaction, OperationType
+from application.tasks import reconciliation_tasks
+from application.tasks.reconciliation_tasks import reconcile_balances
+from application.tasks.transaction_tasks import execute_transactions
+from settings import TRANSACTIONS_ARCHIVE_SCHEMA
+
+
+def deposit(session, account: Account, amount: str):
+    session.add(Transaction(
+        linked_transaction_id=str(uuid4()), amount=Decimal(amount), operation=OperationType.DEPOSIT,
+        origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+        user_id=account.user_id,
+    ))
+    session.commit()
+
+
+def test_reports_the_accounts_that_do_not_match(session, make_account):
+    matching = make_account()
+    drifted = make_account()
+    deposit(session, matching, "10")
+    deposit(session, drifted, "10")
+    execute_transactions()
+    session.execute(update(Account).where(Account.id == drifted.id).values(total=Decimal("15")))
+    session.commit()
+    mismatches = []
+
+    data = reconcile_balances(full=True, on_mismatch=mismatches.append)
+
+    assert (data["accounts"], data["mismatches"]) == (2, 1)
+    assert [mismatch["account_id"] for mismatch in mismatches] == [str(drifted.id)]
+
+
+def test_runs_under_its_own_statement_timeout(session, make_account, monkeypatch):
+    make_account()
+    monkeypatch.setattr(reconciliation_tasks, "RECONCILIATION_STATEMENT_TIMEOUT", 0)
+    connections = []
+    timeouts = []
+
+    def on_begin(connection):
+        connections.append(connection)
+
+    event.listen(db.engine, "begin", on_begin)
+
+    def progress(data):
+        # the reconciliation transaction is still open on that connection
+        timeouts.append(connections[-1].execute(text("SHOW statement_timeout")).scalar())
+
+    try:
+        reconcile_balances(full=True, progress=progress, chunk_size=1)
+    finally:
+        event.remove(db.engine, "begin", on_begin)
+
+    assert timeouts == ["0"]
+    # SET LOCAL ends with the transaction, the pooled connection is back to STATEMENT_TIMEOUT
+    with db.engine.connect() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar() != "0"
+
+
+@pytest.fixture
+def archive_partition(session):
+    """
+    Creates (on call) a plain table of the archive schema, like the partitions moved there by PartitionService.archive.
+    """
+    name = "{}.{}_y2020m01".format(TRANSACTIONS_ARCHIVE_SCHEMA, Transaction.__tablename__)
+
+    def create() -> str:
+        session.execute(text("CREATE SCHEMA IF NOT EXISTS {}".format(TRANSACTIONS_ARCHIVE_SCHEMA)))
+        session.execute(text("CREATE TABLE {} (LIKE {})".format(name, Transaction.__tablename__)))
+        session.commit()
+        return name
+
+    yield create
+    session.rollback()
+    session.execute(text("DROP TABLE IF EXISTS {}".format(name)))
+    session.commit()
+
+
+def test_full_runs_are_refused_once_partitions_are_archived(archive_partition, make_account):
+    make_account()
+    archive_partition()
+
+    with pytest.raises(RuntimeError):
+        reconcile_balances(full=True)
+    # nor a first run, it starts from scratch as well
+    with pytest.raises(RuntimeError):
+        reconcile_balances()
+
+
+def test_archived_legs_are_still_accounted_for(session, make_account, archive_partition):
+    sender = make_account(total="0")
+    receiver = make_account(total="0")
+    deposit(session, sender, "100")
+    execute_transactions()
+    assert reconcile_balances()["mismatches"] == 0
+    session.add(Transaction(
+        linked_transaction_id=str(uuid4()), amount=Decimal("10"), operation=OperationType.TRANSFER,
+        origin_account_id=sender.id, destination_account_id=receiver.id, currency_name=sender.currency_name,
+        user_id=sender.user_id,
+    ))
+    session.commit()
+    execute_transactions()
+    # the debit leg is archived before any run checkpointed it, the credit leg is still live
+    name = archive_partition()
+    transactions = Transaction.__tablename__
+    debit_leg = "SELECT id FROM {} WHERE operation = 'TRANSFER' ORDER BY created_at, id LIMIT 1".format(transactions)
+    session.execute(text("INSERT INTO {} SELECT * FROM {} WHERE id = ({})".format(name, transactions, debit_leg)))
+    session.execute(text("DELETE FROM {} WHERE id IN (SELECT id FROM {})".format(transactions, name)))
+    session.commit()
+    mismatches = []
+
+    data = reconcile_balances(on_mismatch=mismatches.append)
+
+    assert (data["accounts"], data["is_full"]) == (2, False)
+    assert mismatches == []
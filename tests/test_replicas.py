@@ -0,0 +1,129 @@
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.engine import make_url
+
+from app import app, db
+from application.models import Account, Currency, Transaction, OperationType
+from application.repositories.persistence import replicas
+from application.repositories.persistence.entity_repository import EntityRepository
+from application.repositories.persistence.replicas import ReplicaRouter, read_from_replica
+from application.repositories.persistence.unit_of_work import unit_of_work
+from application.tasks.transaction_tasks import execute_transactions
+from tests.conftest import create_database
+
+repository = EntityRepository(model=Currency)
+
+
+@pytest.fixture(scope="session")
+def replica_url(database):
+    """
+    A second database with the same tables plays the replica: reads served by it see its own rows only.
+    """
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    url = url.set(database="{}_replica".format(url.database))
+    create_database(url)
+    engine = create_engine(url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def replica(session, replica_url, monkeypatch):
+    """
+    Routes the replica reads to the replica database, holding a single currency: REP.
+    """
+    engine = create_engine(replica_url)
+    with engine.begin() as connection:
+        connection.execute(Currency.__table__.insert().values(name="REP", is_deleted=False))
+    monkeypatch.setitem(db.engines, "replica_test", engine)
+    monkeypatch.setattr(replicas, "router", ReplicaRouter(["replica_test"]))
+    yield engine
+    # the session keeps a transaction open on every engine it read from
+    db.session.remove()
+    with engine.begin() as connection:
+        connection.execute(text("TRUNCATE {} CASCADE".format(Currency.__tablename__)))
+    engine.dispose()
+
+
+def names_in(engine) -> set:
+    with engine.connect() as connection:
+        return set(connection.execute(select(Currency.name)).scalars())
+
+
+def test_replica_reads_go_to_the_replica(replica, session):
+    session.add(Currency(name="PRI"))
+    session.commit()
+
+    with read_from_replica():
+        assert repository.get(key="REP", field="name") is not None
+        assert repository.get(key="PRI", field="name") is None
+    assert repository.get(key="PRI", field="name") is not None
+    assert repository.get(key="REP", field="name") is None
+
+
+def test_read_replica_views_go_to_the_replica(replica, login):
+    response = app.test_client().get("/currency/?name=REP", headers=login("user"))
+
+    assert [currency["name"] for currency in response.get_json()["data"]] == ["REP"]
+
+
+def test_writes_and_units_of_work_stay_on_the_primary(replica, session):
+    with read_from_replica():
+        repository.create(data={"name": "NEW"})
+        with unit_of_work():
+            # a unit of work reads what it is about to write
+            assert repository.get(key="NEW", field="name") is not None
+            assert repository.get(key="REP", field="name") is None
+
+    assert "NEW" in names_in(db.engine)
+    assert "NEW" not in names_in(replica)
+
+
+def test_writes_read_the_primary_back(replica, session):
+    session.add(Currency(name="PRI"))
+    session.commit()
+
+    with read_from_replica():
+        # only on the primary, the replica hasn't caught up
+        assert repository.update(data={"name": "PRI", "is_deleted": True}, field="name").is_deleted
+        currency, is_created = repository.get_or_create(field="name", data={"name": "NEW"})
+        assert (currency.name, is_created) == ("NEW", True)
+        currency, is_created = repository.get_or_create(field="name", data={"name": "PRI"})
+        assert (currency.name, is_created) == ("PRI", False)
+
+
+def test_settlement_stays_on_the_primary(replica, session, make_account):
+    account = make_account(total="0")
+    session.add(Transaction(
+        linked_transaction_id=str(uuid4()), amount=Decimal("10"), operation=OperationType.DEPOSIT,
+        origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+        user_id=account.user_id,
+    ))
+    session.commit()
+
+    with read_from_replica():
+        assert execute_transactions()["success"] == 1
+    assert session.execute(select(Account.total).where(Account.id == account.id)).scalar() == Decimal("10")
+
+
+def test_a_failing_replica_falls_back_to_the_primary(session, monkeypatch):
+    # nothing listens on port 1
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).set(port=1)
+    engine = create_engine(url, connect_args={"connect_timeout": 1})
+    router = ReplicaRouter(["replica_down"], retry_interval=60)
+    monkeypatch.setitem(db.engines, "replica_down", engine)
+    monkeypatch.setattr(replicas, "router", router)
+    session.add(Currency(name="PRI"))
+    session.commit()
+
+    with read_from_replica():
+        assert repository.get(key="PRI", field="name") is not None
+    assert not router.is_healthy("replica_down")
+    # left out until retry_interval is over
+    assert router.choose() is None
+    engine.dispose()
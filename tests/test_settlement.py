@@ -0,0 +1,320 @@
+import random
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import event, insert, select, update
+
+from app import app, db
+from application.models import (
+    Account, AccountBalanceSnapshot, Transaction, AccountStatus, OperationStatus, OperationType, User, UserStatus,
+)
+from application.services.account_metadata_service import account_metadata_service
+from application.tasks import transaction_tasks
+from application.tasks.transaction_tasks import execute_transactions, search_transaction_created
+
+RATES = {("USD", "EUR"): 0.9, ("EUR", "USD"): 1.1}
+
+
+@pytest.fixture(autouse=True)
+def rates(monkeypatch):
+    def get_rates(pairs):
+        return {pair: 1.0 if pair[0] == pair[1] else RATES[pair] for pair in pairs}
+
+    monkeypatch.setattr(transaction_tasks.api_rate_Service, "get_rates", get_rates)
+
+
+def create_transaction(session, operation: OperationType, origin: Account, destination: Account, amount: str) -> str:
+    # one commit per transaction, so they are claimed (oldest first) in the order they were created
+    transaction = Transaction(
+        linked_transaction_id=str(uuid4()),
+        amount=Decimal(amount),
+        operation=operation,
+        origin_account_id=origin.id,
+        destination_account_id=destination.id,
+        currency_name=origin.currency_name,
+        user_id=origin.user_id,
+    )
+    session.add(transaction)
+    session.commit()
+    return transaction.id
+
+
+@pytest.fixture
+def statements(session):
+    """
+    SQL sent to the database while the test runs.
+    """
+    sent = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        sent.append(" ".join(statement.split()))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield sent
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def total_of(session, account: Account) -> Decimal:
+    return session.execute(select(Account.total).where(Account.id == account.id)).scalar()
+
+
+def status_of(session, transaction_id: str) -> OperationStatus:
+    return session.execute(select(Transaction.operation_status).where(Transaction.id == transaction_id)).scalar()
+
+
+def test_deposit(session, make_account):
+    account = make_account(total="0")
+    transaction_id = create_transaction(session, OperationType.DEPOSIT, account, account, "100.50")
+
+    assert execute_transactions() == {"total": 1, "success": 1, "failed": 0, "deferred": 0}
+    assert total_of(session, account) == Decimal("100.5000")
+    assert status_of(session, transaction_id) == OperationStatus.DONE
+
+
+def test_withdrawal(session, make_account):
+    account = make_account(total="100")
+    create_transaction(session, OperationType.WITHDRAWAL, account, account, "30.25")
+
+    assert execute_transactions()["success"] == 1
+    assert total_of(session, account) == Decimal("69.7500")
+
+
+def test_insufficient_funds(session, make_account):
+    origin = make_account(total="10")
+    destination = make_account(total="0")
+    withdrawal_id = create_transaction(session, OperationType.WITHDRAWAL, origin, origin, "30")
+    transfer_id = create_transaction(session, OperationType.TRANSFER, origin, destination, "10.01")
+
+    assert execute_transactions() == {"total": 2, "success": 0, "failed": 2, "deferred": 0}
+    assert status_of(session, withdrawal_id) == OperationStatus.FAILED
+    assert status_of(session, transfer_id) == OperationStatus.FAILED
+    assert total_of(session, origin) == Decimal("10")
+    assert total_of(session, destination) == Decimal("0")
+
+
+def test_transfer_to_the_same_account(session, make_account):
+    account = make_account(total="100")
+    create_transaction(session, OperationType.TRANSFER, account, account, "40")
+
+    assert execute_transactions()["success"] == 1
+    assert total_of(session, account) == Decimal("100")
+
+
+def test_transfer_between_currencies_charges_fee(session, make_account):
+    origin = make_account(currency_name="USD", total="100")
+    destination = make_account(currency_name="EUR", total="5")
+    transaction_id = create_transaction(session, OperationType.TRANSFER, origin, destination, "10")
+
+    assert execute_transactions()["success"] == 1
+    # 10 USD plus a 0.1% fee leave the origin, 10 * 0.9 EUR reach the destination
+    assert total_of(session, origin) == Decimal("89.9900")
+    assert total_of(session, destination) == Decimal("14.0000")
+
+    linked_transaction_id = session.get(Transaction, transaction_id).linked_transaction_id
+    generated = session.execute(
+        select(Transaction).where(
+            Transaction.linked_transaction_id == linked_transaction_id, Transaction.id != transaction_id
+        )
+    ).scalars().all()
+    by_operation = {transaction.operation: transaction for transaction in generated}
+    assert by_operation[OperationType.TRANSFER].amount == Decimal("9.0000")
+    assert by_operation[OperationType.TRANSFER].destination_account_id == destination.id
+    assert by_operation[OperationType.FEE].amount == Decimal("0.0100")
+    assert {transaction.operation_status for transaction in generated} == {OperationStatus.DONE}
+
+
+def test_rates_are_fetched_before_the_accounts_are_locked(session, make_account, monkeypatch):
+    origin = make_account(currency_name="USD", total="100")
+    destination = make_account(currency_name="EUR", total="0")
+    create_transaction(session, OperationType.TRANSFER, origin, destination, "10")
+    locked = []
+
+    def get_rates(pairs):
+        # another connection can still lock the accounts: a slow upstream call blocks nobody
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(Account.id).where(Account.id.in_([origin.id, destination.id])).with_for_update(nowait=True)
+            ).all()
+            locked.append(len(rows))
+        return {pair: RATES[pair] for pair in pairs}
+
+    monkeypatch.setattr(transaction_tasks.api_rate_Service, "get_rates", get_rates)
+
+    assert execute_transactions()["success"] == 1
+    assert locked == [2]
+
+
+def test_transfer_without_rate_is_deferred(session, make_account, monkeypatch):
+    # the upstream is down: only same currency pairs resolve
+    monkeypatch.setattr(
+        transaction_tasks.api_rate_Service, "get_rates", lambda pairs: {pair: 1.0 for pair in pairs if pair[0] == pair[1]}
+    )
+    origin = make_account(currency_name="USD", total="100")
+    destination = make_account(currency_name="GBP", total="0")
+    same_currency = make_account(currency_name="USD", total="0")
+    deferred_id = create_transaction(session, OperationType.TRANSFER, origin, destination, "10")
+    create_transaction(session, OperationType.TRANSFER, origin, same_currency, "10")
+
+    assert execute_transactions() == {"total": 2, "success": 1, "failed": 0, "deferred": 1}
+    # left for a later batch, nothing moved at a made up rate
+    assert status_of(session, deferred_id) == OperationStatus.CREATED
+    assert total_of(session, origin) == Decimal("90")
+    assert total_of(session, destination) == Decimal("0")
+
+
+def test_transfer_to_inactive_destination_fails(session, make_account):
+    origin = make_account(total="100")
+    blocked_account = make_account(status=AccountStatus.BLOCKED)
+    blocked_user = make_account(user_status=UserStatus.BLOCKED)
+    create_transaction(session, OperationType.TRANSFER, origin, blocked_account, "10")
+    create_transaction(session, OperationType.TRANSFER, origin, blocked_user, "10")
+
+    assert execute_transactions() == {"total": 2, "success": 0, "failed": 2, "deferred": 0}
+    assert total_of(session, origin) == Decimal("100")
+
+
+def test_transfer_to_a_user_blocked_after_being_cached_fails(session, make_account, fake_cache):
+    origin = make_account(total="100")
+    destination = make_account()
+    # the cache still says ACTIVE: the user was blocked without going through the repositories
+    assert account_metadata_service.users_status([destination.user_id]) == {str(destination.user_id): UserStatus.ACTIVE}
+    session.execute(update(User).where(User.id == destination.user_id).values(status=UserStatus.BLOCKED))
+    session.commit()
+    create_transaction(session, OperationType.TRANSFER, origin, destination, "10")
+
+    assert execute_transactions() == {"total": 1, "success": 0, "failed": 1, "deferred": 0}
+    assert total_of(session, origin) == Decimal("100")
+
+
+def test_transactions_on_the_same_account_see_each_other(session, make_account):
+    account = make_account(total="0")
+    create_transaction(session, OperationType.DEPOSIT, account, account, "50")
+    create_transaction(session, OperationType.WITHDRAWAL, account, account, "20")
+    failed_id = create_transaction(session, OperationType.WITHDRAWAL, account, account, "40")
+    create_transaction(session, OperationType.DEPOSIT, account, account, "30")
+
+    assert execute_transactions() == {"total": 4, "success": 3, "failed": 1, "deferred": 0}
+    assert status_of(session, failed_id) == OperationStatus.FAILED
+    assert total_of(session, account) == Decimal("60")
+
+    snapshot = session.execute(
+        select(AccountBalanceSnapshot).where(AccountBalanceSnapshot.account_id == account.id)
+    ).scalar_one()
+    assert (snapshot.opening_total, snapshot.closing_total) == (Decimal("0"), Decimal("60"))
+    assert (snapshot.credits, snapshot.debits, snapshot.movements) == (Decimal("80"), Decimal("20"), 3)
+
+
+def test_claimed_transactions_come_in_creation_order(session, make_account):
+    account = make_account(total="0")
+    created_at = datetime(2024, 1, 1)
+    rows = [
+        dict(
+            id=str(uuid4()), linked_transaction_id=str(uuid4()), amount=Decimal(1), operation=OperationType.DEPOSIT,
+            operation_status=OperationStatus.CREATED, origin_account_id=account.id, destination_account_id=account.id,
+            currency_name=account.currency_name, user_id=account.user_id, is_deleted=False,
+            created_at=created_at + timedelta(seconds=index), last_updated=created_at + timedelta(seconds=index),
+        )
+        for index in range(2000)
+    ]
+    # stored out of order, the claim returns them in whatever order postgres updated them
+    random.shuffle(rows)
+    session.execute(insert(Transaction.__table__), rows)
+    session.commit()
+
+    claimed = search_transaction_created(limit=500)
+    assert [transaction.created_at for transaction in claimed] == [
+        created_at + timedelta(seconds=index) for index in range(500)
+    ]
+
+
+def test_parallel_batches_over_the_same_accounts(session, make_account):
+    first = make_account(total="1000")
+    second = make_account(total="1000")
+    for _ in range(20):
+        create_transaction(session, OperationType.TRANSFER, first, second, "10")
+        create_transaction(session, OperationType.TRANSFER, second, first, "5")
+
+    results = []
+    errors = []
+
+    def settle():
+        # every worker has its own session, accounts are locked in id order so they never deadlock
+        with app.app_context():
+            try:
+                while True:
+                    result = execute_transactions(batch_size=3)
+                    if result["total"] == 0:
+                        return
+                    results.append(result)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    workers = [threading.Thread(target=settle) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert sum(result["success"] for result in results) == 40
+    assert total_of(session, first) == Decimal("900")
+    assert total_of(session, second) == Decimal("1100")
+
+
+def test_accounts_are_locked_in_id_order(session, make_account, statements):
+    accounts = [make_account(total="100") for _ in range(4)]
+    # the transactions reference the accounts in the reverse of the lock order
+    ordered = sorted(accounts, key=lambda account: str(account.id), reverse=True)
+    for origin, destination in zip(ordered, ordered[1:]):
+        create_transaction(session, OperationType.TRANSFER, origin, destination, "1")
+    statements.clear()
+
+    assert execute_transactions()["success"] == 3
+    locks = [statement for statement in statements if statement.startswith("SELECT") and "FOR UPDATE" in statement]
+    assert len(locks) == 1
+    assert "FROM accounts" in locks[0] and "ORDER BY accounts.id" in locks[0]
+
+
+def test_account_totals_are_written_once_per_batch(session, make_account, statements):
+    first = make_account(total="0")
+    second = make_account(total="0")
+    for _ in range(10):
+        create_transaction(session, OperationType.DEPOSIT, first, first, "1")
+        create_transaction(session, OperationType.DEPOSIT, second, second, "2")
+    statements.clear()
+
+    assert execute_transactions(batch_size=20)["success"] == 20
+    # a single UPDATE accounts ... FROM (VALUES ...) whatever the number of transactions per account
+    account_updates = [statement for statement in statements if statement.startswith("UPDATE accounts")]
+    assert len(account_updates) == 1
+    assert "FROM (VALUES" in account_updates[0]
+    assert (total_of(session, first), total_of(session, second)) == (Decimal("10"), Decimal("20"))
+
+
+def test_amounts_are_exact_decimals(session, make_account):
+    account = make_account(total="0")
+    for _ in range(10):
+        create_transaction(session, OperationType.DEPOSIT, account, account, "0.1")
+    create_transaction(session, OperationType.WITHDRAWAL, account, account, "0.3")
+    create_transaction(session, OperationType.WITHDRAWAL, account, account, "0.7")
+
+    assert execute_transactions()["success"] == 12
+    # with floats, ten 0.1 deposits minus 0.3 and 0.7 leave a few units of the 17th decimal
+    assert total_of(session, account) == Decimal("0")
+
+
+def test_converted_amounts_round_half_even(session, make_account, monkeypatch):
+    monkeypatch.setitem(RATES, ("USD", "EUR"), 0.5)
+    origin = make_account(currency_name="USD", total="100")
+    destination = make_account(currency_name="EUR", total="0")
+    # 0.00005 EUR and 0.00015 EUR, halves rounded to the even 4th decimal: 0.0000 and 0.0002
+    create_transaction(session, OperationType.TRANSFER, origin, destination, "0.0001")
+    create_transaction(session, OperationType.TRANSFER, origin, destination, "0.0003")
+
+    assert execute_transactions()["success"] == 2
+    assert total_of(session, destination) == Decimal("0.0002")
@@ -0,0 +1,167 @@
+from typing import Dict, List
+from uuid import uuid4
+
+import pytest
+import redis
+
+from application.services import transaction_event_service
+from application.services.transaction_event_service import TransactionEventService
+from application.tasks import settlement_workers
+from application.tasks.settlement_workers import consume_transaction_events
+
+
+class FakeEventService:
+    """
+    Stand-in of TransactionEventService: `batches` are read in turn (exceptions are raised), then nothing.
+    """
+
+    def __init__(self, *batches, deliveries: Dict[str, int] = None):
+        self.batches = list(batches)
+        self.delivered = deliveries or {}
+        self.acked: List[str] = []
+        self.dead: Dict[str, str] = {}
+
+    def ensure_group(self):
+        pass
+
+    def read(self, consumer: str, count: int) -> Dict[str, str]:
+        batch = self.batches.pop(0) if self.batches else {}
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def ack(self, event_ids: List[str]):
+        self.acked.extend(event_ids)
+
+    def deliveries(self, event_ids: List[str]) -> Dict[str, int]:
+        return {event_id: self.delivered.get(event_id, 1) for event_id in event_ids}
+
+    def dead_letter(self, events: Dict[str, str]):
+        self.dead.update(events)
+        self.ack(list(events))
+
+
+class Stop(BaseException):
+    # not an Exception, the consumer logs and retries those
+    pass
+
+
+@pytest.fixture
+def settled(monkeypatch) -> List[List[str]]:
+    """
+    Transaction ids of every batch settled, a batch holding "poison" raises.
+    """
+    batches = []
+
+    def settle_events(events):
+        transaction_ids = list(events.values())
+        if "poison" in transaction_ids:
+            raise RuntimeError("cannot settle")
+        batches.append(transaction_ids)
+
+    monkeypatch.setattr(settlement_workers, "_settle_events", settle_events)
+    return batches
+
+
+def consume(monkeypatch, event_service: FakeEventService, sleeps: int = 1) -> List[float]:
+    """
+    Runs the consumer until it sleeps `sleeps` times (it only sleeps to back off, or when it has read everything).
+    """
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        if len(slept) >= sleeps:
+            raise Stop()
+
+    def read(consumer, count):
+        if not event_service.batches:
+            sleep(0)
+        return FakeEventService.read(event_service, consumer, count)
+
+    monkeypatch.setattr(event_service, "read", read)
+    monkeypatch.setattr(settlement_workers, "TransactionEventService", lambda: event_service)
+    monkeypatch.setattr(settlement_workers.time, "sleep", sleep)
+    with pytest.raises(Stop):
+        consume_transaction_events(consumer="test", poll_interval=1)
+    return slept[:-1]
+
+
+def test_events_are_acked_once_settled(monkeypatch, settled):
+    event_service = FakeEventService({"1-0": "a", "2-0": "b"})
+
+    consume(monkeypatch, event_service)
+
+    assert settled == [["a", "b"]]
+    assert event_service.acked == ["1-0", "2-0"]
+
+
+def test_a_failed_batch_is_settled_one_by_one(monkeypatch, settled):
+    event_service = FakeEventService({"1-0": "a", "2-0": "poison", "3-0": "c"})
+
+    consume(monkeypatch, event_service)
+
+    assert settled == [["a"], ["c"]]
+    # the failing event stays pending, redelivered later
+    assert event_service.acked == ["1-0", "3-0"]
+    assert event_service.dead == {}
+
+
+def test_events_failing_too_often_are_dead_lettered(monkeypatch, settled):
+    max_deliveries = settlement_workers.SETTLEMENT_STREAM_MAX_DELIVERIES
+    event_service = FakeEventService({"1-0": "poison", "2-0": "b"}, deliveries={"1-0": max_deliveries})
+
+    consume(monkeypatch, event_service)
+
+    assert event_service.dead == {"1-0": "poison"}
+    assert sorted(event_service.acked) == ["1-0", "2-0"]
+
+
+def test_consumer_backs_off_while_redis_is_down(monkeypatch, settled):
+    error = redis.ConnectionError("Connection refused")
+    event_service = FakeEventService(error, error, error, {"1-0": "a"}, error)
+
+    slept = consume(monkeypatch, event_service, sleeps=5)
+
+    # doubles while failing, starts over after events went through
+    assert slept == [1, 2, 4, 1]
+    assert event_service.acked == ["1-0"]
+
+
+@pytest.fixture
+def stream(monkeypatch) -> TransactionEventService:
+    """
+    TransactionEventService over streams of its own in the redis of the settings.
+    """
+    names = {
+        "SETTLEMENT_STREAM": "test:{}".format(uuid4()),
+        "SETTLEMENT_DEAD_LETTER_STREAM": "test:{}:dead".format(uuid4()),
+    }
+    for name, value in names.items():
+        monkeypatch.setattr(transaction_event_service, name, value)
+    service = TransactionEventService()
+    try:
+        service.ensure_group()
+    except redis.ConnectionError:
+        pytest.skip("redis is not reachable, run the tests with `docker compose run tests`")
+    yield service
+    service.cache.delete_many(list(names.values()))
+
+
+def test_deliveries_and_dead_letter_stream(stream):
+    stream.publish_created(["a", "b"])
+    first = stream.read(consumer="first", count=10, block=100)
+    stream.ack([event_id for event_id, transaction_id in first.items() if transaction_id == "a"])
+    poison = next(event_id for event_id, transaction_id in first.items() if transaction_id == "b")
+    # delivered a second time, to another consumer
+    stream.cache.redis.xclaim(
+        transaction_event_service.SETTLEMENT_STREAM, transaction_event_service.SETTLEMENT_STREAM_GROUP, "second",
+        min_idle_time=0, message_ids=[poison],
+    )
+
+    assert stream.deliveries(list(first)) == {poison: 2}
+
+    stream.dead_letter({poison: "b"})
+    assert stream.deliveries([poison]) == {}
+    dead = stream.cache.redis.xrange(transaction_event_service.SETTLEMENT_DEAD_LETTER_STREAM)
+    assert [fields for _, fields in dead] == [{"event_id": poison, "id": "b"}]
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from application.tasks import settlement_workers
+from application.tasks.settlement_workers import drain_transactions
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(settlement_workers.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def batches(monkeypatch, *results):
+    results = list(results)
+
+    def execute_transactions(batch_size):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(settlement_workers, "execute_transactions", execute_transactions)
+
+
+def test_drain_retries_failed_batches_with_backoff(monkeypatch, sleeps):
+    error = OperationalError("SELECT 1", {}, Exception("server closed the connection"))
+    batches(
+        monkeypatch,
+        error,
+        error,
+        {"total": 2, "success": 2, "failed": 0, "deferred": 0},
+        error,
+        {"total": 0, "success": 0, "failed": 0, "deferred": 0},
+    )
+
+    data = drain_transactions(poll_interval=1, drain=True, retry_errors=True)
+
+    assert data == {"total": 2, "success": 2, "failed": 0, "deferred": 0}
+    # doubles while failing, starts over after a batch went through
+    assert sleeps == [1, 2, 1]
+
+
+def test_drain_raises_without_retry(monkeypatch, sleeps):
+    batches(monkeypatch, RuntimeError("boom"))
+
+    with pytest.raises(RuntimeError):
+        drain_transactions(drain=True)
@@ -0,0 +1,197 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import select, update
+
+from app import app
+from application.models import Transaction, OperationType
+from application.views import transactions_view
+
+
+@pytest.fixture
+def movements(session, make_account):
+    """
+    One deposit for each of two users.
+    """
+    accounts = [make_account(), make_account()]
+    for account in accounts:
+        session.add(Transaction(
+            linked_transaction_id=str(uuid4()), amount=Decimal("10"), operation=OperationType.DEPOSIT,
+            origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+            user_id=account.user_id,
+        ))
+    session.commit()
+    return [str(account.user_id) for account in accounts]
+
+
+def user_ids_of(response) -> set:
+    return {transaction["user_id"] for transaction in response.get_json()["data"]}
+
+
+def test_movements_default_to_the_caller(movements, login):
+    owner, _ = movements
+    response = app.test_client().get("/movements/?currency_name=USD", headers=login(owner))
+
+    assert response.status_code == 200
+    assert user_ids_of(response) == {owner}
+
+
+def test_movements_of_another_user_are_forbidden(movements, login):
+    owner, other = movements
+    client = app.test_client()
+
+    assert client.get(f"/movements/?currency_name=USD&user_id={other}", headers=login(owner)).status_code == 403
+    response = client.get(f"/movements/export/?currency_name=USD&user_id={other}", headers=login(owner))
+    assert response.status_code == 403
+
+
+def test_export_defaults_to_the_caller(movements, login):
+    owner, other = movements
+    response = app.test_client().get("/movements/export/?currency_name=USD", headers=login(owner))
+
+    assert response.status_code == 200
+    assert owner in response.get_data(as_text=True)
+    assert other not in response.get_data(as_text=True)
+
+
+def test_admins_read_any_user(movements, login):
+    owner, other = movements
+    client = app.test_client()
+    headers = login(owner, profile="admin")
+
+    response = client.get(f"/movements/?currency_name=USD&user_id={other}", headers=headers)
+    assert response.status_code == 200
+    assert user_ids_of(response) == {other}
+    assert user_ids_of(client.get("/movements/?currency_name=USD", headers=headers)) == {owner, other}
+
+
+def test_amounts_are_loaded_exactly(session, make_account, login):
+    account = make_account()
+    # a float rounds it to 12345678901234.568
+    body = (
+        '{{"amount": 12345678901234.5678, "operation": "Deposit", "origin_account_id": "{id}", '
+        '"destination_account_id": "{id}", "user_id": "{user_id}", "currency_name": "USD"}}'
+    ).format(id=account.id, user_id=account.user_id)
+
+    response = app.test_client().post(
+        "/transaction/", data=body, content_type="application/json", headers=login(account.user_id),
+    )
+
+    assert response.status_code == 200
+    # dumped as a float, as before
+    assert response.get_json()["data"]["amount"] == 12345678901234.5678
+    stored = session.execute(select(Transaction.amount).where(Transaction.id == response.get_json()["data"]["id"]))
+    assert stored.scalar() == Decimal("12345678901234.5678")
+
+
+def deposit_of(account, amount=10) -> dict:
+    return {
+        "amount": amount, "operation": "Deposit", "origin_account_id": str(account.id),
+        "destination_account_id": str(account.id), "user_id": str(account.user_id), "currency_name": "USD",
+    }
+
+
+def stored_amounts(session) -> list:
+    return sorted(session.execute(select(Transaction.amount)).scalars())
+
+
+def test_bulk_reports_every_item_by_index(session, make_account, login):
+    account = make_account()
+    items = [deposit_of(account, 10), {"amount": -1}, deposit_of(account, 20)]
+
+    response = app.test_client().post("/transaction/bulk/", json=items, headers=login(account.user_id))
+
+    assert response.status_code == 200
+    results = response.get_json()["data"]
+    assert [(result["index"], result["status"]) for result in results] == [
+        (0, "success"), (1, "failure"), (2, "success"),
+    ]
+    assert "amount" in results[1]["errors"]
+    assert stored_amounts(session) == [Decimal("10"), Decimal("20")]
+
+
+def test_bulk_accepts_ndjson(session, make_account, login):
+    account = make_account()
+    body = "\n".join([json.dumps(deposit_of(account, 10)), "not json", json.dumps(deposit_of(account, 20)), ""])
+
+    response = app.test_client().post(
+        "/transaction/bulk/", data=body, content_type="application/x-ndjson", headers=login(account.user_id),
+    )
+
+    assert [result["status"] for result in response.get_json()["data"]] == ["success", "failure", "success"]
+    assert stored_amounts(session) == [Decimal("10"), Decimal("20")]
+
+
+def test_bulk_rejects_too_many_items(session, make_account, login, monkeypatch):
+    account = make_account()
+    monkeypatch.setattr(transactions_view, "BULK_TRANSACTIONS_MAX", 2)
+
+    response = app.test_client().post(
+        "/transaction/bulk/", json=[deposit_of(account)] * 3, headers=login(account.user_id),
+    )
+
+    assert response.status_code == 413
+    assert stored_amounts(session) == []
+
+
+def test_bulk_checks_the_ownership_of_every_item(session, make_account, login):
+    own = make_account()
+    other = make_account()
+    items = [deposit_of(own), deposit_of(other), {**deposit_of(own), "user_id": str(other.user_id)}]
+
+    response = app.test_client().post("/transaction/bulk/", json=items, headers=login(own.user_id))
+
+    results = response.get_json()["data"]
+    assert [result["status"] for result in results] == ["success", "failure", "failure"]
+    assert results[1]["errors"] == {"origin_account_id": [transactions_view.NOT_OWNER]}
+    assert results[2]["errors"] == {"origin_account_id": [transactions_view.NOT_OWNER]}
+    assert stored_amounts(session) == [Decimal("10")]
+
+
+def movements_pages(client, headers, limit: int) -> list:
+    pages = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(f"/movements/?currency_name=USD&limit={limit}&cursor={cursor}", headers=headers)
+        pages.append([transaction["id"] for transaction in response.get_json()["data"]])
+        cursor = response.get_json()["next_cursor"]
+    return pages
+
+
+def test_cursor_pages_through_rows_updated_at_the_same_time(session, make_account, login):
+    account = make_account()
+    for amount in range(5):
+        session.add(Transaction(
+            linked_transaction_id=str(uuid4()), amount=Decimal(amount), operation=OperationType.DEPOSIT,
+            origin_account_id=account.id, destination_account_id=account.id, currency_name=account.currency_name,
+            user_id=account.user_id,
+        ))
+        session.commit()
+    # only the primary key tells them apart
+    session.execute(update(Transaction).values(last_updated=datetime(2024, 5, 1)))
+    session.commit()
+
+    pages = movements_pages(app.test_client(), login(account.user_id), limit=2)
+
+    # the last page is short, it has no next cursor
+    assert [len(page) for page in pages] == [2, 2, 1]
+    ids = [transaction_id for page in pages for transaction_id in page]
+    assert sorted(ids) == sorted(str(transaction_id) for transaction_id in session.execute(select(Transaction.id)).scalars())
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    base64.urlsafe_b64encode(b'{"last_updated": 1}').decode(),
+    base64.urlsafe_b64encode(b'["yesterday", "c0ffee00-0000-0000-0000-000000000000"]').decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01T00:00:00", "not-a-uuid"]').decode(),
+])
+def test_malformed_cursors_are_rejected(session, make_account, login, cursor):
+    account = make_account()
+
+    response = app.test_client().get(f"/movements/?currency_name=USD&cursor={cursor}", headers=login(account.user_id))
+
+    assert response.status_code == 400
@@ -0,0 +1,28 @@
+from sqlalchemy import select
+
+from app import app
+from application.models import User
+
+
+def test_users_only_change_themselves(session, make_account, login):
+    caller = make_account().user_id
+    other = make_account().user_id
+    client = app.test_client()
+    headers = login(caller)
+
+    assert client.patch(f"/user/{other}", json={"name": "renamed"}, headers=headers).status_code == 403
+    assert client.delete(f"/user/{other}", headers=headers).status_code == 403
+    assert session.execute(select(User.name, User.is_deleted).where(User.id == other)).one() == ("user", False)
+
+    assert client.patch(f"/user/{caller}", json={"name": "renamed"}, headers=headers).status_code == 200
+    assert session.execute(select(User.name).where(User.id == caller)).scalar() == "renamed"
+
+
+def test_admins_change_anyone(session, make_account, login):
+    admin = make_account().user_id
+    other = make_account().user_id
+
+    response = app.test_client().delete(f"/user/{other}", headers=login(admin, profile="admin"))
+
+    assert response.status_code == 204
+    assert session.execute(select(User.is_deleted).where(User.id == other)).scalar() is True
@@ -0,0 +1,33 @@
+from uuid import uuid4
+
+from sqlalchemy import select
+
+from app import db
+from application.models import Currency, User, UserStatus
+from application.tasks.user_tasks import validate_users_created
+
+
+def create_user(session, name: str) -> str:
+    user = User(email="{}@example.com".format(uuid4()), name=name, password="password", status=UserStatus.CREATED)
+    session.add(user)
+    session.commit()
+    return user.id
+
+
+def test_a_failing_validator_only_rejects_its_record(session):
+    accepted_id = create_user(session, "accepted")
+    rejected_id = create_user(session, "rejected")
+    failing_id = create_user(session, "failing")
+
+    def validator(user: User) -> bool:
+        # what the validator writes is kept, unless it raises
+        db.session.add(Currency(name=user.name[:3].upper()))
+        db.session.flush()
+        if user.name == "failing":
+            raise RuntimeError("validation service down")
+        return user.name == "accepted"
+
+    assert validate_users_created(validator=validator) == {"total": 3, "active": 1, "rejected": 2, "errors": 1}
+    statuses = dict(session.execute(select(User.id, User.status)).all())
+    assert statuses == {accepted_id: UserStatus.ACTIVE, rejected_id: UserStatus.BLOCKED, failing_id: UserStatus.BLOCKED}
+    assert set(session.execute(select(Currency.name)).scalars()) == {"ACC", "REJ"}